@@ -0,0 +1,488 @@
+"""
+An application level cache for API responses and other derived data
+
+Cached values live in a backend, chosen when the app is created:
+
+- "lru": an in-process LRU, the default outside of uwsgi. Each process has its
+  own copy, so it's only suitable for a single process.
+- "uwsgi": a uwsgi cache2 shared memory cache, the default under uwsgi, which
+  is shared by every worker on the host.
+- "redis": a Redis compatible server, shared by every host. This needs the
+  redis package, which isn't installed by default.
+
+Keys are grouped into namespaces, such as the scores of each contest or the
+runs of each user. Clearing a namespace swaps its version token, so it's a
+single write no matter how many keys the namespace has, and the old entries
+age out of the backend.
+
+Invalidating a single key swaps the key's generation token instead of
+deleting its value, which marks the value as stale. The version and
+generation tokens are kept apart from the values, so evicting values when the
+cache is full never evicts the tokens that other values and the processes'
+own copies of cached data are checked against. When a value is missing
+or stale, get_or_compute lets a single caller recompute it while holding a
+lock in the backend, and the other callers either serve the stale value or
+wait for the recomputed one. This stops every worker rebuilding the same
+value at once when a popular key is invalidated. Values can also have a soft
+ttl, after which they're stale and revalidated the same way.
+"""
+
+import collections
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+KEY_PREFIX = "code_court"
+
+LRU_MAX_ITEMS = 5000
+LRU_MAX_TOKENS = 20000
+UWSGI_CACHE_NAME = "appcache"
+UWSGI_TOKEN_CACHE_NAME = "tokencache"
+
+# a recompute that takes longer than this lets another caller start one
+LOCK_TIMEOUT_SECONDS = 30
+# the longest a caller waits for another caller's recompute before doing its own
+LOCK_WAIT_SECONDS = 5
+LOCK_POLL_INTERVAL_SECONDS = 0.02
+
+
+class CacheBackendException(Exception):
+    pass
+
+
+class LRUBackend:
+    """An in-process cache that evicts the least recently used keys"""
+
+    def __init__(self, max_items=LRU_MAX_ITEMS):
+        self.max_items = max_items
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+
+            value, expires = item
+            if expires is not None and expires <= time.time():
+                del self.items[key]
+                return None
+
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self._set(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        """Sets a key only if it isn't already set, returning whether it was"""
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and (item[1] is None or item[1] > time.time()):
+                return False
+
+            self._set(key, value, ttl)
+            return True
+
+    def _set(self, key, value, ttl):
+        """Sets a key, self.lock must be held"""
+        self.items[key] = (value, time.time() + ttl if ttl else None)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class UwsgiBackend:
+    """A uwsgi cache2 cache, shared between the workers of a uwsgi instance"""
+
+    def __init__(self, cache_name=UWSGI_CACHE_NAME):
+        if uwsgi is None:
+            raise CacheBackendException("The uwsgi cache backend must run under uwsgi")
+        self.cache_name = cache_name
+
+    def get(self, key):
+        return uwsgi.cache_get(key, self.cache_name)
+
+    def set(self, key, value, ttl=None):
+        uwsgi.cache_update(key, value, int(ttl or 0), self.cache_name)
+
+    def add(self, key, value, ttl=None):
+        # cache_set fails if the key exists
+        return bool(uwsgi.cache_set(key, value, int(ttl or 0), self.cache_name))
+
+    def delete(self, key):
+        uwsgi.cache_del(key, self.cache_name)
+
+    def clear(self):
+        uwsgi.cache_clear(self.cache_name)
+
+
+class RedisBackend:
+    """A cache stored in a Redis compatible server"""
+
+    def __init__(self, url):
+        if redis is None:
+            raise CacheBackendException(
+                "The redis cache backend needs the redis package installed"
+            )
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, value, ex=int(ttl) if ttl else None, nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match="{}:*".format(KEY_PREFIX)))
+        if keys:
+            self.client.delete(*keys)
+
+
+_backend = LRUBackend()
+# holds the version and generation tokens
+_token_backend = LRUBackend(LRU_MAX_TOKENS)
+_default_ttl = None
+_single_flight = True
+_stats = collections.defaultdict(collections.Counter)
+_stats_lock = threading.Lock()
+
+
+def init_app(app):
+    """
+    Sets up the cache backend from the app's config
+
+    The backend is picked with CACHE_BACKEND, which is one of "lru", "uwsgi"
+    and "redis". CACHE_REDIS_URL is the redis server to use, and
+    CACHE_DEFAULT_TTL is the number of seconds values are kept for when the
+    caller doesn't give a ttl, None keeps them until they're invalidated.
+    CACHE_SINGLE_FLIGHT can be set to False to let every caller compute
+    missing values at once.
+
+    The lru and uwsgi backends keep tokens in a cache of their own, see
+    uwsgi.ini for the uwsgi caches. Redis keeps them with the values, so it
+    should be configured to evict only keys with a ttl.
+
+    Params:
+        app (Flask): the flask app
+    """
+    global _backend, _token_backend, _default_ttl, _single_flight
+
+    backend_name = app.config.get("CACHE_BACKEND") or ("uwsgi" if uwsgi else "lru")
+    if backend_name == "lru":
+        _backend = LRUBackend(app.config.get("CACHE_LRU_MAX_ITEMS", LRU_MAX_ITEMS))
+        _token_backend = LRUBackend(
+            app.config.get("CACHE_LRU_MAX_TOKENS", LRU_MAX_TOKENS)
+        )
+    elif backend_name == "uwsgi":
+        _backend = UwsgiBackend()
+        _token_backend = UwsgiBackend(UWSGI_TOKEN_CACHE_NAME)
+    elif backend_name == "redis":
+        _backend = _token_backend = RedisBackend(app.config["CACHE_REDIS_URL"])
+    else:
+        raise CacheBackendException("Unknown cache backend: {}".format(backend_name))
+
+    _default_ttl = app.config.get("CACHE_DEFAULT_TTL")
+    _single_flight = app.config.get("CACHE_SINGLE_FLIGHT", True)
+
+
+def get(namespace, key):
+    """
+    Gets a cached value
+
+    Params:
+        namespace (str): the key's namespace
+        key: the key within the namespace
+
+    Returns:
+        the cached value, or None if it isn't cached or is stale
+    """
+    cache_key = _make_key(namespace, key)
+    entry = _load(cache_key)
+    if entry is None or not _is_fresh(entry, _get_generation(cache_key)):
+        _count(namespace, "misses")
+        return None
+
+    _count(namespace, "hits")
+    return entry[0]
+
+
+def set(namespace, key, value, ttl=None, soft_ttl=None):
+    """
+    Caches a value
+
+    Params:
+        namespace (str): the key's namespace
+        key: the key within the namespace
+        value: the value to cache, it must be picklable
+        ttl (int): the number of seconds to cache the value for, defaults to
+            CACHE_DEFAULT_TTL
+        soft_ttl (int): the number of seconds until the value is stale
+    """
+    cache_key = _make_key(namespace, key)
+    _store(cache_key, value, ttl, soft_ttl, _get_generation(cache_key))
+
+
+def get_or_compute(
+    namespace,
+    key,
+    compute,
+    ttl=None,
+    soft_ttl=None,
+    serve_stale=False,
+    is_cacheable=None,
+):
+    """
+    Gets a cached value, computing and caching it if it's missing or stale.
+    Only one caller at a time computes a value, the others serve the stale
+    value if serve_stale is set or otherwise wait for the computed value.
+
+    Params:
+        namespace (str): the key's namespace
+        key: the key within the namespace
+        compute (function): takes no arguments and returns the value
+        ttl (int): the number of seconds to cache the value for, defaults to
+            CACHE_DEFAULT_TTL
+        soft_ttl (int): the number of seconds until the value is stale
+        serve_stale (bool): whether stale values can be returned while another
+            caller computes the new value
+        is_cacheable (function): takes a computed value and returns whether
+            it should be cached, all values are cached if this is None
+
+    Returns:
+        the cached or computed value
+    """
+    cache_key = _make_key(namespace, key)
+    lock_key = cache_key + ":lock"
+    deadline = time.time() + LOCK_WAIT_SECONDS
+
+    while True:
+        generation = _get_generation(cache_key)
+        entry = _load(cache_key)
+        if entry is not None and _is_fresh(entry, generation):
+            _count(namespace, "hits")
+            return entry[0]
+
+        if not _single_flight or _backend.add(lock_key, b"1", LOCK_TIMEOUT_SECONDS):
+            break
+
+        if entry is not None and serve_stale:
+            _count(namespace, "stale")
+            return entry[0]
+
+        if time.time() >= deadline:
+            # the caller holding the lock is taking too long, so compute the
+            # value without it
+            lock_key = None
+            break
+
+        # wait for the caller holding the lock to finish
+        _count(namespace, "waits")
+        while _backend.get(lock_key) is not None and time.time() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL_SECONDS)
+
+    _count(namespace, "misses")
+    try:
+        value = compute()
+        if is_cacheable is None or is_cacheable(value):
+            # the generation was read before computing, so if the key was
+            # invalidated while computing the stored value is already stale
+            _store(cache_key, value, ttl, soft_ttl, generation)
+        return value
+    finally:
+        if _single_flight and lock_key is not None:
+            _backend.delete(lock_key)
+
+
+def invalidate(namespace, key):
+    """Marks a cached value as stale"""
+    cache_key = _make_key(namespace, key)
+    _token_backend.set(_generation_key(cache_key), uuid.uuid4().hex.encode())
+
+
+def clear(namespace):
+    """Deletes every cached value in a namespace"""
+    _token_backend.set(_version_key(namespace), uuid.uuid4().hex.encode())
+
+
+def get_version(namespace):
+    """
+    Gets a namespace's version token, which changes whenever the namespace is
+    cleared. Processes can compare it with the version of their own copies of
+    a namespace's data to tell when to reload them.
+
+    Returns:
+        str: the version token
+    """
+    return _get_version(namespace)
+
+
+def clear_all():
+    """Deletes every cached value"""
+    _backend.clear()
+    if _token_backend is not _backend:
+        _token_backend.clear()
+
+
+def get_stats():
+    """
+    Gets this process's counts of hits, misses, stale values served and waits
+    for other callers' computes
+
+    Returns:
+        dict: the counts of each namespace
+    """
+    with _stats_lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+
+def reset_stats():
+    """Resets this process's counts"""
+    with _stats_lock:
+        _stats.clear()
+
+
+def cached_response(namespace, key, ttl=None, soft_ttl=None, serve_stale=False):
+    """
+    Caches a view's successful responses with get_or_compute. Responses have
+    an ETag, so clients that send a matching If-None-Match get a 304.
+
+    Note:
+        this should be applied after any auth decorators, so requests are
+        still authenticated when the response is cached
+
+    Params:
+        namespace (str): the namespace to cache responses in
+        key (function): takes the view's arguments and returns the cache key
+        ttl (int): the number of seconds to cache responses for
+        soft_ttl (int): the number of seconds until responses are stale
+        serve_stale (bool): whether stale responses can be served while
+            another request builds the new response
+
+    Returns:
+        a decorator for the view
+    """
+
+    def wrapper(fn):
+        @wraps(fn)
+        def decorated_view(*args, **kwargs):
+            def build_response():
+                resp = make_response(fn(*args, **kwargs))
+                data = resp.get_data()
+                etag = hashlib.sha1(data).hexdigest()
+                return (data, resp.status_code, resp.mimetype, etag)
+
+            data, status, mimetype, etag = get_or_compute(
+                namespace,
+                key(*args, **kwargs),
+                build_response,
+                ttl=ttl,
+                soft_ttl=soft_ttl,
+                serve_stale=serve_stale,
+                is_cacheable=lambda x: x[1] == 200,
+            )
+            resp = current_app.response_class(data, status=status, mimetype=mimetype)
+            resp.set_etag(etag)
+            return resp.make_conditional(request)
+
+        return decorated_view
+
+    return wrapper
+
+
+def _load(cache_key):
+    """Loads a (value, soft expiry time, generation) entry"""
+    data = _backend.get(cache_key)
+    if data is None:
+        return None
+
+    return pickle.loads(data)
+
+
+def _store(cache_key, value, ttl, soft_ttl, generation):
+    soft_expires = time.time() + soft_ttl if soft_ttl else None
+    _backend.set(
+        cache_key,
+        pickle.dumps((value, soft_expires, generation)),
+        ttl if ttl is not None else _default_ttl,
+    )
+
+
+def _is_fresh(entry, generation):
+    value, soft_expires, entry_generation = entry
+    if entry_generation != generation:
+        return False
+
+    return soft_expires is None or soft_expires > time.time()
+
+
+def _make_key(namespace, key):
+    return "{}:{}:{}:{}".format(KEY_PREFIX, namespace, _get_version(namespace), key)
+
+
+def _version_key(namespace):
+    return "{}:{}:version".format(KEY_PREFIX, namespace)
+
+
+def _generation_key(cache_key):
+    return cache_key + ":generation"
+
+
+def _get_version(namespace):
+    """Gets a namespace's version token, creating it if it doesn't exist"""
+    return _get_token(_version_key(namespace))
+
+
+def _get_generation(cache_key):
+    """Gets a key's generation token, creating it if it doesn't exist"""
+    return _get_token(_generation_key(cache_key))
+
+
+def _get_token(token_key):
+    """
+    Gets a token that's swapped to invalidate values. If the token has been
+    evicted a new one is created, which invalidates the values that used it.
+    """
+    token = _token_backend.get(token_key)
+    if token is None:
+        token = uuid.uuid4().hex.encode()
+        if not _token_backend.add(token_key, token):
+            token = _token_backend.get(token_key) or token
+    return token.decode()
+
+
+def _count(namespace, counter):
+    with _stats_lock:
+        _stats[namespace][counter] += 1
@@ -1,28 +1,224 @@
+"""
+The database engine and session
+
+The engine's connection pool is configured with these environment variables,
+sqlite only uses the recycle and pre-ping settings:
+
+- CODE_COURT_DB_POOL_SIZE: the connections each process keeps open (5)
+- CODE_COURT_DB_MAX_OVERFLOW: the extra connections each process can open when
+  every pooled connection is in use (10)
+- CODE_COURT_DB_POOL_TIMEOUT: the seconds to wait for a connection when the
+  pool and overflow are in use, before failing the request (30)
+- CODE_COURT_DB_POOL_RECYCLE: the age in seconds after which connections are
+  replaced, or -1 to keep them (-1)
+- CODE_COURT_DB_POOL_PRE_PING: whether to check connections are alive before
+  using them (false)
+
+Every uwsgi worker has its own pool, so the database needs to accept the
+number of workers times the pool size and overflow. The pools' checkout waits
+and usage are shown by /admin/utils/metrics/.
+"""
 import os
 import threading
+import time
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import Pool, QueuePool
 
 db_uri = os.getenv("CODE_COURT_DB_URI") or "sqlite:////tmp/code_court.db"
-engine = create_engine(db_uri, convert_unicode=True)
 
-try:
-    import uwsgi
 
-    scopefunc = uwsgi.worker_id
-except ImportError:
-    scopefunc = threading.get_ident
+class MeteredQueuePool(QueuePool):
+    """A QueuePool that records how long checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics_lock = threading.Lock()
+        self.reset_metrics()
+
+    def connect(self):
+        return self._timed_checkout(super().connect)
+
+    def unique_connection(self):
+        # engines check out connections with this
+        return self._timed_checkout(super().unique_connection)
+
+    def recreate(self):
+        # keeps the metrics when the engine is disposed
+        pool = super().recreate()
+        pool.metrics_lock = self.metrics_lock
+        pool.metrics = self.metrics
+        return pool
+
+    def reset_metrics(self):
+        with self.metrics_lock:
+            self.metrics = {
+                "checkouts": 0,
+                "timeouts": 0,
+                "total_wait_seconds": 0.0,
+                "max_wait_seconds": 0.0,
+                "max_checked_out": 0,
+            }
+
+    def get_metrics(self):
+        """
+        Gets the pool's current usage and its checkout counts since the metrics
+        were last reset
+
+        Returns:
+            dict: the pool's metrics
+        """
+        with self.metrics_lock:
+            metrics = dict(self.metrics)
+
+        metrics.update(
+            {
+                "pool_size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                "overflow": max(self.overflow(), 0),
+                "mean_wait_seconds": (
+                    metrics["total_wait_seconds"] / metrics["checkouts"]
+                    if metrics["checkouts"]
+                    else 0.0
+                ),
+            }
+        )
+        return metrics
+
+    def _timed_checkout(self, checkout):
+        start = time.monotonic()
+        is_timeout = False
+        try:
+            return checkout()
+        except exc.TimeoutError:
+            is_timeout = True
+            raise
+        finally:
+            wait_seconds = time.monotonic() - start
+            with self.metrics_lock:
+                self.metrics["checkouts"] += 1
+                self.metrics["timeouts"] += int(is_timeout)
+                self.metrics["total_wait_seconds"] += wait_seconds
+                self.metrics["max_wait_seconds"] = max(
+                    self.metrics["max_wait_seconds"], wait_seconds
+                )
+                self.metrics["max_checked_out"] = max(
+                    self.metrics["max_checked_out"], self.checkedout()
+                )
+
+
+def get_pool_options(uri, env=os.environ):
+    """
+    Gets the engine's pool options from the environment
+
+    Params:
+        uri (str): the database uri
+        env (dict): the environment variables
+
+    Returns:
+        dict: keyword arguments for create_engine
+    """
+    options = {
+        "pool_recycle": int(env.get("CODE_COURT_DB_POOL_RECYCLE", -1)),
+        "pool_pre_ping": env.get("CODE_COURT_DB_POOL_PRE_PING", "false").lower()
+        in ("1", "true", "yes"),
+    }
+
+    # sqlite connections can't be shared between threads, so sqlite keeps its
+    # default pool
+    if make_url(uri).get_backend_name() != "sqlite":
+        options.update(
+            {
+                "poolclass": MeteredQueuePool,
+                "pool_size": int(env.get("CODE_COURT_DB_POOL_SIZE", 5)),
+                "max_overflow": int(env.get("CODE_COURT_DB_MAX_OVERFLOW", 10)),
+                "pool_timeout": int(env.get("CODE_COURT_DB_POOL_TIMEOUT", 30)),
+            }
+        )
 
+    return options
+
+
+engine = create_engine(db_uri, convert_unicode=True, **get_pool_options(db_uri))
+
+
+@event.listens_for(Pool, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+
+@event.listens_for(Pool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    # a connection opened before the process forked is shared with the parent,
+    # so it's dropped without being closed and the pool opens a new one
+    pid = os.getpid()
+    if connection_record.info["pid"] != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid {}, attempting to check out in "
+            "pid {}".format(connection_record.info["pid"], pid)
+        )
+
+
+def get_pool_metrics():
+    """
+    Gets this process's connection pool metrics
+
+    Returns:
+        dict: the pool's metrics, or only its status if the pool isn't metered
+    """
+    if isinstance(engine.pool, MeteredQueuePool):
+        return engine.pool.get_metrics()
+    return {"status": engine.pool.status()}
+
+
+def insert_ignoring_conflicts(table):
+    """
+    Gets an insert that does nothing if a row with the same primary key exists,
+    so concurrent requests can insert the same row without failing
+
+    Params:
+        table (Table): the table to insert into
+
+    Returns:
+        Insert: the insert statement
+    """
+    dialect_name = engine.dialect.name
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect_name == "sqlite":
+        return table.insert().prefix_with("OR IGNORE")
+    else:
+        return table.insert().prefix_with("IGNORE")
+
+
+# sessions are scoped per thread, uwsgi workers run several request threads
+# so that long-polling executioners don't tie up whole workers
 db_session = scoped_session(
-    sessionmaker(autocommit=False, autoflush=False, bind=engine), scopefunc=scopefunc
+    sessionmaker(autocommit=False, autoflush=False, bind=engine),
+    scopefunc=threading.get_ident,
 )
 Base = declarative_base()
 Base.query = db_session.query_property()
 
 
 def init_db():
+    """
+    Creates the tables of a new database at the latest schema. Existing
+    databases are left as they are, they're brought up to date by
+    utils/migrate_db.py.
+    """
+    import migrations
     import model
 
+    existing_tables = set(inspect(engine).get_table_names())
+    if existing_tables & set(Base.metadata.tables):
+        return
+
     Base.metadata.create_all(bind=engine)
+    migrations.stamp(engine)
@@ -0,0 +1,250 @@
+"""
+Versioned schema migrations for existing databases
+
+Each migration is a module in this package with a VERSION number, a one line
+docstring describing it, and an upgrade(connection) function. Migrations are
+listed in MIGRATIONS in version order, and the versions that have been applied
+are recorded in the schema_version table. Together they build every table in
+model.py, starting from the tables of the first release.
+
+New databases are created at the latest schema by init_db, which stamps them
+with every migration so they're never applied. Existing databases are brought
+up to date by utils/migrate_db.py, and the courthouse refuses to start while
+any migrations are pending. Migrations should still check what already exists,
+as databases from before this package have some of the newer tables but none
+of the versions recorded.
+
+Migrations run while the courthouse is up, so they shouldn't hold locks that
+block it for long. On postgres each migration's transaction gives up waiting
+for a lock after LOCK_TIMEOUT, instead of queueing every query behind it, and
+migrations that set TRANSACTIONAL = False run outside of a transaction so
+they can create indexes concurrently with create_index. Those migrations are
+recorded once they finish, so they must be safe to run again if interrupted.
+"""
+import datetime
+import importlib
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+MIGRATIONS = [
+    "m0000_baseline",
+    "m0001_test_data_hashes",
+    "m0002_run_indexes",
+    "m0003_language_compile_scripts",
+    "m0004_problem_test_cases",
+    "m0005_contest_freeze",
+    "m0006_contest_problem_scores",
+    "m0007_run_queue",
+    "m0008_run_leases",
+]
+
+LOCK_TIMEOUT = "10s"
+
+metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_time", DateTime, nullable=False),
+)
+
+
+def get_migrations():
+    """
+    Loads the migration modules
+
+    Returns:
+        list: the migration modules, in version order
+    """
+    migrations = [
+        importlib.import_module("{}.{}".format(__name__, x)) for x in MIGRATIONS
+    ]
+
+    versions = [x.VERSION for x in migrations]
+    if versions != sorted(set(versions)):
+        raise Exception("Migration versions must be unique and in order")
+
+    return migrations
+
+
+def get_applied_versions(engine):
+    """
+    Gets the migrations that have been applied to a database
+
+    Params:
+        engine: the database's engine
+
+    Returns:
+        set: the applied versions
+    """
+    metadata.create_all(engine)
+    with engine.connect() as connection:
+        return {x.version for x in connection.execute(schema_version.select())}
+
+
+def get_pending_migrations(engine):
+    """
+    Gets the migrations that haven't been applied to a database
+
+    Params:
+        engine: the database's engine
+
+    Returns:
+        list: the pending migration modules, in version order
+    """
+    applied_versions = get_applied_versions(engine)
+    return [x for x in get_migrations() if x.VERSION not in applied_versions]
+
+
+def upgrade(engine, log=print):
+    """
+    Applies every pending migration. Each migration is applied in its own
+    transaction together with its version record, unless it's not
+    transactional.
+
+    Params:
+        engine: the database's engine
+        log (function): called with a message for each migration
+
+    Returns:
+        list: the applied migration modules
+    """
+    pending = get_pending_migrations(engine)
+    for migration in pending:
+        log("Applying migration {}: {}".format(migration.VERSION, describe(migration)))
+        if getattr(migration, "TRANSACTIONAL", True):
+            with engine.begin() as connection:
+                if connection.dialect.name == "postgresql":
+                    connection.execute(
+                        "SET LOCAL lock_timeout = '{}'".format(LOCK_TIMEOUT)
+                    )
+                migration.upgrade(connection)
+                _record(connection, migration)
+        else:
+            with engine.connect() as connection:
+                migration.upgrade(
+                    connection.execution_options(isolation_level="AUTOCOMMIT")
+                )
+            with engine.begin() as connection:
+                _record(connection, migration)
+
+    return pending
+
+
+def check_schema(engine):
+    """
+    Checks that every migration has been applied to a database
+
+    Params:
+        engine: the database's engine
+
+    Raises:
+        Exception: if any migrations are pending
+    """
+    pending = get_pending_migrations(engine)
+    if pending:
+        raise Exception(
+            "The database schema is out of date, run utils/migrate_db.py to "
+            "apply the pending migrations: {}".format(
+                ", ".join("{} ({})".format(x.VERSION, describe(x)) for x in pending)
+            )
+        )
+
+
+def stamp(engine):
+    """
+    Records every migration as applied without running them, for databases
+    created at the latest schema
+
+    Params:
+        engine: the database's engine
+    """
+    pending = get_pending_migrations(engine)
+    with engine.begin() as connection:
+        for migration in pending:
+            _record(connection, migration)
+
+
+def add_column(connection, column):
+    """
+    Adds a column to an existing table, if it doesn't have it yet. Columns
+    added to tables with rows must be nullable or have a server default.
+
+    Params:
+        connection: the migration's connection
+        column (Column): the column, in a snapshot of its table
+    """
+    table_name = column.table.name
+    existing = {x["name"] for x in inspect(connection).get_columns(table_name)}
+    if column.name in existing:
+        return
+
+    connection.execute(
+        "ALTER TABLE {} ADD COLUMN {}".format(
+            connection.dialect.identifier_preparer.format_table(column.table),
+            CreateColumn(column).compile(dialect=connection.dialect),
+        )
+    )
+
+
+def create_index(connection, index):
+    """
+    Creates an index, if it doesn't exist yet. On postgres the index is built
+    without blocking writes to its table if the index sets
+    postgresql_concurrently and the migration isn't transactional.
+
+    Params:
+        connection: the migration's connection
+        index (Index): the index, on a snapshot of its table
+    """
+    if connection.dialect.name == "postgresql":
+        # a concurrent build that fails leaves an invalid index behind, which
+        # has to be dropped before it's built again
+        is_valid = connection.execute(
+            text(
+                "SELECT pg_index.indisvalid FROM pg_index "
+                "JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+                "WHERE pg_class.relname = :name"
+            ),
+            name=index.name,
+        ).scalar()
+        if is_valid:
+            return
+        if is_valid is not None:
+            connection.execute(
+                "DROP INDEX {}{}".format(
+                    (
+                        "CONCURRENTLY "
+                        if index.dialect_options["postgresql"]["concurrently"]
+                        else ""
+                    ),
+                    connection.dialect.identifier_preparer.quote(index.name),
+                )
+            )
+    else:
+        existing = {
+            x["name"] for x in inspect(connection).get_indexes(index.table.name)
+        }
+        if index.name in existing:
+            return
+
+    index.create(connection)
+
+
+def _record(connection, migration):
+    connection.execute(
+        schema_version.insert().values(
+            version=migration.VERSION,
+            description=describe(migration),
+            applied_time=datetime.datetime.utcnow(),
+        )
+    )
+
+
+def describe(migration):
+    """Gets the first line of a migration's docstring"""
+    return (migration.__doc__ or "").strip().splitlines()[0]
@@ -0,0 +1,152 @@
+"""Creates the tables of the first release"""
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, MetaData
+from sqlalchemy import String, Table
+
+VERSION = 0
+
+metadata = MetaData()
+
+Table(
+    "contest_problem",
+    metadata,
+    Column("contest_id", Integer, ForeignKey("contest.id")),
+    Column("problem_id", Integer, ForeignKey("problem.id")),
+)
+
+Table(
+    "contest_user",
+    metadata,
+    Column("contest_id", Integer, ForeignKey("contest.id")),
+    Column("user_id", Integer, ForeignKey("user.id")),
+)
+
+Table(
+    "user_user_role",
+    metadata,
+    Column("user_id", Integer, ForeignKey("user.id")),
+    Column("user_role_id", Integer, ForeignKey("user_role.id")),
+)
+
+Table(
+    "language",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, unique=True, nullable=False),
+    Column("default_template", String),
+    Column("syntax_mode", String, nullable=False),
+    Column("is_enabled", Boolean, nullable=False),
+    Column("run_script", String, nullable=False),
+    Column("version", String),
+)
+
+Table(
+    "problem_type",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, unique=True, nullable=False),
+    Column("eval_script", String, nullable=False),
+)
+
+Table(
+    "problem",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("problem_type_id", Integer, ForeignKey("problem_type.id"), nullable=False),
+    Column("slug", String(200), unique=True, nullable=False),
+    Column("name", String, nullable=False),
+    Column("problem_statement", String, nullable=False),
+    Column("sample_input", String, nullable=False),
+    Column("sample_output", String, nullable=False),
+    Column("secret_input", String, nullable=False),
+    Column("secret_output", String, nullable=False),
+    Column("is_enabled", Boolean, nullable=False),
+)
+
+Table(
+    "user",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("username", String, unique=True, nullable=False),
+    Column("hashed_password", String, nullable=False),
+    Column("creation_time", DateTime, nullable=False),
+    Column("misc_data", String, nullable=False),
+)
+
+Table(
+    "contest",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, unique=True, nullable=False),
+    Column("start_time", DateTime, nullable=False),
+    Column("end_time", DateTime, nullable=False),
+    Column("is_public", Boolean, nullable=False),
+)
+
+Table(
+    "configuration",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("key", String, unique=True, nullable=False),
+    Column("val", String, nullable=False),
+    Column("valType", String, nullable=False),
+    Column("category", String, nullable=False),
+)
+
+Table(
+    "saved_code",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("contest_id", Integer, ForeignKey("contest.id"), nullable=False),
+    Column("problem_id", Integer, ForeignKey("problem.id"), nullable=False),
+    Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+    Column("language_id", Integer, ForeignKey("language.id"), nullable=False),
+    Column("source_code", String, unique=True, nullable=False),
+    Column("last_updated_time", DateTime),
+)
+
+Table(
+    "run",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+    Column("contest_id", Integer, ForeignKey("contest.id"), nullable=True),
+    Column("language_id", Integer, ForeignKey("language.id"), nullable=False),
+    Column("problem_id", Integer, ForeignKey("problem.id"), nullable=True),
+    Column("source_code", String, nullable=False),
+    Column("submit_time", DateTime, nullable=False),
+    Column("local_submit_time", DateTime, nullable=True),
+    Column("started_execing_time", DateTime),
+    Column("finished_execing_time", DateTime),
+    Column("run_input", String, nullable=False),
+    Column("correct_output", String, nullable=False),
+    Column("run_output", String),
+    Column("is_submission", Boolean, nullable=False),
+    Column("is_passed", Boolean, nullable=True),
+    Column("is_priority", Boolean),
+    Column("state", String),
+)
+
+Table(
+    "clarification",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("problem_id", Integer, ForeignKey("problem.id"), nullable=True),
+    Column("initiating_user_id", Integer, ForeignKey("user.id"), nullable=False),
+    Column("subject", String, nullable=False),
+    Column("contents", String, nullable=False),
+    Column("answer", String, nullable=True),
+    Column("creation_time", DateTime, nullable=False),
+    Column("is_public", Boolean, nullable=False),
+)
+
+Table(
+    "user_role",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+)
+
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
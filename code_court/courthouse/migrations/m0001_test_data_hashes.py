@@ -0,0 +1,27 @@
+"""Stores run test data once by hash in the test_data table"""
+from sqlalchemy import Column, MetaData, String, Table, inspect
+
+VERSION = 1
+
+metadata = MetaData()
+
+test_data = Table(
+    "test_data",
+    metadata,
+    Column("hash", String(64), primary_key=True),
+    Column("contents", String, nullable=False),
+)
+
+
+def upgrade(connection):
+    test_data.create(connection, checkfirst=True)
+
+    # the inline data is moved into test_data by utils/migrate_test_data.py,
+    # runs that haven't been moved yet are judged using their inline data
+    run_columns = {x["name"] for x in inspect(connection).get_columns("run")}
+    for column in ("run_input_hash", "correct_output_hash"):
+        if column not in run_columns:
+            connection.execute(
+                "ALTER TABLE run ADD COLUMN {} VARCHAR(64) "
+                "REFERENCES test_data (hash)".format(column)
+            )
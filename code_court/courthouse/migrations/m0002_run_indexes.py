@@ -0,0 +1,77 @@
+"""Indexes the run queries made by the writ queue, rate limits and scores"""
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, MetaData, Table
+from sqlalchemy import and_
+
+from migrations import create_index
+
+VERSION = 2
+
+# the indexes are built concurrently on postgres, so submissions and judging
+# carry on while they're built
+TRANSACTIONAL = False
+
+metadata = MetaData()
+
+run = Table(
+    "run",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer),
+    Column("contest_id", Integer),
+    Column("problem_id", Integer),
+    Column("submit_time", DateTime),
+    Column("started_execing_time", DateTime),
+    Column("finished_execing_time", DateTime),
+    Column("is_priority", Boolean),
+)
+
+is_unclaimed = and_(
+    run.c.started_execing_time == None, run.c.finished_execing_time == None
+)
+is_executing = and_(
+    run.c.started_execing_time != None, run.c.finished_execing_time == None
+)
+
+indexes = [
+    Index(
+        "ix_run_unclaimed",
+        run.c.submit_time,
+        postgresql_where=is_unclaimed,
+        sqlite_where=is_unclaimed,
+        postgresql_concurrently=True,
+    ),
+    Index(
+        "ix_run_unclaimed_priority",
+        run.c.is_priority,
+        run.c.submit_time,
+        postgresql_where=is_unclaimed,
+        sqlite_where=is_unclaimed,
+        postgresql_concurrently=True,
+    ),
+    Index(
+        "ix_run_executing",
+        run.c.started_execing_time,
+        postgresql_where=is_executing,
+        sqlite_where=is_executing,
+        postgresql_concurrently=True,
+    ),
+    Index(
+        "ix_run_user_submit_time",
+        run.c.user_id,
+        run.c.submit_time,
+        postgresql_concurrently=True,
+    ),
+    Index(
+        "ix_run_contest_user_problem",
+        run.c.contest_id,
+        run.c.user_id,
+        run.c.problem_id,
+        run.c.submit_time,
+        postgresql_concurrently=True,
+    ),
+]
+
+
+def upgrade(connection):
+    for index in indexes:
+        create_index(connection, index)
@@ -0,0 +1,19 @@
+"""Adds a compile script to languages"""
+from sqlalchemy import Column, Integer, MetaData, String, Table
+
+from migrations import add_column
+
+VERSION = 3
+
+metadata = MetaData()
+
+language = Table(
+    "language",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("compile_script", String, nullable=True),
+)
+
+
+def upgrade(connection):
+    add_column(connection, language.c.compile_script)
@@ -0,0 +1,34 @@
+"""Adds ordered test cases to problems and per case results to runs"""
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, String, Table
+
+from migrations import add_column
+
+VERSION = 4
+
+metadata = MetaData()
+
+# only used to resolve problem_test_case's foreign keys
+Table("problem", metadata, Column("id", Integer, primary_key=True))
+Table("test_data", metadata, Column("hash", String(64), primary_key=True))
+
+problem_test_case = Table(
+    "problem_test_case",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("problem_id", Integer, ForeignKey("problem.id"), nullable=False),
+    Column("case_number", Integer, nullable=False),
+    Column("input_hash", String(64), ForeignKey("test_data.hash"), nullable=False),
+    Column("output_hash", String(64), ForeignKey("test_data.hash"), nullable=False),
+)
+
+run = Table(
+    "run",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("test_case_data", String),
+)
+
+
+def upgrade(connection):
+    problem_test_case.create(connection, checkfirst=True)
+    add_column(connection, run.c.test_case_data)
@@ -0,0 +1,21 @@
+"""Adds a scoreboard freeze time to contests"""
+from sqlalchemy import Boolean, Column, DateTime, Integer, MetaData, Table, false
+
+from migrations import add_column
+
+VERSION = 5
+
+metadata = MetaData()
+
+contest = Table(
+    "contest",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("freeze_time", DateTime, nullable=True),
+    Column("is_unfrozen", Boolean, nullable=False, server_default=false()),
+)
+
+
+def upgrade(connection):
+    add_column(connection, contest.c.freeze_time)
+    add_column(connection, contest.c.is_unfrozen)
@@ -0,0 +1,117 @@
+"""Adds scoreboard aggregates and fills them in from the judged runs"""
+import itertools
+
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, MetaData
+from sqlalchemy import Table, and_, select
+
+VERSION = 6
+
+FAILED_RUN_PENALTY_MINUTES = 20
+
+metadata = MetaData()
+
+contest = Table(
+    "contest",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("start_time", DateTime),
+    Column("freeze_time", DateTime),
+)
+Table("user", metadata, Column("id", Integer, primary_key=True))
+Table("problem", metadata, Column("id", Integer, primary_key=True))
+
+run = Table(
+    "run",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("contest_id", Integer),
+    Column("user_id", Integer),
+    Column("problem_id", Integer),
+    Column("submit_time", DateTime),
+    Column("finished_execing_time", DateTime),
+    Column("is_submission", Boolean),
+    Column("is_passed", Boolean),
+)
+
+contest_problem_score = Table(
+    "contest_problem_score",
+    metadata,
+    Column("contest_id", Integer, ForeignKey("contest.id"), primary_key=True),
+    Column("user_id", Integer, ForeignKey("user.id"), primary_key=True),
+    Column("problem_id", Integer, ForeignKey("problem.id"), primary_key=True),
+    Column("solve_time", DateTime, nullable=True),
+    Column("num_failed", Integer, nullable=False, default=0),
+    Column("penalty_minutes", Integer, nullable=False, default=0),
+    Column("frozen_solve_time", DateTime, nullable=True),
+    Column("frozen_num_failed", Integer, nullable=False, default=0),
+    Column("frozen_penalty_minutes", Integer, nullable=False, default=0),
+)
+
+
+def upgrade(connection):
+    if contest_problem_score.exists(connection):
+        return
+
+    contest_problem_score.create(connection)
+
+    # the same aggregates as scoreboard.py at the time of this migration, the
+    # scoreboard can also be rebuilt from the admin utils page
+    verdicts = connection.execute(
+        select(
+            [
+                run.c.contest_id,
+                run.c.user_id,
+                run.c.problem_id,
+                run.c.submit_time,
+                run.c.is_passed,
+                contest.c.start_time,
+                contest.c.freeze_time,
+            ]
+        )
+        .select_from(run.join(contest, run.c.contest_id == contest.c.id))
+        .where(
+            and_(
+                run.c.is_submission == True,
+                run.c.is_passed != None,
+                run.c.finished_execing_time != None,
+                run.c.problem_id != None,
+            )
+        )
+        .order_by(run.c.contest_id, run.c.user_id, run.c.problem_id, run.c.submit_time)
+    )
+
+    scores = []
+    for score_key, rows in itertools.groupby(verdicts, key=lambda x: tuple(x[:3])):
+        rows = list(rows)
+        start_time, freeze_time = rows[0].start_time, rows[0].freeze_time
+        score = dict(zip(("contest_id", "user_id", "problem_id"), score_key))
+
+        score["solve_time"], score["num_failed"], score["penalty_minutes"] = _aggregate(
+            rows, start_time
+        )
+        if freeze_time is not None:
+            rows = [x for x in rows if x.submit_time < freeze_time]
+        (
+            score["frozen_solve_time"],
+            score["frozen_num_failed"],
+            score["frozen_penalty_minutes"],
+        ) = _aggregate(rows, start_time)
+        scores.append(score)
+
+    if scores:
+        connection.execute(contest_problem_score.insert(), scores)
+
+
+def _aggregate(rows, start_time):
+    num_failed = 0
+    for row in rows:
+        if row.is_passed:
+            solve_minutes = (
+                max(int((row.submit_time - start_time).total_seconds()), 0) // 60
+            )
+            penalty_minutes = solve_minutes + num_failed * FAILED_RUN_PENALTY_MINUTES
+            return row.submit_time, num_failed, penalty_minutes
+
+        num_failed += 1
+
+    return None, num_failed, 0
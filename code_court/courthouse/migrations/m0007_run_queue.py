@@ -0,0 +1,21 @@
+"""Adds delivery counts and dead-lettering to runs"""
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table
+
+from migrations import add_column
+
+VERSION = 7
+
+metadata = MetaData()
+
+run = Table(
+    "run",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("delivery_count", Integer, nullable=False, server_default="0"),
+    Column("dead_letter_time", DateTime, nullable=True),
+)
+
+
+def upgrade(connection):
+    add_column(connection, run.c.delivery_count)
+    add_column(connection, run.c.dead_letter_time)
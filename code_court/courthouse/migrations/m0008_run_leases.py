@@ -0,0 +1,24 @@
+"""Adds lease counts to runs, so leases from before a rejudge are rejected"""
+from sqlalchemy import Column, Integer, MetaData, Table
+
+from migrations import add_column
+
+VERSION = 8
+
+metadata = MetaData()
+
+run = Table(
+    "run",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("delivery_count", Integer, nullable=False, server_default="0"),
+    Column("lease_count", Integer, nullable=False, server_default="0"),
+)
+
+
+def upgrade(connection):
+    add_column(connection, run.c.lease_count)
+
+    # leases handed out before lease counts existed have the delivery count as
+    # their id
+    connection.execute(run.update().values(lease_count=run.c.delivery_count))
@@ -1,14 +1,16 @@
 import json
 import datetime
+import hashlib
 
 import util
 
 from flask_login import UserMixin
-from database import Base
+from database import Base, db_session, insert_ignoring_conflicts
 
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, deferred
 
 from sqlalchemy import Column, Table, ForeignKey, Integer, String, Boolean, DateTime
+from sqlalchemy import Index, and_
 
 MAX_RUN_OUTPUT_LENGTH = 2000
 
@@ -54,19 +56,31 @@ class Language(Base):
     """bool: whether or not the language is enabled"""
 
     run_script = Column(String, nullable=False)
-    """str: script (with shebang) that compiles and runs scripts for this language"""
+    """str: script (with shebang) that runs programs for this language, if there is
+            no compile_script it also compiles them"""
+
+    compile_script = Column(String, nullable=True)
+    """str: script (with shebang) that compiles programs into $build_dir, executors
+            cache the compiled program so identical source is only compiled once"""
 
     version = Column(String)
     """str: the version of the language"""
 
     def __init__(
-        self, name, syntax_mode, is_enabled, run_script, default_template=None
+        self,
+        name,
+        syntax_mode,
+        is_enabled,
+        run_script,
+        default_template=None,
+        compile_script=None,
     ):
         self.name = name
         self.syntax_mode = syntax_mode
         self.is_enabled = is_enabled
         self.run_script = run_script
         self.default_template = default_template
+        self.compile_script = compile_script
 
     def get_output_dict(self):
         return {
@@ -74,6 +88,7 @@ class Language(Base):
             "name": self.name,
             "is_enabled": self.is_enabled,
             "run_script": self.run_script,
+            "compile_script": self.compile_script,
             "default_template": self.default_template,
             "version": self.version,
         }
@@ -130,19 +145,21 @@ class Problem(Base):
     name = Column(String, nullable=False)
     """str: the problem's name"""
 
-    problem_statement = Column(String, nullable=False)
+    # the problem's text is only loaded when it's used, or when a query asks for
+    # it with undefer_group("statement") or undefer_group("secret")
+    problem_statement = deferred(Column(String, nullable=False), group="statement")
     """str: the problem statement in markdown format"""
 
-    sample_input = Column(String, nullable=False)
+    sample_input = deferred(Column(String, nullable=False), group="statement")
     """str: the problem's sample input, this may be shown to the user """
 
-    sample_output = Column(String, nullable=False)
+    sample_output = deferred(Column(String, nullable=False), group="statement")
     """str: the problem's sample output, this may be shown to the user """
 
-    secret_input = Column(String, nullable=False)
+    secret_input = deferred(Column(String, nullable=False), group="secret")
     """str: the problem's secret input, this may be shown to the user """
 
-    secret_output = Column(String, nullable=False)
+    secret_output = deferred(Column(String, nullable=False), group="secret")
     """str: the problem's secret output, this may be shown to the user """
 
     is_enabled = Column(Boolean, nullable=False, default=True)
@@ -152,6 +169,13 @@ class Problem(Base):
         "Contest", secondary=contest_problem, back_populates="problems"
     )
 
+    test_cases = relationship(
+        "ProblemTestCase",
+        order_by="ProblemTestCase.case_number",
+        back_populates="problem",
+        cascade="all, delete-orphan",
+    )
+
     def __init__(
         self,
         problem_type,
@@ -183,6 +207,34 @@ class Problem(Base):
             "sample_output": self.sample_output,
         }
 
+    def set_test_cases(self, test_cases):
+        """
+        Replaces the problem's secret test cases
+
+        Params:
+            test_cases (list): (input, output) pairs, in the order they are run
+        """
+        self.test_cases = [
+            ProblemTestCase(case_number, case_input, case_output)
+            for case_number, (case_input, case_output) in enumerate(test_cases, 1)
+        ]
+
+    def store_test_data(self):
+        """
+        Stores the problem's sample and secret data as test data, so runs
+        referencing it don't have to store it themselves
+
+        Note:
+            the changes are not committed
+        """
+        for contents in (
+            self.sample_input,
+            self.sample_output,
+            self.secret_input,
+            self.secret_output,
+        ):
+            TestData.get_or_create(contents)
+
     def __repr__(self):
         return "Problem({})".format(self.name)
 
@@ -190,6 +242,129 @@ class Problem(Base):
         return self.__repr__()
 
 
+class ProblemTestCase(Base):
+    """Stores one of a problem's secret test cases. Submissions to problems
+    with test cases are run against each case in order, and judging stops
+    at the first failing case. Problems without test cases are judged against
+    their secret input and output."""
+
+    __tablename__ = "problem_test_case"
+
+    id = Column(Integer, primary_key=True)
+
+    problem = relationship("Problem", back_populates="test_cases")
+    problem_id = Column(Integer, ForeignKey("problem.id"), nullable=False)
+    """int: a foreignkey to the test case's problem"""
+
+    case_number = Column(Integer, nullable=False)
+    """int: the test case's position in the problem's test cases, starting at 1"""
+
+    input_data = relationship("TestData", foreign_keys="ProblemTestCase.input_hash")
+    input_hash = Column(String(64), ForeignKey("test_data.hash"), nullable=False)
+    """str: a foreignkey to the input text passed to the submitted program"""
+
+    output_data = relationship("TestData", foreign_keys="ProblemTestCase.output_hash")
+    output_hash = Column(String(64), ForeignKey("test_data.hash"), nullable=False)
+    """str: a foreignkey to the correct output for the input"""
+
+    @property
+    def input(self):
+        return self.input_data.contents
+
+    @input.setter
+    def input(self, contents):
+        self.input_data = TestData.get_or_create(contents)
+
+    @property
+    def output(self):
+        return self.output_data.contents
+
+    @output.setter
+    def output(self, contents):
+        self.output_data = TestData.get_or_create(contents)
+
+    def __init__(self, case_number, input, output):
+        self.case_number = case_number
+        self.input = input
+        self.output = output
+
+    def get_output_dict(self):
+        return {
+            "case_number": self.case_number,
+            "input": self.input,
+            "output": self.output,
+        }
+
+    def __repr__(self):
+        return "ProblemTestCase(problem_id={}, case_number={})".format(
+            self.problem_id, self.case_number
+        )
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class TestData(Base):
+    """Stores a blob of test data, such as a run's input or correct output.
+    Blobs are keyed by the sha256 hash of their contents, so data shared by
+    many runs is only stored once, and executioners can cache it by hash."""
+
+    __tablename__ = "test_data"
+
+    hash = Column(String(64), primary_key=True)
+    """str: the hex sha256 hash of the contents"""
+
+    contents = Column(String, nullable=False)
+    """str: the test data"""
+
+    def __init__(self, contents):
+        self.hash = TestData.hash_contents(contents)
+        self.contents = contents
+
+    @staticmethod
+    def hash_contents(contents):
+        return hashlib.sha256(contents.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_or_create(contents):
+        """
+        Gets the stored test data with the given contents, adding it to the
+        session if it isn't stored yet
+
+        Params:
+            contents (str): the test data
+
+        Returns:
+            TestData: the test data
+        """
+        data_hash = TestData.hash_contents(contents)
+
+        test_data = TestData.query.get(data_hash)
+        if test_data is not None:
+            return test_data
+
+        # the session isn't autoflushed, so check data that's not yet flushed
+        for obj in db_session.new:
+            if isinstance(obj, TestData) and obj.hash == data_hash:
+                return obj
+
+        # concurrent requests may be storing the same data, so the row is
+        # inserted unless it exists rather than added to the session, where
+        # the loser of the race would fail to flush
+        db_session.execute(
+            insert_ignoring_conflicts(TestData.__table__).values(
+                hash=data_hash, contents=contents
+            )
+        )
+        return TestData.query.get(data_hash)
+
+    def __repr__(self):
+        return "TestData({})".format(self.hash)
+
+    def __str__(self):
+        return self.__repr__()
+
+
 class User(Base, UserMixin):
     """Stores information about a user"""
 
@@ -306,6 +481,13 @@ class Contest(Base):
     is_public = Column(Boolean, nullable=False)
     """bool: whether or not the contest can be joined/viewed by anyone"""
 
+    freeze_time = Column(DateTime, nullable=True)
+    """DateTime: the time when the public scoreboard freezes, verdicts on submissions made
+        after this time are hidden from it until the contest is unfrozen"""
+
+    is_unfrozen = Column(Boolean, nullable=False, default=False)
+    """bool: whether or not the frozen scoreboard has been revealed"""
+
     # users = relationship("ContestUser", back_populates="contest")
     users = relationship("User", secondary=contest_user, back_populates="contests")
     problems = relationship(
@@ -320,6 +502,7 @@ class Contest(Base):
         is_public,
         users=None,
         problems=None,
+        freeze_time=None,
     ):
         self.name = name
         self.start_time = start_time
@@ -327,6 +510,26 @@ class Contest(Base):
         self.is_public = is_public
         self.users = users or []
         self.problems = problems or []
+        self.freeze_time = freeze_time
+        self.is_unfrozen = False
+
+    def get_scoreboard_freeze_time(self, now=None):
+        """
+        Gets the time the public scoreboard is frozen at
+
+        Params:
+            now (datetime): the current time, defaults to utcnow
+
+        Returns:
+            datetime: the freeze time, or None if the scoreboard isn't frozen
+        """
+        if self.freeze_time is None or self.is_unfrozen:
+            return None
+
+        if (now or datetime.datetime.utcnow()) < self.freeze_time:
+            return None
+
+        return self.freeze_time
 
     def get_output_dict(self):
         return {
@@ -335,6 +538,8 @@ class Contest(Base):
             "is_public": self.is_public,
             "start_time": util.dt_to_str(self.start_time),
             "end_time": util.dt_to_str(self.end_time),
+            "freeze_time": util.dt_to_str(self.freeze_time),
+            "is_scoreboard_frozen": self.get_scoreboard_freeze_time() is not None,
         }
 
     def __repr__(self):
@@ -344,6 +549,61 @@ class Contest(Base):
         return self.__repr__()
 
 
+class ContestProblemScore(Base):
+    """Stores a defendant's aggregated verdicts on one of a contest's problems,
+    so the scoreboard doesn't need to read every submission. Each score holds
+    the live aggregates and the aggregates of the frozen scoreboard, which only
+    count submissions made before the contest's freeze time."""
+
+    __tablename__ = "contest_problem_score"
+
+    contest_id = Column(Integer, ForeignKey("contest.id"), primary_key=True)
+    """int: a foreignkey to the contest"""
+
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    """int: a foreignkey to the defendant"""
+
+    problem_id = Column(Integer, ForeignKey("problem.id"), primary_key=True)
+    """int: a foreignkey to the problem"""
+
+    solve_time = Column(DateTime, nullable=True)
+    """DateTime: the submit time of the first passing submission, or None if the
+        problem hasn't been solved"""
+
+    num_failed = Column(Integer, nullable=False, default=0)
+    """int: the number of failed submissions before the problem was solved"""
+
+    penalty_minutes = Column(Integer, nullable=False, default=0)
+    """int: the minutes from the contest start to the solve, plus the penalty for
+        each failed submission, this is 0 if the problem hasn't been solved"""
+
+    frozen_solve_time = Column(DateTime, nullable=True)
+    """DateTime: solve_time for the frozen scoreboard"""
+
+    frozen_num_failed = Column(Integer, nullable=False, default=0)
+    """int: num_failed for the frozen scoreboard"""
+
+    frozen_penalty_minutes = Column(Integer, nullable=False, default=0)
+    """int: penalty_minutes for the frozen scoreboard"""
+
+    def __init__(self, contest_id, user_id, problem_id):
+        self.contest_id = contest_id
+        self.user_id = user_id
+        self.problem_id = problem_id
+        self.num_failed = 0
+        self.penalty_minutes = 0
+        self.frozen_num_failed = 0
+        self.frozen_penalty_minutes = 0
+
+    def __repr__(self):
+        return "ContestProblemScore({}, {}, {})".format(
+            self.contest_id, self.user_id, self.problem_id
+        )
+
+    def __str__(self):
+        return self.__repr__()
+
+
 class Configuration(Base):
     """Stores general configuration information"""
 
@@ -465,7 +725,9 @@ class Run(Base):
     problem_id = Column(Integer, ForeignKey("problem.id"), nullable=True)
     """int: a foreignkey to the run's problem"""
 
-    source_code = Column(String, nullable=False)
+    # the run's code and data are only loaded when they're used, or when a query
+    # asks for them with undefer_group("run_data")
+    source_code = deferred(Column(String, nullable=False), group="run_data")
     """str: the submitted source code"""
 
     submit_time = Column(DateTime, nullable=False)
@@ -480,13 +742,30 @@ class Run(Base):
     finished_execing_time = Column(DateTime)
     """DateTime: the time the code finished being executed"""
 
-    run_input = Column(String, nullable=False)
-    """str: input text passed to the submitted program"""
+    run_input_data = relationship("TestData", foreign_keys="Run.run_input_hash")
+    run_input_hash = Column(String(64), ForeignKey("test_data.hash"), nullable=True)
+    """str: a foreignkey to the input text passed to the submitted program"""
+
+    correct_output_data = relationship(
+        "TestData", foreign_keys="Run.correct_output_hash"
+    )
+    correct_output_hash = Column(
+        String(64), ForeignKey("test_data.hash"), nullable=True
+    )
+    """str: a foreignkey to the correct output of the submitted program"""
+
+    inline_run_input = deferred(
+        Column("run_input", String, nullable=False, default=""), group="run_data"
+    )
+    """str: the input of runs made before test data was stored by hash, these
+            are moved to test_data by utils/migrate_test_data.py"""
 
-    correct_output = Column(String, nullable=False)
-    """str: the correct output of the submitted program"""
+    inline_correct_output = deferred(
+        Column("correct_output", String, nullable=False, default=""), group="run_data"
+    )
+    """str: the correct output of runs made before test data was stored by hash"""
 
-    run_output = Column(String)
+    run_output = deferred(Column(String), group="run_data")
     """str: the output of the submitted program"""
 
     is_submission = Column(Boolean, nullable=False)
@@ -498,9 +777,60 @@ class Run(Base):
     is_priority = Column(Boolean, default=False)
     """bool: indicates whether or not a run has priority status, which expedites execution"""
 
+    delivery_count = Column(Integer, nullable=False, default=0)
+    """int: the number of times the run has been claimed by executioners since it was queued"""
+
+    lease_count = Column(Integer, nullable=False, default=0)
+    """int: the number of leases the run has had, which is never reset, the current lease's id"""
+
+    dead_letter_time = Column(DateTime, nullable=True)
+    """DateTime: the time the run was taken out of the queue after too many deliveries"""
+
     state = Column(String)
     """str: information about the execution of the program"""
 
+    test_case_data = Column(String)
+    """str: the results of each executed test case, stored as a json list of
+            objects with the case_number, state, is_passed and time in seconds"""
+
+    @property
+    def run_input(self):
+        """str: input text passed to the submitted program"""
+        if self.run_input_hash is None and self.run_input_data is None:
+            return self.inline_run_input
+        return self.run_input_data.contents
+
+    @run_input.setter
+    def run_input(self, contents):
+        self.run_input_data = TestData.get_or_create(contents)
+        self.inline_run_input = ""
+
+    @property
+    def correct_output(self):
+        """str: the correct output of the submitted program"""
+        if self.correct_output_hash is None and self.correct_output_data is None:
+            return self.inline_correct_output
+        return self.correct_output_data.contents
+
+    @correct_output.setter
+    def correct_output(self, contents):
+        self.correct_output_data = TestData.get_or_create(contents)
+        self.inline_correct_output = ""
+
+    @property
+    def test_case_results(self):
+        if not self.test_case_data:
+            return []
+        return json.loads(self.test_case_data)
+
+    @property
+    def failed_test_case(self):
+        """int: the number of the first test case that failed, if any"""
+        for result in self.test_case_results:
+            if not result["is_passed"]:
+                return result["case_number"]
+        return None
+
     @property
     def is_judging(self):
         return (
@@ -550,6 +880,10 @@ class Run(Base):
             "state": self.state,
         }
 
+        if self.test_case_data:
+            d["test_case_results"] = self.test_case_results
+            d["failed_test_case"] = self.failed_test_case
+
         if self.local_submit_time:
             d["local_submit_time"] = self.local_submit_time
 
@@ -566,6 +900,21 @@ class Run(Base):
 
         return d
 
+    def get_summary_dict(self):
+        """Gets the run's status, without its source code, input or output"""
+        return {
+            "id": self.id,
+            "problem_id": self.problem_id,
+            "language": self.language.name,
+            "submit_time": self.submit_time,
+            "local_submit_time": self.local_submit_time,
+            "started_execing_time": self.started_execing_time,
+            "finished_execing_time": self.finished_execing_time,
+            "is_submission": self.is_submission,
+            "is_passed": self.is_passed,
+            "state": self.state,
+        }
+
     def __repr__(self):
         return "Run(id={})".format(self.id)
 
@@ -585,6 +934,51 @@ class Run(Base):
         return Run.query.filter(Run.finished_execing_time is None).all()
 
 
+# the partial indexes only cover runs waiting for, or being run by, an
+# executioner, so they stay small however many runs have been judged
+_is_unclaimed_run = and_(
+    Run.started_execing_time == None, Run.finished_execing_time == None
+)
+_is_executing_run = and_(
+    Run.started_execing_time != None, Run.finished_execing_time == None
+)
+
+# claiming the oldest writ, priority writs first
+Index(
+    "ix_run_unclaimed",
+    Run.submit_time,
+    postgresql_where=_is_unclaimed_run,
+    sqlite_where=_is_unclaimed_run,
+)
+Index(
+    "ix_run_unclaimed_priority",
+    Run.is_priority,
+    Run.submit_time,
+    postgresql_where=_is_unclaimed_run,
+    sqlite_where=_is_unclaimed_run,
+)
+
+# returning overdue writs to the queue
+Index(
+    "ix_run_executing",
+    Run.started_execing_time,
+    postgresql_where=_is_executing_run,
+    sqlite_where=_is_executing_run,
+)
+
+# submission rate limits and a defendant's runs
+Index("ix_run_user_submit_time", Run.user_id, Run.submit_time)
+
+# recomputing and rebuilding scoreboard aggregates
+Index(
+    "ix_run_contest_user_problem",
+    Run.contest_id,
+    Run.user_id,
+    Run.problem_id,
+    Run.submit_time,
+)
+
+
 class Clarification(Base):
     """Stores information about a user or judge clarification"""
 
@@ -692,6 +1086,7 @@ class RunState:
     FAILED = "Failed"
     EXECUTED = "Executed"
     JUDGING = "Judging"
+    DEAD_LETTERED = "DeadLettered"
     NO_OUTPUT = "NoOutput"
     TIMED_OUT = "TimedOut"
     OUTPUT_LIMIT_EXCEEDED = "OutputLimitExceeded"
@@ -0,0 +1,547 @@
+"""
+The queue of runs waiting for executioners
+
+Runs are queued when they're submitted or rejudged, and executioners claim
+them with get-writ. Claiming a run leases it to the executioner until its
+visibility timeout, EXECUTOR_TIMEOUT_MINS after it was claimed. The lease ends
+when the executioner submits the run, or when it returns the run without
+running it. requeue_expired returns runs whose lease expired to the queue, so
+they're handed to another executioner.
+
+The queue is split into lanes. Priority runs are claimed before any other
+runs, and within each lane the oldest run is claimed first. Executioners can
+ask for runs in some languages only, which claims from just those languages'
+lanes.
+
+Every claim of a run is a new lease, and the run's lease count, which only
+ever goes up, is the id of the current lease. Executioners send the lease id
+back when they submit or return a run, and only the holder of the run's
+current lease can end it, so a run whose lease expired can't be submitted or
+returned by its old executioner once another executioner has claimed it.
+Rejudging a run also ends its lease.
+
+Every claim of a run also counts as a delivery. A run that's returned or
+times out after MAX_DELIVERIES deliveries since it was queued is dead-lettered
+instead of being queued again: it's finished with the DeadLettered state, so a
+run that breaks executioners stops being handed out. Rejudging a dead-lettered
+run queues it again.
+
+The queue is kept in a backend, chosen when the app is created:
+
+- "database": the run table itself, where every unclaimed run is queued. This
+  is the default, and it's safe to use from every process at once.
+- "memory": lanes of run ids in this process, for tests. Only runs queued
+  with enqueue after it's created are in the queue.
+
+Both backends keep the claim and delivery times of runs in the run table.
+"""
+import abc
+import datetime
+import heapq
+import threading
+
+from sqlalchemy.orm import undefer_group
+from sqlalchemy.orm.attributes import set_committed_value
+
+import model
+import util
+import writ_notify
+from database import db_session
+
+MAX_DELIVERIES = 3
+
+
+class RunQueueBackendException(Exception):
+    pass
+
+
+class RunQueue(abc.ABC):
+    """The operations shared by the queue backends"""
+
+    def enqueue(self, run):
+        """
+        Queues a committed run, and wakes up executioners waiting for runs
+
+        Params:
+            run (model.Run): the run, which mustn't have been claimed
+        """
+        writ_notify.notify_run_queued()
+
+    def claim(self, max_runs, languages=None):
+        """
+        Claims up to max_runs runs from the front of the queue, leasing them
+        to the caller. It is safe to call this concurrently, each claim of a
+        run will only ever be handed to one caller.
+
+        Params:
+            max_runs (int): the maximum number of runs to claim
+            languages (list): the names of the languages to claim runs in,
+                None claims runs in any language
+
+        Returns:
+            list: the claimed runs, with their code and test data loaded
+        """
+        runs = []
+        while len(runs) < max_runs:
+            run = self._claim_run(languages)
+            if run is None:
+                break
+            runs.append(run)
+
+        return runs
+
+    def complete(self, run, lease_id):
+        """
+        Ends a run's lease once its output is recorded
+
+        Params:
+            run (model.Run): the run
+            lease_id (int): the id of the caller's lease on the run
+
+        Returns:
+            bool: whether the caller holds the run's lease, it doesn't if the
+                run was already submitted or dead-lettered, or if the lease
+                expired and the run was claimed again
+
+        Note:
+            the changes are not committed
+        """
+        now = datetime.datetime.utcnow()
+        return self._update_leased_run(
+            run, lease_id, {"finished_execing_time": now}, is_claimed=False
+        )
+
+    def release(self, run, lease_id):
+        """
+        Ends a run's lease without its output, returning it to the queue, or
+        dead-lettering it if it has been delivered too many times
+
+        Params:
+            run (model.Run): the run
+            lease_id (int): the id of the caller's lease on the run
+
+        Returns:
+            bool: whether the caller holds the run's lease, it doesn't if the
+                run was already submitted, returned or dead-lettered, or if
+                the lease expired and the run was claimed again
+        """
+        is_requeued = self._release_run(run, lease_id)
+        db_session.commit()
+
+        if is_requeued is None:
+            return False
+
+        if is_requeued:
+            self.enqueue(run)
+        else:
+            util.invalidate_cache_item(util.RUN_CACHE_NAME, run.user_id)
+
+        return True
+
+    def requeue_expired(self, now=None):
+        """
+        Releases every run whose lease has expired
+
+        Params:
+            now (datetime): the current time
+
+        Returns:
+            int: the number of released runs
+        """
+        now = now or datetime.datetime.utcnow()
+        expired_runs = self._get_expired_runs(
+            now - datetime.timedelta(minutes=util.EXECUTOR_TIMEOUT_MINS)
+        )
+
+        # the runs are released under the lease they were found with, so runs
+        # submitted since are left alone
+        released_runs = {x: self._release_run(x, x.lease_count) for x in expired_runs}
+        db_session.commit()
+
+        for run, is_requeued in released_runs.items():
+            if is_requeued:
+                self.enqueue(run)
+        for user_id in {
+            run.user_id
+            for run, is_requeued in released_runs.items()
+            if is_requeued is not None
+        }:
+            util.invalidate_cache_item(util.RUN_CACHE_NAME, user_id)
+
+        return sum(1 for x in released_runs.values() if x is not None)
+
+    def get_dead_letters(self):
+        """
+        Gets the dead-lettered runs
+
+        Returns:
+            list: the runs, in the order they were dead-lettered
+        """
+        return (
+            model.Run.query.filter(model.Run.dead_letter_time != None)
+            .order_by(model.Run.dead_letter_time)
+            .all()
+        )
+
+    def _release_run(self, run, lease_id):
+        """
+        Returns a claimed run to the queue, or dead-letters it
+
+        Returns:
+            bool: whether the run was queued again, or None if the lease
+                isn't the run's current lease
+
+        Note:
+            the changes are not committed
+        """
+        if run.delivery_count >= MAX_DELIVERIES:
+            now = datetime.datetime.utcnow()
+            values = {
+                "finished_execing_time": now,
+                "dead_letter_time": now,
+                "state": model.RunState.DEAD_LETTERED,
+            }
+        else:
+            values = {"started_execing_time": None}
+
+        if not self._update_leased_run(run, lease_id, values, is_claimed=True):
+            return None
+
+        return "started_execing_time" in values
+
+    def _update_leased_run(self, run, lease_id, values, is_claimed):
+        """
+        Updates a run only if the lease is its current lease, with a
+        conditional UPDATE so that only one of any concurrent updates succeeds
+
+        Params:
+            run (model.Run): the run
+            lease_id (int): the id of the lease
+            values (dict): the run attributes to set, by name
+            is_claimed (bool): whether the run must still be claimed, rather
+                than returned to the queue and not yet claimed again
+
+        Returns:
+            bool: whether the run was updated
+
+        Note:
+            the changes are not committed
+        """
+        if lease_id is None:
+            return False
+
+        lease_query = db_session.query(model.Run).filter(
+            model.Run.id == run.id,
+            model.Run.lease_count == lease_id,
+            model.Run.finished_execing_time == None,
+        )
+        if is_claimed:
+            lease_query = lease_query.filter(model.Run.started_execing_time != None)
+
+        num_updated = lease_query.update(
+            {getattr(model.Run, k): v for k, v in values.items()},
+            synchronize_session=False,
+        )
+        if num_updated != 1:
+            return False
+
+        for key, value in values.items():
+            set_committed_value(run, key, value)
+        return True
+
+    @abc.abstractmethod
+    def _claim_run(self, languages):
+        """
+        Claims the run at the front of the queue
+
+        Params:
+            languages (list): the names of the languages to claim runs in, or
+                None
+
+        Returns:
+            model.Run: the claimed run, or None if no runs are waiting
+        """
+
+    @abc.abstractmethod
+    def _get_expired_runs(self, claimed_before):
+        """
+        Gets the unfinished runs claimed before a time
+
+        Params:
+            claimed_before (datetime): the time
+
+        Returns:
+            list: the runs
+        """
+
+
+class DatabaseRunQueue(RunQueue):
+    """A queue of the unclaimed runs in the run table"""
+
+    def _claim_run(self, languages):
+        for priority_only in (True, False):
+            run = self._claim_oldest_run(priority_only, languages)
+            if run is not None:
+                return run
+
+        return None
+
+    def _claim_oldest_run(self, priority_only, languages):
+        """
+        Claims the oldest unclaimed run
+
+        On postgres the row is locked with SELECT ... FOR UPDATE SKIP LOCKED so
+        concurrent claimers move on to the next row instead of waiting. Other
+        databases fall back to a conditional UPDATE that only succeeds if the
+        run is still unclaimed, retrying with the next candidate if it lost the
+        race.
+
+        Params:
+            priority_only (bool): only consider runs with priority status
+            languages (list): the names of the languages to consider runs in,
+                or None
+
+        Returns:
+            model.Run: the claimed run, or None if no matching runs are waiting
+        """
+        unclaimed_query = model.Run.query.filter(
+            model.Run.started_execing_time == None,
+            model.Run.finished_execing_time == None,
+        )
+        if priority_only:
+            unclaimed_query = unclaimed_query.filter(model.Run.is_priority == True)
+        if languages is not None:
+            unclaimed_query = unclaimed_query.filter(
+                model.Run.language.has(model.Language.name.in_(languages))
+            )
+        unclaimed_query = unclaimed_query.order_by(model.Run.submit_time.asc())
+
+        if db_session.bind.dialect.name == "postgresql":
+            run = (
+                unclaimed_query.options(undefer_group("run_data"))
+                .with_for_update(skip_locked=True)
+                .limit(1)
+                .first()
+            )
+            if run is None:
+                db_session.commit()
+                return None
+
+            run.started_execing_time = datetime.datetime.utcnow()
+            run.delivery_count += 1
+            run.lease_count += 1
+            db_session.commit()
+            return run
+
+        while True:
+            run_id = unclaimed_query.with_entities(model.Run.id).limit(1).scalar()
+            if run_id is None:
+                db_session.commit()
+                return None
+
+            num_claimed = (
+                db_session.query(model.Run)
+                .filter(
+                    model.Run.id == run_id,
+                    model.Run.started_execing_time == None,
+                    model.Run.finished_execing_time == None,
+                )
+                .update(
+                    {
+                        model.Run.started_execing_time: datetime.datetime.utcnow(),
+                        model.Run.delivery_count: model.Run.delivery_count + 1,
+                        model.Run.lease_count: model.Run.lease_count + 1,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db_session.commit()
+
+            if num_claimed == 1:
+                # the run's code and data are sent to the executioner
+                return model.Run.query.options(undefer_group("run_data")).get(run_id)
+
+    def _get_expired_runs(self, claimed_before):
+        return model.Run.query.filter(
+            model.Run.finished_execing_time == None,
+            model.Run.started_execing_time != None,
+            model.Run.started_execing_time < claimed_before,
+        ).all()
+
+
+class MemoryRunQueue(RunQueue):
+    """A queue of run ids in this process, for tests"""
+
+    def __init__(self):
+        # (is priority, language name): a heap of (submit time, run id)
+        self.lanes = {}
+        # run id: the time it was claimed
+        self.leases = {}
+        self.lock = threading.Lock()
+
+    def enqueue(self, run):
+        with self.lock:
+            lane = self.lanes.setdefault((bool(run.is_priority), run.language.name), [])
+            heapq.heappush(lane, (run.submit_time, run.id))
+
+        super().enqueue(run)
+
+    def complete(self, run, lease_id):
+        if not super().complete(run, lease_id):
+            return False
+
+        with self.lock:
+            self.leases.pop(run.id, None)
+        return True
+
+    def release(self, run, lease_id):
+        with self.lock:
+            claim_time = self.leases.pop(run.id, None)
+
+        if not super().release(run, lease_id):
+            # the caller's lease is gone, but the run's current lease isn't
+            if claim_time is not None:
+                with self.lock:
+                    self.leases.setdefault(run.id, claim_time)
+            return False
+
+        return True
+
+    def _claim_run(self, languages):
+        while True:
+            with self.lock:
+                run_id = self._pop_oldest_run_id(languages)
+                if run_id is None:
+                    return None
+
+                claim_time = datetime.datetime.utcnow()
+                self.leases[run_id] = claim_time
+
+            run = model.Run.query.options(undefer_group("run_data")).get(run_id)
+            if run is None or run.started_execing_time or run.finished_execing_time:
+                # the run was deleted or judged while it was queued
+                with self.lock:
+                    self.leases.pop(run_id, None)
+                continue
+
+            run.started_execing_time = claim_time
+            run.delivery_count += 1
+            run.lease_count += 1
+            db_session.commit()
+            return run
+
+    def _pop_oldest_run_id(self, languages):
+        for is_priority in (True, False):
+            lanes = [
+                lane
+                for (lane_is_priority, language), lane in self.lanes.items()
+                if lane
+                and lane_is_priority == is_priority
+                and (languages is None or language in languages)
+            ]
+            if lanes:
+                return heapq.heappop(min(lanes, key=lambda x: x[0]))[1]
+
+        return None
+
+    def _get_expired_runs(self, claimed_before):
+        with self.lock:
+            expired_run_ids = [
+                run_id
+                for run_id, claim_time in self.leases.items()
+                if claim_time < claimed_before
+            ]
+            for run_id in expired_run_ids:
+                del self.leases[run_id]
+
+        if not expired_run_ids:
+            return []
+
+        return model.Run.query.filter(
+            model.Run.id.in_(expired_run_ids),
+            model.Run.finished_execing_time == None,
+        ).all()
+
+
+_queue = DatabaseRunQueue()
+
+
+def init_app(app):
+    """
+    Sets up the queue backend from the app's config
+
+    The backend is picked with RUN_QUEUE_BACKEND, which is one of "database"
+    and "memory".
+
+    Params:
+        app (Flask): the flask app
+    """
+    global _queue
+
+    backend_name = app.config.get("RUN_QUEUE_BACKEND") or "database"
+    if backend_name == "database":
+        _queue = DatabaseRunQueue()
+    elif backend_name == "memory":
+        _queue = MemoryRunQueue()
+    else:
+        raise RunQueueBackendException(
+            "Unknown run queue backend: {}".format(backend_name)
+        )
+
+
+def enqueue(run):
+    """Queues a committed run, see RunQueue.enqueue"""
+    _queue.enqueue(run)
+
+
+def claim(max_runs, languages=None):
+    """Claims runs from the front of the queue, see RunQueue.claim"""
+    return _queue.claim(max_runs, languages)
+
+
+def complete(run, lease_id):
+    """Ends a run's lease once its output is recorded, see RunQueue.complete"""
+    return _queue.complete(run, lease_id)
+
+
+def release(run, lease_id):
+    """Returns a claimed run to the queue, see RunQueue.release"""
+    return _queue.release(run, lease_id)
+
+
+def requeue_expired(now=None):
+    """Releases every run whose lease has expired, see RunQueue.requeue_expired"""
+    return _queue.requeue_expired(now)
+
+
+def get_dead_letters():
+    """Gets the dead-lettered runs, see RunQueue.get_dead_letters"""
+    return _queue.get_dead_letters()
+
+
+def get_lease_id(run):
+    """
+    Gets the id of a claimed run's current lease
+
+    Params:
+        run (model.Run): the claimed run
+
+    Returns:
+        int: the lease id
+    """
+    return run.lease_count
+
+
+def get_lease_expiration(run):
+    """
+    Gets the time a claimed run's lease expires
+
+    Params:
+        run (model.Run): the claimed run
+
+    Returns:
+        datetime: the expiration time
+    """
+    return run.started_execing_time + datetime.timedelta(
+        minutes=util.EXECUTOR_TIMEOUT_MINS
+    )
@@ -0,0 +1,220 @@
+"""
+Keeps the scoreboard's ICPC style aggregates up to date, so ranking reads one
+row per defendant and problem instead of every submission
+
+Whenever a verdict is recorded the aggregate of its (contest, user, problem)
+is recomputed from that defendant's submissions to the problem, in the same
+transaction as the verdict, so the scoreboard never misses a verdict that was
+committed. Recomputing instead of incrementing keeps the aggregate correct
+when verdicts arrive out of submission order, and it only reads a handful of
+runs.
+
+A defendant's penalty on a solved problem is the number of minutes from the
+contest start to the first passing submission, plus a fixed penalty for each
+failed submission made before it. Unsolved problems have no penalty.
+"""
+import model
+from database import db_session, insert_ignoring_conflicts
+
+FAILED_RUN_PENALTY_MINUTES = 20
+
+
+def get_score_key(run):
+    """
+    Gets the aggregate a run counts towards. This should be called before
+    committing, as some runs are deleted once they're judged.
+
+    Returns:
+        tuple: the (contest_id, user_id, problem_id), or None if the run doesn't
+            count towards scores
+    """
+    if not run.is_submission or run.problem_id is None:
+        return None
+
+    return (run.contest_id, run.user_id, run.problem_id)
+
+
+def update_scores(score_keys):
+    """
+    Recomputes the aggregates of the given score keys from the verdicts in the
+    session, which should be called in the transaction that records them
+
+    Params:
+        score_keys (iterable): score keys from get_score_key, None is ignored
+
+    Note:
+        the changes are not committed
+    """
+    # the session isn't autoflushed, and the verdicts are read back
+    db_session.flush()
+
+    # aggregates are always locked in the same order, so concurrent
+    # transactions updating several of them can't deadlock
+    for score_key in sorted({x for x in score_keys if x is not None}):
+        _update_score(*score_key)
+
+
+def rebuild_scores(contest_id=None):
+    """
+    Recomputes every aggregate, used when a contest's start or freeze time
+    changes and to fill in aggregates for runs judged before they existed
+
+    The old aggregates are deleted and the new ones inserted in the caller's
+    transaction, so readers see either the old scoreboard or the new one and
+    never a partial one.
+
+    Params:
+        contest_id (int): only rebuild this contest's aggregates, or None to
+            rebuild every contest's
+
+    Note:
+        the changes are not committed, the score cache should be invalidated
+        once they are
+    """
+    score_query = model.ContestProblemScore.query
+    # like get_score_key, runs without a problem, such as the executioners'
+    # version run, don't count towards scores
+    runs_query = model.Run.query.filter(
+        model.Run.is_submission == True, model.Run.problem_id != None
+    )
+    if contest_id is not None:
+        score_query = score_query.filter_by(contest_id=contest_id)
+        runs_query = runs_query.filter(model.Run.contest_id == contest_id)
+
+    score_query.delete(synchronize_session=False)
+
+    score_keys = runs_query.with_entities(
+        model.Run.contest_id, model.Run.user_id, model.Run.problem_id
+    ).distinct()
+    update_scores(list(score_keys))
+
+
+def get_user_points(contest_id, defendants, problems, is_frozen=False):
+    """
+    Builds the scoreboard, ordered by the number of solved problems and then by
+    penalty
+
+    Params:
+        contest_id (int): the contest's id
+        defendants (list): the contest's defendants
+        problems (list): the contest's enabled problems
+        is_frozen (bool): whether to use the frozen scoreboard's aggregates
+
+    Returns:
+        list: each defendant's score
+    """
+    scores = {
+        (x.user_id, x.problem_id): x
+        for x in model.ContestProblemScore.query.filter_by(contest_id=contest_id)
+    }
+
+    user_points = []
+    for user in defendants:
+        problem_states = {}
+        penalty = 0
+        for problem in problems:
+            score = scores.get((user.id, problem.id))
+            if score is None:
+                problem_states[problem.slug] = False
+            elif is_frozen:
+                problem_states[problem.slug] = score.frozen_solve_time is not None
+                penalty += score.frozen_penalty_minutes
+            else:
+                problem_states[problem.slug] = score.solve_time is not None
+                penalty += score.penalty_minutes
+
+        user_points.append(
+            {
+                "user": user.get_output_dict(),
+                "num_solved": len([x for x in problem_states.values() if x]),
+                "penalty": penalty,
+                "problem_states": problem_states,
+            }
+        )
+
+    user_points.sort(key=lambda x: (x["num_solved"], -x["penalty"]), reverse=True)
+    return user_points
+
+
+def _update_score(contest_id, user_id, problem_id):
+    """Recomputes a single aggregate from the defendant's judged submissions"""
+    # the aggregate is created up front, rather than added to the session,
+    # so concurrent transactions lock the same row instead of both inserting it
+    db_session.execute(
+        insert_ignoring_conflicts(model.ContestProblemScore.__table__).values(
+            contest_id=contest_id,
+            user_id=user_id,
+            problem_id=problem_id,
+            num_failed=0,
+            penalty_minutes=0,
+            frozen_num_failed=0,
+            frozen_penalty_minutes=0,
+        )
+    )
+
+    score_query = model.ContestProblemScore.query.filter_by(
+        contest_id=contest_id, user_id=user_id, problem_id=problem_id
+    )
+    if db_session.bind.dialect.name == "postgresql":
+        # serializes concurrent recomputes, so the last one to commit has seen
+        # every verdict committed before it
+        score_query = score_query.with_for_update()
+    score = score_query.one()
+
+    verdicts = (
+        model.Run.query.filter(
+            model.Run.contest_id == contest_id,
+            model.Run.user_id == user_id,
+            model.Run.problem_id == problem_id,
+            model.Run.is_submission == True,
+            model.Run.is_passed != None,
+            model.Run.finished_execing_time != None,
+        )
+        .order_by(model.Run.submit_time)
+        .with_entities(model.Run.submit_time, model.Run.is_passed)
+        .all()
+    )
+
+    if not verdicts:
+        db_session.delete(score)
+        return
+
+    contest = model.Contest.query.get(contest_id)
+
+    score.solve_time, score.num_failed, score.penalty_minutes = _aggregate(
+        verdicts, contest.start_time
+    )
+
+    if contest.freeze_time is not None:
+        verdicts = [x for x in verdicts if x[0] < contest.freeze_time]
+    (
+        score.frozen_solve_time,
+        score.frozen_num_failed,
+        score.frozen_penalty_minutes,
+    ) = _aggregate(verdicts, contest.start_time)
+
+
+def _aggregate(verdicts, start_time):
+    """
+    Aggregates verdicts into a solve time, failed count and penalty
+
+    Params:
+        verdicts (list): (submit_time, is_passed) tuples ordered by submit time
+        start_time (datetime): the contest's start time
+
+    Returns:
+        tuple: the solve time, the number of failed submissions before the
+            solve and the penalty minutes
+    """
+    num_failed = 0
+    for submit_time, is_passed in verdicts:
+        if is_passed:
+            solve_minutes = (
+                max(int((submit_time - start_time).total_seconds()), 0) // 60
+            )
+            penalty_minutes = solve_minutes + num_failed * FAILED_RUN_PENALTY_MINUTES
+            return submit_time, num_failed, penalty_minutes
+
+        num_failed += 1
+
+    return None, num_failed, 0
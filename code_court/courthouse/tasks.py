@@ -1,17 +1,14 @@
 """
 Defines tasks for uwsgi to run at regular intervals
 """
-import datetime
 import os
 
 import uwsgidecorators
 
 from flask import Flask
 
-import model
-from database import db_session
-
-EXECUTOR_TIMEOUT_MINS = 3
+import cache
+import run_queue
 
 
 @uwsgidecorators.timer(15, target="spooler")
@@ -22,17 +19,10 @@ def reset_overdue_runs(signum):
     ) or "sqlite:////tmp/code_court.db"
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-    # reset overdue runs
-    overdue_runs = model.Run.query.filter(
-        model.Run.finished_execing_time == None
-    ).filter(
-        model.Run.started_execing_time != None
-    ).filter(
-        (datetime.datetime.utcnow() - datetime.timedelta(minutes=EXECUTOR_TIMEOUT_MINS))
-        > model.Run.started_execing_time
-    ).all()
-
-    for run in overdue_runs:
-        run.started_execing_time = None
+    # the cached runs of users whose runs are dead-lettered are invalidated in
+    # the workers' cache
+    app.config["CACHE_BACKEND"] = os.getenv("CODE_COURT_CACHE_BACKEND")
+    cache.init_app(app)
 
-    db_session.commit()
+    # return runs whose lease expired to the queue
+    run_queue.requeue_expired()
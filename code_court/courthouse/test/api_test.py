@@ -1,12 +1,22 @@
+import datetime
 import json
+import threading
+import time
 
 from base64 import b64encode
+from unittest import mock
+
+from sqlalchemy import event
 
 from base_test import BaseTest
 
+import cache
 import model
+import run_queue
+import scoreboard
 import util
-from database import db_session
+import writ_notify
+from database import db_session, engine
 
 
 class APITestCase(BaseTest):
@@ -61,20 +71,47 @@ class APITestCase(BaseTest):
         self.assertEqual(rv.status_code, 200)
         self.assertEqual(json.loads(rv.data.decode("utf-8"))["status"], "unavailable")
 
+        # writs can only be given back with their lease
+        rv = self.app.post(
+            "/api/return-without-run/{}".format(writ_data["run_id"]),
+            headers=auth_headers,
+        )
+        self.assertEqual(rv.status_code, 400)
+
         # give back writ
         rv = self.app.post(
             "/api/return-without-run/{}".format(writ_data["run_id"]),
             headers=auth_headers,
+            data=json.dumps({"lease_id": writ_data["lease_id"]}),
+            content_type="application/json",
         )
         self.assertEqual(rv.status_code, 200)
+        stale_lease_id = writ_data["lease_id"]
 
         # get writ again
         rv = self.app.get("/api/get-writ", headers=auth_headers)
         self.assertEqual(rv.status_code, 200)
         writ_data = json.loads(rv.data.decode("utf-8"))
+        self.assertNotEqual(writ_data["lease_id"], stale_lease_id)
+
+        # the returned writ's lease can't submit or return the run anymore
+        rv = self.app.post(
+            "/api/submit-writ/{}".format(writ_data["run_id"]),
+            headers=auth_headers,
+            data=json.dumps({"output": "run_output", "lease_id": stale_lease_id}),
+            content_type="application/json",
+        )
+        self.assertEqual(rv.status_code, 400)
+        rv = self.app.post(
+            "/api/return-without-run/{}".format(writ_data["run_id"]),
+            headers=auth_headers,
+            data=json.dumps({"lease_id": stale_lease_id}),
+            content_type="application/json",
+        )
+        self.assertEqual(rv.status_code, 400)
 
         # submit writ
-        submit_data = {"output": "run_output"}
+        submit_data = {"output": "run_output", "lease_id": writ_data["lease_id"]}
         rv = self.app.post(
             "/api/submit-writ/{}".format(writ_data["run_id"]),
             headers=auth_headers,
@@ -88,6 +125,690 @@ class APITestCase(BaseTest):
         self.assertEqual(rv.status_code, 200)
         self.assertEqual(json.loads(rv.data.decode("utf-8"))["status"], "unavailable")
 
+    def test_executioner_token(self):
+        """Tests exchanging an executioner's password for a token"""
+        setup_contest()
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+        rv = self.app.post("/api/executioner-token", headers=auth_headers)
+        self.assertEqual(rv.status_code, 200)
+        token_data = json.loads(rv.data.decode("utf-8"))
+        self.assertEqual(token_data["expires_in"], util.EXECUTIONER_TOKEN_TTL_SECONDS)
+
+        token_headers = {"Authorization": "Bearer {}".format(token_data["token"])}
+        with mock.patch.object(
+            model.User, "verify_password", side_effect=AssertionError
+        ):
+            rv = self.app.get("/api/get-writ", headers=token_headers)
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(json.loads(rv.data.decode("utf-8"))["status"], "found")
+
+        rv = self.app.get(
+            "/api/get-writ", headers={"Authorization": "Bearer notatoken"}
+        )
+        self.assertEqual(rv.status_code, 401)
+
+        # tokens are revoked when users change
+        util.invalidate_credentials()
+        rv = self.app.get("/api/get-writ", headers=token_headers)
+        self.assertEqual(rv.status_code, 401)
+
+    def test_executioner_credential_cache(self):
+        """Tests that an executioner's password is only checked with bcrypt once"""
+        setup_contest()
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+        wrong_auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:wrong").decode("ascii")
+        }
+        with mock.patch.object(
+            model.User, "verify_password", autospec=True, return_value=True
+        ) as verify_password:
+            for _ in range(3):
+                rv = self.app.get("/api/get-writ", headers=auth_headers)
+                self.assertEqual(rv.status_code, 200)
+            self.assertEqual(verify_password.call_count, 1)
+
+            # other passwords are still checked
+            self.app.get("/api/get-writ", headers=wrong_auth_headers)
+            self.assertEqual(verify_password.call_count, 2)
+
+    def test_executioner_batch_api(self):
+        """Tests claiming and submitting a batch of writs in one request"""
+        setup_contest()
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+
+        # claim every waiting writ, there is also the language version run
+        rv = self.app.get("/api/get-writs?max=5", headers=auth_headers)
+        self.assertEqual(rv.status_code, 200)
+        writs_data = json.loads(rv.data.decode("utf-8"))
+
+        self.assertEqual(writs_data["status"], "found")
+        self.assertEqual(len(writs_data["writs"]), 2)
+        for writ in writs_data["writs"]:
+            self.assertIn("source_code", writ)
+            self.assertIn("run_id", writ)
+            self.assertIsNotNone(util.str_to_dt(writ["lease_expiration"]))
+
+        # verify no more writs
+        rv = self.app.get("/api/get-writs?max=5", headers=auth_headers)
+        self.assertEqual(rv.status_code, 200)
+        writs_data_after = json.loads(rv.data.decode("utf-8"))
+        self.assertEqual(writs_data_after["status"], "unavailable")
+        self.assertEqual(writs_data_after["writs"], [])
+
+        # submit a contestant's writ along with an invalid one
+        contestant_writs = [
+            x
+            for x in writs_data["writs"]
+            if model.Run.query.get(x["run_id"]).user.username == "testuser"
+        ]
+        self.assertEqual(len(contestant_writs), 1)
+        contestant_run_ids = [x["run_id"] for x in contestant_writs]
+        submit_data = {
+            "writs": [
+                {
+                    "run_id": contestant_run_ids[0],
+                    "lease_id": contestant_writs[0]["lease_id"],
+                    "output": "run_output",
+                },
+                {"run_id": 9999, "lease_id": 1, "output": "run_output"},
+            ]
+        }
+        rv = self.app.post(
+            "/api/submit-writs",
+            headers=auth_headers,
+            data=json.dumps(submit_data),
+            content_type="application/json",
+        )
+        self.assertEqual(rv.status_code, 200)
+        statuses = json.loads(rv.data.decode("utf-8"))["statuses"]
+        self.assertEqual(statuses[str(contestant_run_ids[0])], "Good")
+        self.assertEqual(statuses["9999"], "NotFound")
+
+        # a writ is only submitted once
+        rv = self.app.post(
+            "/api/submit-writs",
+            headers=auth_headers,
+            data=json.dumps(submit_data),
+            content_type="application/json",
+        )
+        statuses = json.loads(rv.data.decode("utf-8"))["statuses"]
+        self.assertEqual(statuses[str(contestant_run_ids[0])], "LeaseLost")
+
+        run = model.Run.query.get(contestant_run_ids[0])
+        self.assertIsNotNone(run.finished_execing_time)
+        self.assertEqual(run.run_output, "run_output")
+        self.assertFalse(run.is_passed)
+
+    def test_executioner_rejudged_lease(self):
+        """Tests that a writ claimed before its run was rejudged can't submit
+        the run's output"""
+        setup_contest()
+        self.login("admin", "pass")
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+
+        def claim_contestant_writ():
+            rv = self.app.get("/api/get-writs?max=5", headers=auth_headers)
+            return [
+                x
+                for x in json.loads(rv.data.decode("utf-8"))["writs"]
+                if model.Run.query.get(x["run_id"]).user.username == "testuser"
+            ][0]
+
+        def submit(writ_data, lease_id):
+            return self.app.post(
+                "/api/submit-writ/{}".format(writ_data["run_id"]),
+                headers=auth_headers,
+                data=json.dumps({"lease_id": lease_id, "output": "run_output"}),
+                content_type="application/json",
+            )
+
+        stale_writ = claim_contestant_writ()
+        self.app.get("/admin/runs/{}/rejudge".format(stale_writ["run_id"]))
+
+        # before and after the rejudged run is claimed again
+        self.assertEqual(submit(stale_writ, stale_writ["lease_id"]).status_code, 400)
+        writ_data = claim_contestant_writ()
+        self.assertEqual(writ_data["run_id"], stale_writ["run_id"])
+        self.assertEqual(submit(stale_writ, stale_writ["lease_id"]).status_code, 400)
+
+        self.assertEqual(submit(writ_data, writ_data["lease_id"]).status_code, 200)
+
+    def test_executioner_batch_size(self):
+        """Tests that batches only have as many writs as can run in a lease"""
+        setup_contest()
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+
+        # there are two runs queued, the contestant's and the language version run
+        writ_seconds = util.EXECUTOR_TIMEOUT_MINS * 60 // 2 + 1
+        rv = self.app.get(
+            "/api/get-writs?max=5&writ_timeout={}".format(writ_seconds),
+            headers=auth_headers,
+        )
+        self.assertEqual(len(json.loads(rv.data.decode("utf-8"))["writs"]), 1)
+
+        # writs that can't finish in a lease are still handed out one at a time
+        rv = self.app.get(
+            "/api/get-writs?max=5&writ_timeout=100000", headers=auth_headers
+        )
+        self.assertEqual(len(json.loads(rv.data.decode("utf-8"))["writs"]), 1)
+
+    def test_executioner_long_poll(self):
+        """Tests that get-writ waits for a run to be queued when asked to"""
+        setup_contest()
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+
+        # drain the queue, there is also the language version run
+        self.app.get("/api/get-writ", headers=auth_headers)
+        self.app.get("/api/get-writ", headers=auth_headers)
+
+        # an empty queue waits for the full timeout
+        start = time.time()
+        rv = self.app.get("/api/get-writ?wait=1", headers=auth_headers)
+        self.assertGreaterEqual(time.time() - start, 1)
+        self.assertEqual(json.loads(rv.data.decode("utf-8"))["status"], "unavailable")
+
+        # queue a run from another thread while waiting
+        run_id = model.Run.query.filter_by(is_submission=True).first().id
+        db_session.commit()
+
+        def requeue_run():
+            time.sleep(0.2)
+            run = model.Run.query.get(run_id)
+            run.started_execing_time = None
+            db_session.commit()
+            db_session.remove()
+            writ_notify.notify_run_queued()
+
+        thread = threading.Thread(target=requeue_run)
+        thread.start()
+
+        start = time.time()
+        rv = self.app.get("/api/get-writ?wait=10", headers=auth_headers)
+        thread.join()
+
+        self.assertLess(time.time() - start, 10)
+        writ_data = json.loads(rv.data.decode("utf-8"))
+        self.assertEqual(writ_data["status"], "found")
+        self.assertEqual(writ_data["run_id"], run_id)
+
+    def test_executioner_long_poll_limit(self):
+        """Tests that get-writ doesn't wait once too many executioners are
+        waiting"""
+        setup_contest()
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+
+        # drain the queue, there is also the language version run
+        self.app.get("/api/get-writ", headers=auth_headers)
+        self.app.get("/api/get-writ", headers=auth_headers)
+
+        queue_version = writ_notify.get_queue_version()
+        waiters = [
+            threading.Thread(target=writ_notify.wait_for_run, args=(queue_version, 10))
+            for _ in range(writ_notify.MAX_WAITERS)
+        ]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.2)
+
+        try:
+            start = time.time()
+            rv = self.app.get("/api/get-writ?wait=10", headers=auth_headers)
+            self.assertLess(time.time() - start, 1)
+            self.assertEqual(
+                json.loads(rv.data.decode("utf-8"))["status"], "unavailable"
+            )
+        finally:
+            writ_notify.notify_run_queued()
+            for waiter in waiters:
+                waiter.join()
+
+    def test_executioner_output_verdict(self):
+        """Tests judging submissions whose output was compared by the executioner"""
+        for run in model.Run.query.all():
+            db_session.delete(run)
+        db_session.commit()
+
+        setup_contest()
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+
+        rv = self.app.get("/api/get-writ", headers=auth_headers)
+        writ_data = json.loads(rv.data.decode("utf-8"))
+        run = model.Run.query.get(writ_data["run_id"])
+        rv = self.app.get(
+            "/api/test-data/{}".format(writ_data["expected_output_hash"]),
+            headers=auth_headers,
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.data.decode("utf-8"), run.correct_output)
+
+        # the verdict is used instead of comparing the output excerpt
+        submit_data = {
+            "lease_id": writ_data["lease_id"],
+            "output": "1\n2\n...",
+            "state": "Executed",
+            "is_output_matching": True,
+        }
+        rv = self.app.post(
+            "/api/submit-writ/{}".format(run.id),
+            headers=auth_headers,
+            data=json.dumps(submit_data),
+            content_type="application/json",
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(run.is_passed)
+        self.assertEqual(run.state, model.RunState.SUCCESSFUL)
+
+        run.finished_execing_time = None
+        db_session.commit()
+        submit_data["is_output_matching"] = "yes"
+        rv = self.app.post(
+            "/api/submit-writ/{}".format(run.id),
+            headers=auth_headers,
+            data=json.dumps(submit_data),
+            content_type="application/json",
+        )
+        self.assertEqual(rv.status_code, 400)
+
+    def test_executioner_test_cases(self):
+        """Tests judging submissions to problems with multiple test cases"""
+        for run in model.Run.query.all():
+            db_session.delete(run)
+        db_session.commit()
+
+        setup_contest()
+        problem = model.Problem.query.filter_by(slug="fizzbuzz").one()
+        problem.set_test_cases(
+            [("1", "1"), ("3", "1\n2\nFizz"), ("5", "1\n2\nFizz\n4\nBuzz")]
+        )
+        db_session.commit()
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+
+        def judge(output, test_case_results):
+            run = model.Run.query.first()
+            self.app.get("/admin/runs/{}/rejudge".format(run.id))
+            rv = self.app.get("/api/get-writ", headers=auth_headers)
+            writ_data = json.loads(rv.data.decode("utf-8"))
+            self.assertEqual(
+                [x["case_number"] for x in writ_data["test_cases"]], [1, 2, 3]
+            )
+            rv = self.app.get(
+                "/api/test-data/{}".format(writ_data["test_cases"][1]["input_hash"]),
+                headers=auth_headers,
+            )
+            self.assertEqual(rv.data.decode("utf-8"), "3")
+
+            submit_data = {
+                "lease_id": writ_data["lease_id"],
+                "output": output,
+                "state": "Executed",
+                "test_case_results": test_case_results,
+            }
+            rv = self.app.post(
+                "/api/submit-writ/{}".format(writ_data["run_id"]),
+                headers=auth_headers,
+                data=json.dumps(submit_data),
+                content_type="application/json",
+            )
+            self.assertEqual(rv.status_code, 200)
+            return model.Run.query.get(writ_data["run_id"])
+
+        self.login("admin", "pass")
+
+        def result(case_number, is_passed):
+            return {
+                "case_number": case_number,
+                "state": "Executed",
+                "is_passed": is_passed,
+                "time": 0.01,
+            }
+
+        # all cases pass
+        run = judge("1\n2\nFizz\n4\nBuzz\n", [result(x, True) for x in (1, 2, 3)])
+        self.assertTrue(run.is_passed)
+        self.assertEqual(run.state, model.RunState.SUCCESSFUL)
+        self.assertIsNone(run.failed_test_case)
+
+        # the executioner stopped at the second case
+        run = judge("1\n2\n3", [result(1, True), result(2, False)])
+        self.assertFalse(run.is_passed)
+        self.assertEqual(run.state, model.RunState.FAILED)
+        self.assertEqual(run.failed_test_case, 2)
+        self.assertEqual(len(run.get_output_dict()["test_case_results"]), 2)
+
+        rv = self.app.get("/admin/runs/run/{}/".format(run.id))
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn(b"test_case_number", rv.data)
+
+        # not every case was run
+        run = judge("1\n2\nFizz", [result(1, True), result(2, True)])
+        self.assertFalse(run.is_passed)
+
+        # malformed results are rejected
+        run = model.Run.query.first()
+        self.app.get("/admin/runs/{}/rejudge".format(run.id))
+        rv = self.app.get("/api/get-writ", headers=auth_headers)
+        writ_data = json.loads(rv.data.decode("utf-8"))
+        rv = self.app.post(
+            "/api/submit-writ/{}".format(writ_data["run_id"]),
+            headers=auth_headers,
+            data=json.dumps(
+                {
+                    "lease_id": writ_data["lease_id"],
+                    "output": "1",
+                    "test_case_results": [{"case": 1}],
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(rv.status_code, 400)
+
+    def test_scoreboard(self):
+        """Tests that the scoreboard's ICPC penalties are kept up to date as
+        verdicts arrive"""
+        for run in model.Run.query.all():
+            db_session.delete(run)
+        db_session.commit()
+
+        setup_contest()
+        contest = model.Contest.query.filter_by(name="test_contest").one()
+        problem = model.Problem.query.filter_by(slug="fizzbuzz").one()
+        python = model.Language.query.filter_by(name="python").one()
+        roles = {x.name: x for x in model.UserRole.query.all()}
+        other_user = model.User(
+            "otheruser", "Other User", "pass", user_roles=[roles["defendant"]]
+        )
+        contest.users.append(other_user)
+
+        # a judged failing and passing run for the other user
+        for is_passed, submit_time in (
+            (False, "2017-02-05T22:50:00Z"),
+            (True, "2017-02-05T23:00:00Z"),
+        ):
+            run = model.Run(
+                other_user,
+                contest,
+                python,
+                problem,
+                util.str_to_dt(submit_time),
+                "print(1)",
+                "",
+                "",
+                True,
+            )
+            run.is_passed = is_passed
+            run.started_execing_time = datetime.datetime.utcnow()
+            run.finished_execing_time = datetime.datetime.utcnow()
+            db_session.add(run)
+        db_session.commit()
+        scoreboard.rebuild_scores(contest.id)
+        db_session.commit()
+
+        def get_scores():
+            rv = self.app.get("/api/scores/{}".format(contest.id))
+            self.assertEqual(rv.status_code, 200)
+            scores = json.loads(rv.data.decode("utf-8"))
+            return [
+                (x["user"]["username"], x["num_solved"], x["penalty"]) for x in scores
+            ]
+
+        # solved 56 minutes after the contest start, plus 20 for the failed run
+        self.assertEqual(get_scores(), [("otheruser", 1, 76), ("testuser", 0, 0)])
+
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+
+        def judge_writ(is_output_matching):
+            rv = self.app.get("/api/get-writ", headers=auth_headers)
+            writ_data = json.loads(rv.data.decode("utf-8"))
+            submit_data = {
+                "lease_id": writ_data["lease_id"],
+                "output": "...",
+                "state": "Executed",
+                "is_output_matching": is_output_matching,
+            }
+            rv = self.app.post(
+                "/api/submit-writ/{}".format(writ_data["run_id"]),
+                headers=auth_headers,
+                data=json.dumps(submit_data),
+                content_type="application/json",
+            )
+            self.assertEqual(rv.status_code, 200)
+            return writ_data["run_id"]
+
+        # testuser solves fizzbuzz with no failed runs, so ranks first
+        run_id = judge_writ(True)
+        self.assertEqual(get_scores(), [("testuser", 1, 56), ("otheruser", 1, 76)])
+
+        # rejudging replaces the old verdict instead of adding to it
+        self.login("admin", "pass")
+        self.app.get("/admin/runs/{}/rejudge".format(run_id))
+        self.assertEqual(judge_writ(False), run_id)
+        self.assertEqual(get_scores(), [("otheruser", 1, 76), ("testuser", 0, 0)])
+
+    def test_scoreboard_concurrent_verdicts(self):
+        """Tests that a verdict's aggregate is updated in the verdict's
+        transaction, even if another request creates the aggregate first"""
+        setup_contest()
+        user = model.User.query.filter_by(username="testuser").one()
+        run = model.Run.query.filter_by(user=user).one()
+        run.is_passed = True
+        run.finished_execing_time = datetime.datetime.utcnow()
+        score_key = scoreboard.get_score_key(run)
+        # sqlite only allows one writer, so the verdict is committed before the
+        # other request creates the aggregate
+        db_session.commit()
+
+        other_inserts = []
+
+        def on_execute(conn, cursor, statement, *args):
+            if "INSERT" in statement and "contest_problem_score" in statement:
+                if not other_inserts:
+                    other_inserts.append(statement)
+                    with engine.connect() as other_conn:
+                        other_conn.execute(
+                            model.ContestProblemScore.__table__.insert().values(
+                                contest_id=score_key[0],
+                                user_id=score_key[1],
+                                problem_id=score_key[2],
+                                num_failed=0,
+                                penalty_minutes=0,
+                                frozen_num_failed=0,
+                                frozen_penalty_minutes=0,
+                            )
+                        )
+
+        event.listen(engine, "before_cursor_execute", on_execute)
+        try:
+            scoreboard.update_scores([score_key])
+        finally:
+            event.remove(engine, "before_cursor_execute", on_execute)
+        db_session.commit()
+
+        self.assertEqual(len(other_inserts), 1)
+        score = model.ContestProblemScore.query.get(score_key)
+        self.assertEqual(score.solve_time, run.submit_time)
+
+    def test_scoreboard_rebuild(self):
+        """Tests that other requests see the old aggregates until a rebuild is
+        committed, and the new ones after it"""
+        setup_contest()
+        contest = model.Contest.query.filter_by(name="test_contest").one()
+        run = model.Run.query.filter(
+            model.Run.contest_id == contest.id, model.Run.is_submission == True
+        ).one()
+        run.is_passed = True
+        run.finished_execing_time = datetime.datetime.utcnow()
+        db_session.commit()
+        scoreboard.rebuild_scores(contest.id)
+        db_session.commit()
+
+        def get_penalties():
+            with engine.connect() as other_conn:
+                return [
+                    x.penalty_minutes
+                    for x in other_conn.execute(
+                        model.ContestProblemScore.__table__.select()
+                    )
+                ]
+
+        # solved 56 minutes after the contest start
+        self.assertEqual(get_penalties(), [56])
+
+        # the contest starts later, so the solve was sooner after it
+        contest.start_time += datetime.timedelta(minutes=10)
+        scoreboard.rebuild_scores(contest.id)
+        self.assertEqual(get_penalties(), [56])
+
+        db_session.commit()
+        self.assertEqual(get_penalties(), [46])
+
+    def test_scoreboard_rebuild_version_run(self):
+        """Tests that rebuilding every contest's aggregates skips runs without a
+        problem, like the pending version run"""
+        setup_contest()
+        version_run = model.Run.query.filter(
+            model.Run.is_submission == True, model.Run.problem_id == None
+        ).first()
+        self.assertIsNotNone(version_run)
+        run = model.Run.query.filter(
+            model.Run.user.has(username="testuser"), model.Run.is_submission == True
+        ).one()
+        run.is_passed = True
+        run.finished_execing_time = datetime.datetime.utcnow()
+        db_session.commit()
+
+        scoreboard.rebuild_scores()
+        db_session.commit()
+
+        scores = model.ContestProblemScore.query.all()
+        self.assertTrue(scores)
+        self.assertNotIn(None, [x.problem_id for x in scores])
+
+    def test_scoreboard_freeze(self):
+        """Tests that the public scoreboard hides verdicts on submissions made
+        after the freeze until the contest is unfrozen"""
+        for run in model.Run.query.all():
+            db_session.delete(run)
+        db_session.commit()
+
+        setup_contest()
+        contest = model.Contest.query.filter_by(name="test_contest").one()
+        contest.freeze_time = util.str_to_dt("2017-02-05T23:30:00Z")
+        problem = model.Problem.query.filter_by(slug="fizzbuzz").one()
+        python = model.Language.query.filter_by(name="python").one()
+        roles = {x.name: x for x in model.UserRole.query.all()}
+        other_user = model.User(
+            "otheruser", "Other User", "pass", user_roles=[roles["defendant"]]
+        )
+        contest.users.append(other_user)
+
+        # a failing run before the freeze and a passing run after it
+        for is_passed, submit_time in (
+            (False, "2017-02-05T23:10:00Z"),
+            (True, "2017-02-05T23:40:00Z"),
+        ):
+            run = model.Run(
+                other_user,
+                contest,
+                python,
+                problem,
+                util.str_to_dt(submit_time),
+                "print(1)",
+                "",
+                "",
+                True,
+            )
+            run.is_passed = is_passed
+            run.started_execing_time = datetime.datetime.utcnow()
+            run.finished_execing_time = datetime.datetime.utcnow()
+            db_session.add(run)
+        db_session.commit()
+        scoreboard.rebuild_scores(contest.id)
+        db_session.commit()
+
+        def get_scores(url):
+            rv = self.app.get(url)
+            self.assertEqual(rv.status_code, 200)
+            scores = json.loads(rv.data.decode("utf-8"))
+            return sorted(
+                (x["user"]["username"], x["num_solved"], x["penalty"]) for x in scores
+            )
+
+        public_url = "/api/scores/{}".format(contest.id)
+        live_url = "/api/scores/{}/live".format(contest.id)
+
+        self.assertEqual(
+            get_scores(public_url), [("otheruser", 0, 0), ("testuser", 0, 0)]
+        )
+
+        # the live scoreboard is only for judges
+        rv = self.app.get(live_url)
+        self.assertNotEqual(rv.status_code, 200)
+
+        self.login("admin", "pass")
+        self.assertEqual(
+            get_scores(live_url), [("otheruser", 1, 116), ("testuser", 0, 0)]
+        )
+
+        # testuser's run was submitted before the freeze, so it still counts
+        auth_headers = {
+            "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
+        }
+        rv = self.app.get("/api/get-writ", headers=auth_headers)
+        writ_data = json.loads(rv.data.decode("utf-8"))
+        rv = self.app.post(
+            "/api/submit-writ/{}".format(writ_data["run_id"]),
+            headers=auth_headers,
+            data=json.dumps(
+                {
+                    "lease_id": writ_data["lease_id"],
+                    "output": "...",
+                    "is_output_matching": True,
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(
+            get_scores(public_url), [("otheruser", 0, 0), ("testuser", 1, 56)]
+        )
+
+        rv = self.app.get(
+            "/admin/contests/unfreeze/{}/".format(contest.id), follow_redirects=True
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(
+            get_scores(public_url), [("otheruser", 1, 116), ("testuser", 1, 56)]
+        )
+
     def test_rejudging(self):
         """Tests rejudging endpoint"""
         # A version run is being added on db startup
@@ -115,6 +836,65 @@ class APITestCase(BaseTest):
         self.assertIsNone(test_run.finished_execing_time)
         self.assertIsNone(test_run.run_output)
 
+    def test_concurrent_writ_claiming(self):
+        """Tests that concurrent claimers never claim the same run twice"""
+        setup_contest()
+
+        contest = model.Contest.query.filter_by(name="test_contest").one()
+        user = model.User.query.filter_by(username="testuser").one()
+        problem = model.Problem.query.filter_by(slug="fizzbuzz").one()
+        python = model.Language.query.filter_by(name="python").one()
+
+        for i in range(40):
+            run = model.Run(
+                user,
+                contest,
+                python,
+                problem,
+                datetime.datetime.utcnow(),
+                "print('hello')",
+                problem.secret_input,
+                problem.secret_output,
+                True,
+            )
+            run.is_priority = i % 5 == 0
+            db_session.add(run)
+        db_session.commit()
+
+        expected_run_ids = {
+            run.id
+            for run in model.Run.query.filter_by(started_execing_time=None).all()
+        }
+        db_session.remove()
+
+        num_claimers = 8
+        claimed_run_ids = []
+        errors = []
+        barrier = threading.Barrier(num_claimers)
+
+        def claimer():
+            try:
+                barrier.wait()
+                while True:
+                    runs = run_queue.claim(1)
+                    if not runs:
+                        break
+                    claimed_run_ids.append(runs[0].id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db_session.remove()
+
+        threads = [threading.Thread(target=claimer) for _ in range(num_claimers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(claimed_run_ids), len(set(claimed_run_ids)))
+        self.assertEqual(set(claimed_run_ids), expected_run_ids)
+
     def _judge_writ(self):
         auth_headers = {
             "Authorization": "Basic %s" % b64encode(b"testexec:epass").decode("ascii")
@@ -126,7 +906,9 @@ class APITestCase(BaseTest):
         self.app.post(
             "/api/submit-writ/{}".format(writ_data["run_id"]),
             headers=auth_headers,
-            data=json.dumps({"output": "run_output"}),
+            data=json.dumps(
+                {"lease_id": writ_data["lease_id"], "output": "run_output"}
+            ),
             content_type="application/json",
         )
 
@@ -158,6 +940,110 @@ class APITestCase(BaseTest):
         self.assertIn("fizzbuzz", problems)
 
         self.assertEqual(1, len(problems["fizzbuzz"]["runs"]))
+        self.assertNotIn("source_code", problems["fizzbuzz"]["runs"][0])
+
+        # unchanged responses aren't sent again
+        rv = self.jwt_get(
+            "/api/problems",
+            auth_token=token,
+            headers={"If-None-Match": rv.headers["ETag"]},
+        )
+        self.assertEqual(rv.status_code, 304)
+
+    def test_get_run(self):
+        """Tests the /api/run endpoint"""
+        setup_contest()
+        user = model.User.query.filter_by(username="testuser").one()
+        run = model.Run.query.filter_by(user_id=user.id).first()
+        token = self.get_jwt_token("testuser", "pass")
+
+        rv = self.jwt_get("/api/run/{}".format(run.id), auth_token=token)
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(
+            json.loads(rv.data.decode("utf-8"))["source_code"], run.source_code
+        )
+
+        rv = self.jwt_get(
+            "/api/run/{}".format(run.id),
+            auth_token=token,
+            headers={"If-None-Match": rv.headers["ETag"]},
+        )
+        self.assertEqual(rv.status_code, 304)
+
+        # other users can't see the run
+        roles = {x.name: x for x in model.UserRole.query.all()}
+        other_user = model.User(
+            "otheruser", "Other User", "pass", user_roles=[roles["defendant"]]
+        )
+        db_session.add(other_user)
+        db_session.commit()
+        token = self.get_jwt_token("otheruser", "pass")
+
+        rv = self.jwt_get("/api/run/{}".format(run.id), auth_token=token)
+        self.assertEqual(rv.status_code, 404)
+
+    def test_get_problems_query_count(self):
+        """Tests that the /api/problems queries don't grow with the number of
+        problems and runs"""
+        setup_contest()
+        token = self.get_jwt_token("testuser", "pass")
+
+        def count_queries():
+            cache.clear_all()
+            db_session.remove()
+            queries = []
+
+            def on_execute(*args):
+                queries.append(args)
+
+            event.listen(engine, "before_cursor_execute", on_execute)
+            try:
+                rv = self.jwt_get("/api/problems", auth_token=token)
+            finally:
+                event.remove(engine, "before_cursor_execute", on_execute)
+
+            self.assertEqual(rv.status_code, 200)
+            return len(queries), json.loads(rv.data.decode("utf-8"))
+
+        num_queries, problems = count_queries()
+        self.assertEqual(len(problems), 1)
+
+        contest = model.Contest.query.filter_by(name="test_contest").one()
+        user = model.User.query.filter_by(username="testuser").one()
+        python = model.Language.query.filter_by(name="python").one()
+        io_problem_type = model.ProblemType.query.filter_by(name="input-output").one()
+        for i in range(5):
+            problem = model.Problem(
+                io_problem_type,
+                "prob{}".format(i),
+                "Problem {}".format(i),
+                "",
+                "",
+                "",
+                "in{}".format(i),
+                "out{}".format(i),
+            )
+            contest.problems.append(problem)
+            for is_submission in (True, False):
+                db_session.add(
+                    model.Run(
+                        user,
+                        contest,
+                        python,
+                        problem,
+                        datetime.datetime.utcnow(),
+                        "print(1)",
+                        "in{}".format(i),
+                        "out{}".format(i),
+                        is_submission,
+                    )
+                )
+        db_session.commit()
+
+        num_queries_after, problems = count_queries()
+        self.assertEqual(len(problems), 6)
+        self.assertEqual(len(problems["prob0"]["runs"]), 2)
+        self.assertEqual(num_queries_after, num_queries)
 
     def test_get_current_user(self):
         """Tests the /api/current-user endpoint"""
@@ -181,6 +1067,37 @@ class APITestCase(BaseTest):
         contest = json.loads(rv.data.decode("utf-8"))
         self.assertEqual(contest.get("name"), "test_contest")
 
+    def test_identity_cache(self):
+        """Tests that JWT users are loaded from the identity cache until they change"""
+        setup_contest()
+        token = self.get_jwt_token("testuser", "pass")
+        self.jwt_get("/api/get-contest-info", auth_token=token)
+
+        queries = []
+
+        def on_execute(*args):
+            queries.append(args)
+
+        event.listen(engine, "before_cursor_execute", on_execute)
+        try:
+            rv = self.jwt_get("/api/get-contest-info", auth_token=token)
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(len(queries), 0)
+
+            contest = model.Contest.query.filter_by(name="test_contest").one()
+            contest.name = "renamed_contest"
+            db_session.commit()
+            util.invalidate_identities()
+
+            # the user, their roles and their contests are loaded in one query
+            del queries[:]
+            rv = self.jwt_get("/api/get-contest-info", auth_token=token)
+            self.assertEqual(len(queries), 1)
+            contest = json.loads(rv.data.decode("utf-8"))
+            self.assertEqual(contest.get("name"), "renamed_contest")
+        finally:
+            event.remove(engine, "before_cursor_execute", on_execute)
+
     def test_signup(self):
         """Tests the /api/signup endpoint"""
         setup_contest()
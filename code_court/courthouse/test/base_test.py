@@ -8,6 +8,7 @@ import sqlalchemy
 
 from web import app, setup_database
 
+import cache
 import model
 from database import db_session, engine, Base
 
@@ -33,6 +34,9 @@ class BaseTest(unittest.TestCase):
         logging.info("Setting up database")
         setup_database(app)
 
+        # cached responses are stale now the db is new
+        cache.clear_all()
+
     def login(self, username, password):
         with self.app:
             rv = self.app.post(
@@ -66,8 +70,7 @@ class BaseTest(unittest.TestCase):
         return j["access_token"]
 
     def jwt_get(self, url, auth_token=None, headers=None):
-        if not headers:
-            h = {}
+        h = dict(headers or {})
 
         if auth_token:
             h["Authorization"] = "Bearer " + auth_token
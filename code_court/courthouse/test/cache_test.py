@@ -0,0 +1,174 @@
+import json
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from base_test import BaseTest
+
+import cache
+import util
+from api_test import setup_contest
+
+
+class LRUBackendTestCase(unittest.TestCase):
+    """
+    Contains tests for the in-process cache backend
+    """
+
+    def test_evicts_least_recently_used(self):
+        """Tests that the least recently used key is evicted first"""
+        backend = cache.LRUBackend(max_items=2)
+        backend.set("a", b"1")
+        backend.set("b", b"2")
+        backend.get("a")
+        backend.set("c", b"3")
+
+        self.assertEqual(backend.get("a"), b"1")
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), b"3")
+
+    def test_ttl(self):
+        """Tests that values expire after their ttl"""
+        backend = cache.LRUBackend()
+        backend.set("a", b"1", ttl=0.05)
+        backend.set("b", b"2")
+        self.assertEqual(backend.get("a"), b"1")
+
+        time.sleep(0.1)
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(backend.get("b"), b"2")
+
+
+class CacheTestCase(BaseTest):
+    """
+    Contains tests for the cache module
+    """
+
+    def test_namespaces(self):
+        """Tests that clearing a namespace leaves other namespaces cached"""
+        cache.set("scores", 1, {"a": 1})
+        cache.set("scores", 2, {"a": 2})
+        cache.set("runs", 1, [1, 2])
+
+        cache.invalidate("scores", 2)
+        self.assertEqual(cache.get("scores", 1), {"a": 1})
+        self.assertIsNone(cache.get("scores", 2))
+
+        cache.clear("scores")
+        self.assertIsNone(cache.get("scores", 1))
+        self.assertEqual(cache.get("runs", 1), [1, 2])
+
+    def test_single_flight(self):
+        """Tests that concurrent misses only compute the value once"""
+        num_computes = []
+
+        def compute():
+            num_computes.append(1)
+            time.sleep(0.1)
+            return "value"
+
+        results = []
+
+        def read():
+            results.append(cache.get_or_compute("scores", 1, compute))
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["value"] * 8)
+        self.assertEqual(len(num_computes), 1)
+
+    def test_stale_while_revalidate(self):
+        """Tests that stale values are served while another caller recomputes"""
+        cache.set("scores", 1, "old")
+        cache.invalidate("scores", 1)
+
+        is_computing = threading.Event()
+        can_finish = threading.Event()
+
+        def compute():
+            is_computing.set()
+            can_finish.wait()
+            return "new"
+
+        thread = threading.Thread(
+            target=cache.get_or_compute,
+            args=("scores", 1, compute),
+            kwargs={"serve_stale": True},
+        )
+        thread.start()
+        is_computing.wait()
+
+        self.assertEqual(
+            cache.get_or_compute("scores", 1, lambda: "other", serve_stale=True),
+            "old",
+        )
+
+        can_finish.set()
+        thread.join()
+        self.assertEqual(cache.get("scores", 1), "new")
+
+    def test_soft_ttl(self):
+        """Tests that values are recomputed once their soft ttl passes"""
+        self.assertEqual(cache.get_or_compute("scores", 1, lambda: 1, soft_ttl=0.05), 1)
+        self.assertEqual(cache.get_or_compute("scores", 1, lambda: 2, soft_ttl=0.05), 1)
+
+        time.sleep(0.1)
+        self.assertEqual(cache.get_or_compute("scores", 1, lambda: 3, soft_ttl=0.05), 3)
+
+    def test_stats(self):
+        """Tests the hit and miss counters"""
+        cache.reset_stats()
+        cache.get("scores", 1)
+        cache.set("scores", 1, "x")
+        cache.get("scores", 1)
+        cache.get("scores", 1)
+
+        self.assertEqual(cache.get_stats(), {"scores": {"hits": 2, "misses": 1}})
+
+    def test_tokens_outlive_evicted_values(self):
+        """Tests that evicting values when the cache is full leaves the tokens
+        they're checked against"""
+        version = cache.get_version("scores")
+        with mock.patch.object(cache, "_backend", cache.LRUBackend(max_items=2)):
+            for i in range(10):
+                cache.set("scores", i, i)
+            self.assertEqual(cache.get("scores", 9), 9)
+            self.assertEqual(cache.get_version("scores"), version)
+
+    def test_cached_response(self):
+        """Tests that api responses are cached until they're invalidated"""
+        setup_contest()
+        cache.reset_stats()
+
+        def get_conf():
+            rv = self.app.get("/api/conf")
+            self.assertEqual(rv.status_code, 200)
+            return json.loads(rv.data.decode("utf-8"))
+
+        self.assertEqual(get_conf()["max_user_submissions"], 5)
+        self.assertEqual(get_conf()["max_user_submissions"], 5)
+        self.assertEqual(
+            cache.get_stats()[util.CONF_CACHE_NAME], {"hits": 1, "misses": 1}
+        )
+
+        util.set_configuration("max_user_submissions", 10)
+        self.assertEqual(get_conf()["max_user_submissions"], 10)
+
+    def test_cached_response_needs_auth(self):
+        """Tests that cached responses are still behind the view's auth"""
+        setup_contest()
+
+        token = self.get_jwt_token("testuser", "pass")
+        rv = self.app.get(
+            "/api/problems", headers={"Authorization": "Bearer {}".format(token)}
+        )
+        self.assertEqual(rv.status_code, 200)
+
+        rv = self.app.get("/api/problems")
+        self.assertEqual(rv.status_code, 401)
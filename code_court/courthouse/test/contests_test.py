@@ -120,3 +120,57 @@ class ContestsTestCase(BaseTest):
         self._contest_add(init_contest_name, usernames[0:7])
         self._contest_edit(init_contest_name, edit_contest_name, usernames[0:7])
         self._contest_del(edit_contest_name)
+
+    def test_contest_freeze_moved(self):
+        """test that moving a contest's freeze time freezes it again"""
+        self.login("admin", "pass")
+
+        self.app.post(
+            "/admin/problems/add/",
+            data={
+                "problem_type_id": model.ProblemType.query.filter_by(
+                    name="input-output"
+                ).one().id,
+                "slug": "2plus2",
+                "name": "2 + 2",
+                "problem_statement": "## is there a problem here",
+                "sample_input": "1",
+                "sample_output": "2",
+                "secret_input": "1 2 3",
+                "secret_output": "4 5 6",
+            },
+            follow_redirects=True,
+        )
+
+        def save_contest(freeze_time, contest_id=None):
+            rv = self.app.post(
+                "/admin/contests/add/",
+                data={
+                    "contest_id": contest_id or "",
+                    "name": "frozen contest",
+                    "start_date": "2017-01-01",
+                    "start_time": "13:00:00",
+                    "end_date": "2017-01-01",
+                    "end_time": "15:00:00",
+                    "freeze_date": "2017-01-01",
+                    "freeze_time": freeze_time,
+                    "is_public": "on",
+                    "users": "",
+                    "problems": "2plus2",
+                },
+                follow_redirects=True,
+            )
+            self.assertEqual(rv.status_code, 200)
+            return model.Contest.query.filter_by(name="frozen contest").one()
+
+        contest = save_contest("14:00:00")
+        self.app.get(
+            "/admin/contests/unfreeze/{}/".format(contest.id), follow_redirects=True
+        )
+
+        # saving the same freeze time leaves it unfrozen
+        contest = save_contest("14:00:00", contest.id)
+        self.assertTrue(contest.is_unfrozen)
+
+        contest = save_contest("14:30:00", contest.id)
+        self.assertFalse(contest.is_unfrozen)
@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+
+from base_test import BaseTest
+
+from sqlalchemy import create_engine, exc
+
+import database
+
+
+class PoolTestCase(unittest.TestCase):
+    """
+    Contains tests for the database connection pool
+    """
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.engine = create_engine(
+            "sqlite:///{}".format(self.db_path),
+            poolclass=database.MeteredQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.05,
+            connect_args={"check_same_thread": False},
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.db_path)
+
+    def test_pool_options(self):
+        """Tests that the pool is configured from the environment"""
+        env = {
+            "CODE_COURT_DB_POOL_SIZE": "4",
+            "CODE_COURT_DB_MAX_OVERFLOW": "1",
+            "CODE_COURT_DB_POOL_RECYCLE": "3600",
+            "CODE_COURT_DB_POOL_PRE_PING": "true",
+        }
+        options = database.get_pool_options("postgresql://localhost/code_court", env)
+        self.assertEqual(options["poolclass"], database.MeteredQueuePool)
+        self.assertEqual(options["pool_size"], 4)
+        self.assertEqual(options["max_overflow"], 1)
+        self.assertEqual(options["pool_timeout"], 30)
+        self.assertEqual(options["pool_recycle"], 3600)
+        self.assertTrue(options["pool_pre_ping"])
+
+        options = database.get_pool_options("sqlite:////tmp/code_court.db", env)
+        self.assertNotIn("pool_size", options)
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_metrics(self):
+        """Tests the checkout and timeout counts"""
+        connection = self.engine.connect()
+        with self.assertRaises(exc.TimeoutError):
+            self.engine.connect()
+
+        metrics = self.engine.pool.get_metrics()
+        self.assertEqual(metrics["checkouts"], 2)
+        self.assertEqual(metrics["timeouts"], 1)
+        self.assertEqual(metrics["checked_out"], 1)
+        self.assertEqual(metrics["max_checked_out"], 1)
+        self.assertGreaterEqual(metrics["max_wait_seconds"], 0.05)
+
+        connection.close()
+        self.engine.dispose()
+        metrics = self.engine.pool.get_metrics()
+        self.assertEqual(metrics["checkouts"], 2)
+        self.assertEqual(metrics["checked_out"], 0)
+
+    def test_forked_connections_are_replaced(self):
+        """Tests that connections opened by another process aren't reused"""
+        connection = self.engine.connect()
+        dbapi_connection = connection.connection.connection
+        connection.connection._connection_record.info["pid"] = -1
+        connection.close()
+
+        connection = self.engine.connect()
+        self.assertIsNot(connection.connection.connection, dbapi_connection)
+        connection.close()
+
+
+class MetricsTestCase(BaseTest):
+    """
+    Contains tests for the metrics page
+    """
+
+    def test_metrics(self):
+        """Tests that operators can get the metrics"""
+        rv = self.app.get("/admin/utils/metrics/")
+        self.assertEqual(rv.status_code, 401)
+
+        self.login("admin", "pass")
+        rv = self.app.get("/admin/utils/metrics/")
+        self.assertEqual(rv.status_code, 200)
+
+        metrics = json.loads(rv.data.decode("utf-8"))
+        self.assertEqual(metrics["pid"], os.getpid())
+        self.assertIn("db_pool", metrics)
+        self.assertIn("cache", metrics)
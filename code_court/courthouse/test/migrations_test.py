@@ -0,0 +1,180 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+import migrations
+import model
+from database import Base
+from migrations import m0000_baseline
+
+RUN_INDEXES = {
+    "ix_run_unclaimed",
+    "ix_run_unclaimed_priority",
+    "ix_run_executing",
+    "ix_run_user_submit_time",
+    "ix_run_contest_user_problem",
+}
+
+
+class MigrationsTestCase(unittest.TestCase):
+    """
+    Contains tests for the schema migrations
+    """
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.engine = create_engine("sqlite:///{}".format(self.db_path))
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.db_path)
+
+    def get_run_indexes(self):
+        return {x["name"] for x in inspect(self.engine).get_indexes("run")}
+
+    def test_model_has_indexes(self):
+        """Tests that new databases are created with the run indexes"""
+        Base.metadata.create_all(self.engine)
+        self.assertEqual(self.get_run_indexes(), RUN_INDEXES)
+
+    def test_upgrade(self):
+        """Tests that upgrading adds the run indexes to an existing database"""
+        Base.metadata.create_all(self.engine)
+        for index in RUN_INDEXES:
+            self.engine.execute("DROP INDEX {}".format(index))
+
+        applied = migrations.upgrade(self.engine, log=lambda message: None)
+        self.assertEqual(
+            [x.VERSION for x in applied],
+            [x.VERSION for x in migrations.get_migrations()],
+        )
+        self.assertEqual(self.get_run_indexes(), RUN_INDEXES)
+
+        # applied migrations are skipped
+        self.assertEqual(migrations.upgrade(self.engine, log=lambda message: None), [])
+
+    def test_stamp(self):
+        """Tests that stamped migrations aren't applied"""
+        Base.metadata.create_all(self.engine)
+        self.assertEqual(
+            migrations.get_pending_migrations(self.engine), migrations.get_migrations()
+        )
+
+        migrations.stamp(self.engine)
+        self.assertEqual(migrations.get_pending_migrations(self.engine), [])
+
+    def test_check_schema(self):
+        """Tests that the schema check fails while migrations are pending"""
+        Base.metadata.create_all(self.engine)
+        with self.assertRaises(Exception):
+            migrations.check_schema(self.engine)
+
+        migrations.stamp(self.engine)
+        migrations.check_schema(self.engine)
+
+    def test_migrations_build_model(self):
+        """Tests that migrating an empty database builds every table in the model"""
+        migrations.upgrade(self.engine, log=lambda message: None)
+        migrated = inspect(self.engine)
+
+        fd, created_db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        created_engine = create_engine("sqlite:///{}".format(created_db_path))
+        try:
+            Base.metadata.create_all(created_engine)
+            created = inspect(created_engine)
+
+            self.assertEqual(
+                set(migrated.get_table_names()) - {"schema_version"},
+                set(created.get_table_names()),
+            )
+            for table_name in created.get_table_names():
+                self.assertEqual(
+                    {
+                        (x["name"], x["nullable"])
+                        for x in migrated.get_columns(table_name)
+                    },
+                    {
+                        (x["name"], x["nullable"])
+                        for x in created.get_columns(table_name)
+                    },
+                    table_name,
+                )
+                self.assertEqual(
+                    {x["name"] for x in migrated.get_indexes(table_name)},
+                    {x["name"] for x in created.get_indexes(table_name)},
+                    table_name,
+                )
+        finally:
+            created_engine.dispose()
+            os.remove(created_db_path)
+
+    def test_upgrade_first_release(self):
+        """Tests upgrading a database from the first release with contest data"""
+        m0000_baseline.metadata.create_all(self.engine)
+        tables = m0000_baseline.metadata.tables
+        start_time = datetime.datetime(2017, 2, 5, 22, 0)
+        self.engine.execute(
+            tables["contest"].insert(),
+            id=1,
+            name="contest",
+            start_time=start_time,
+            end_time=start_time + datetime.timedelta(hours=5),
+            is_public=True,
+        )
+        run_defaults = {
+            "user_id": 1,
+            "contest_id": 1,
+            "language_id": 1,
+            "problem_id": 1,
+            "source_code": "",
+            "run_input": "",
+            "correct_output": "",
+            "is_submission": True,
+        }
+        self.engine.execute(
+            tables["run"].insert(),
+            [
+                dict(
+                    run_defaults,
+                    submit_time=start_time + datetime.timedelta(minutes=minutes),
+                    finished_execing_time=start_time,
+                    is_passed=is_passed,
+                )
+                for minutes, is_passed in ((10, False), (30, True), (40, False))
+            ],
+        )
+
+        migrations.upgrade(self.engine, log=lambda message: None)
+        migrations.check_schema(self.engine)
+
+        contest = self.engine.execute(model.Contest.__table__.select()).first()
+        self.assertIsNone(contest.freeze_time)
+        self.assertFalse(contest.is_unfrozen)
+
+        score = self.engine.execute(
+            model.ContestProblemScore.__table__.select()
+        ).first()
+        self.assertEqual(score.solve_time, start_time + datetime.timedelta(minutes=30))
+        self.assertEqual(score.num_failed, 1)
+        self.assertEqual(score.penalty_minutes, 50)
+
+    def test_partial_index_plan(self):
+        """Tests that claiming a writ uses the unclaimed runs index"""
+        Base.metadata.create_all(self.engine)
+        query = (
+            model.Run.__table__.select()
+            .where(model.Run.started_execing_time == None)
+            .where(model.Run.finished_execing_time == None)
+            .order_by(model.Run.submit_time)
+            .limit(1)
+        )
+        sql = str(query.compile(self.engine, compile_kwargs={"literal_binds": True}))
+        plan = " ".join(
+            str(x) for x in self.engine.execute("EXPLAIN QUERY PLAN " + sql)
+        )
+        self.assertIn("ix_run_unclaimed", plan)
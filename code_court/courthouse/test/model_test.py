@@ -1,8 +1,10 @@
 from base_test import BaseTest
 
+from sqlalchemy import event, inspect
+
 import model
 import util
-from database import db_session
+from database import db_session, engine
 
 
 class ModelsTestCase(BaseTest):
@@ -184,6 +186,106 @@ class ModelsTestCase(BaseTest):
         db_session.add(run)
         db_session.commit()
 
+    def test_run_test_data(self):
+        """test that run test data is stored once by hash"""
+        contest_args, contest = get_contest()
+        problem_args, problem = get_problem()
+        user_args, user = get_user()
+        language_args, language = get_language()
+
+        runs = []
+        for _ in range(3):
+            run = model.Run(
+                user,
+                contest,
+                language,
+                problem,
+                util.str_to_dt("2017-01-26T10:45:00Z"),
+                "print('hello'*input())",
+                problem.secret_input,
+                problem.secret_output,
+                True,
+            )
+            runs.append(run)
+        db_session.add_all(runs)
+        db_session.commit()
+
+        input_hash = model.TestData.hash_contents(problem.secret_input)
+        self.assertEqual({x.run_input_hash for x in runs}, {input_hash})
+        self.assertEqual(model.TestData.query.filter_by(hash=input_hash).count(), 1)
+        self.assertEqual(runs[0].run_input, problem.secret_input)
+        self.assertEqual(runs[0].correct_output, problem.secret_output)
+
+        # runs from before test data was stored by hash keep it inline
+        legacy_run = runs[0]
+        legacy_run.run_input_data = None
+        legacy_run.inline_run_input = "legacy input"
+        db_session.commit()
+        self.assertEqual(legacy_run.run_input, "legacy input")
+
+    def test_test_data_stored_concurrently(self):
+        """test that test data stored by another request after it was looked up
+        is used rather than failing to insert it again"""
+        contents = "concurrent input"
+        data_hash = model.TestData.hash_contents(contents)
+
+        other_inserts = []
+
+        def on_execute(conn, cursor, statement, *args):
+            if "INSERT" in statement and "test_data" in statement and not other_inserts:
+                other_inserts.append(statement)
+                with engine.connect() as other_conn:
+                    other_conn.execute(
+                        model.TestData.__table__.insert().values(
+                            hash=data_hash, contents=contents
+                        )
+                    )
+
+        event.listen(engine, "before_cursor_execute", on_execute)
+        try:
+            test_data = model.TestData.get_or_create(contents)
+        finally:
+            event.remove(engine, "before_cursor_execute", on_execute)
+        db_session.commit()
+
+        self.assertEqual(len(other_inserts), 1)
+        self.assertEqual(test_data.hash, data_hash)
+        self.assertEqual(test_data.contents, contents)
+        self.assertEqual(model.TestData.query.filter_by(hash=data_hash).count(), 1)
+
+    def test_run_deferred_columns(self):
+        """test that run code and data are only loaded when they're used"""
+        contest_args, contest = get_contest()
+        problem_args, problem = get_problem()
+        user_args, user = get_user()
+        language_args, language = get_language()
+
+        run = model.Run(
+            user,
+            contest,
+            language,
+            problem,
+            util.str_to_dt("2017-01-26T10:45:00Z"),
+            "print('hello'*input())",
+            problem.secret_input,
+            problem.secret_output,
+            True,
+        )
+        db_session.add(run)
+        db_session.commit()
+        run_id = run.id
+        db_session.remove()
+
+        run = model.Run.query.get(run_id)
+        unloaded = inspect(run).unloaded
+        self.assertIn("source_code", unloaded)
+        self.assertIn("run_output", unloaded)
+        self.assertIn("problem_statement", inspect(run.problem).unloaded)
+
+        # the run's data is loaded together when it's used
+        self.assertEqual(run.source_code, "print('hello'*input())")
+        self.assertNotIn("run_output", inspect(run).unloaded)
+
     def test_clarification(self):
         """test the clarification table"""
         contest_args, contest = get_contest()
@@ -35,6 +35,11 @@ class ProblemsTestCase(BaseTest):
         page_problem_names = [x.text for x in root.cssselect(".problem_name")]
         self.assertIn(init_problem_name, page_problem_names, "Problem was not added")
 
+        # runs use the problem's data, so it's stored when the problem is
+        for contents in ("1", "2", "1 2 3", "4 5 6"):
+            data_hash = model.TestData.hash_contents(contents)
+            self.assertIsNotNone(model.TestData.query.get(data_hash))
+
     def _problem_edit(self, old_name, new_name):
         problem_id = model.Problem.query.filter_by(name=old_name).one().id
 
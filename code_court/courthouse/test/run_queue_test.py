@@ -0,0 +1,195 @@
+import datetime
+
+from base_test import BaseTest
+
+import model
+import run_queue
+import util
+from api_test import setup_contest
+from database import db_session
+
+
+class RunQueueTests:
+    """
+    Contains tests for a run queue backend, which are run against each one
+    """
+
+    def make_queue(self):
+        raise NotImplementedError()
+
+    def setUp(self):
+        super().setUp()
+        setup_contest()
+
+        # the runs made when setting up are judged, so each test starts with an
+        # empty queue
+        model.Run.query.update(
+            {model.Run.finished_execing_time: datetime.datetime.utcnow()}
+        )
+        db_session.commit()
+
+        self.queue = self.make_queue()
+        self.start_time = datetime.datetime.utcnow()
+
+    def add_run(self, language_name, seconds=0, is_priority=False):
+        """Queues a run submitted the given number of seconds after the start"""
+        user = model.User.query.filter_by(username="testuser").one()
+        contest = model.Contest.query.filter_by(name="test_contest").one()
+        problem = model.Problem.query.filter_by(slug="fizzbuzz").one()
+        language = model.Language.query.filter_by(name=language_name).one()
+
+        run = model.Run(
+            user,
+            contest,
+            language,
+            problem,
+            self.start_time + datetime.timedelta(seconds=seconds),
+            "print('hello')",
+            problem.secret_input,
+            problem.secret_output,
+            True,
+        )
+        run.is_priority = is_priority
+        db_session.add(run)
+        db_session.commit()
+
+        self.queue.enqueue(run)
+        return run.id
+
+    def claim_ids(self, max_runs, languages=None):
+        return [x.id for x in self.queue.claim(max_runs, languages)]
+
+    def test_claim_order(self):
+        """test that priority runs are claimed first, then the oldest runs"""
+        old_id = self.add_run("python", seconds=0)
+        new_id = self.add_run("python", seconds=10)
+        priority_id = self.add_run("perl", seconds=20, is_priority=True)
+
+        self.assertEqual(self.claim_ids(5), [priority_id, old_id, new_id])
+        self.assertEqual(self.claim_ids(5), [])
+
+        run = model.Run.query.get(old_id)
+        self.assertIsNotNone(run.started_execing_time)
+        self.assertEqual(run.delivery_count, 1)
+
+    def test_claim_languages(self):
+        """test that runs can be claimed from some language lanes only"""
+        python_id = self.add_run("python", seconds=0)
+        perl_id = self.add_run("perl", seconds=10)
+        lua_id = self.add_run("lua", seconds=20, is_priority=True)
+
+        self.assertEqual(self.claim_ids(5, ["perl", "python"]), [python_id, perl_id])
+        self.assertEqual(self.claim_ids(5, ["perl"]), [])
+        self.assertEqual(self.claim_ids(5), [lua_id])
+
+    def test_complete(self):
+        """test that a run's output is only accepted once"""
+        run_id = self.add_run("python")
+        run = self.queue.claim(1)[0]
+
+        lease_id = run_queue.get_lease_id(run)
+
+        self.assertFalse(self.queue.complete(run, None))
+        self.assertFalse(self.queue.complete(run, lease_id + 1))
+        self.assertTrue(self.queue.complete(run, lease_id))
+        db_session.commit()
+        self.assertIsNotNone(model.Run.query.get(run_id).finished_execing_time)
+
+        self.assertFalse(self.queue.complete(run, lease_id))
+        self.assertFalse(self.queue.release(run, lease_id))
+        self.assertEqual(self.claim_ids(1), [])
+
+    def test_release(self):
+        """test that released runs are queued again until they're dead-lettered"""
+        run_id = self.add_run("python")
+
+        for _ in range(run_queue.MAX_DELIVERIES):
+            runs = self.queue.claim(1)
+            self.assertEqual([x.id for x in runs], [run_id])
+            lease_id = run_queue.get_lease_id(runs[0])
+            self.assertTrue(self.queue.release(runs[0], lease_id))
+            self.assertFalse(self.queue.release(runs[0], lease_id))
+
+        self.assertEqual(self.claim_ids(1), [])
+
+        run = model.Run.query.get(run_id)
+        self.assertEqual(run.state, model.RunState.DEAD_LETTERED)
+        self.assertIsNotNone(run.finished_execing_time)
+        self.assertEqual([x.id for x in self.queue.get_dead_letters()], [run_id])
+        self.assertFalse(self.queue.release(run, run_queue.get_lease_id(run)))
+
+    def test_requeue_expired(self):
+        """test that runs are queued again when their lease expires"""
+        run_id = self.add_run("python")
+        run = self.queue.claim(1)[0]
+
+        self.assertEqual(self.queue.requeue_expired(), 0)
+        self.assertEqual(self.claim_ids(1), [])
+
+        lease_expiration = run_queue.get_lease_expiration(run)
+        self.assertEqual(
+            lease_expiration,
+            run.started_execing_time
+            + datetime.timedelta(minutes=util.EXECUTOR_TIMEOUT_MINS),
+        )
+        now = lease_expiration + datetime.timedelta(seconds=1)
+        self.assertEqual(self.queue.requeue_expired(now), 1)
+        self.assertEqual(self.claim_ids(1), [run_id])
+
+    def test_stale_lease(self):
+        """test that an expired lease can't end the run's next lease"""
+        run_id = self.add_run("python")
+        run = self.queue.claim(1)[0]
+        stale_lease_id = run_queue.get_lease_id(run)
+
+        now = run_queue.get_lease_expiration(run) + datetime.timedelta(seconds=1)
+        self.assertEqual(self.queue.requeue_expired(now), 1)
+        run = self.queue.claim(1)[0]
+        lease_id = run_queue.get_lease_id(run)
+        self.assertNotEqual(lease_id, stale_lease_id)
+
+        self.assertFalse(self.queue.release(run, stale_lease_id))
+        self.assertFalse(self.queue.complete(run, stale_lease_id))
+        db_session.commit()
+
+        run = model.Run.query.get(run_id)
+        self.assertIsNotNone(run.started_execing_time)
+        self.assertIsNone(run.finished_execing_time)
+        self.assertEqual(self.claim_ids(1), [])
+
+        self.assertTrue(self.queue.complete(run, lease_id))
+        db_session.commit()
+
+
+class DatabaseRunQueueTestCase(RunQueueTests, BaseTest):
+    """
+    Contains tests for the run queue kept in the run table
+    """
+
+    def make_queue(self):
+        return run_queue.DatabaseRunQueue()
+
+
+class MemoryRunQueueTestCase(RunQueueTests, BaseTest):
+    """
+    Contains tests for the run queue kept in memory
+    """
+
+    def make_queue(self):
+        return run_queue.MemoryRunQueue()
+
+
+class IncompleteRunQueueTestCase(BaseTest):
+    """
+    Contains tests for run queue backends that don't implement every operation
+    """
+
+    def test_incomplete_backend(self):
+        """test that a backend without a claim can't be made"""
+
+        class IncompleteRunQueue(run_queue.RunQueue):
+            def _get_expired_runs(self, claimed_before):
+                return []
+
+        with self.assertRaises(TypeError):
+            IncompleteRunQueue()
@@ -3,9 +3,10 @@ from base_test import BaseTest
 import model
 import json
 import bcrypt
-from database import db_session
+from database import db_session, engine
 import datetime
 from flask import request
+from sqlalchemy import event
 
 
 class UtilTestCase(BaseTest):
@@ -120,3 +121,50 @@ class UtilTestCase(BaseTest):
         for lang in lang_list:
             results = model.Language.query.filter_by(name=lang).scalar()
             self.assertIsNotNone(results.version)
+
+    def test_get_configuration_snapshot(self):
+        """test that configuration is read from the snapshot until it changes"""
+        queries = []
+
+        def on_execute(*args):
+            queries.append(args)
+
+        util.get_configuration("max_user_submissions")
+        event.listen(engine, "before_cursor_execute", on_execute)
+        try:
+            self.assertEqual(util.get_configuration("max_user_submissions"), 5)
+            self.assertEqual(util.get_configurations()["extra_signup_fields"], [])
+            self.assertEqual(len(queries), 0)
+
+            util.set_configuration("max_user_submissions", 10)
+            del queries[:]
+            self.assertEqual(util.get_configuration("max_user_submissions"), 10)
+            self.assertEqual(util.get_configuration("max_user_submissions"), 10)
+            self.assertEqual(len(queries), 1)
+        finally:
+            event.remove(engine, "before_cursor_execute", on_execute)
+
+    def test_load_identity_by_username(self):
+        """test that session users and their roles are cached until they change"""
+        queries = []
+
+        def on_execute(*args):
+            queries.append(args)
+
+        util.load_identity_by_username("admin")
+        db_session.remove()
+        event.listen(engine, "before_cursor_execute", on_execute)
+        try:
+            user = util.load_identity_by_username("admin")
+            self.assertIn("operator", {x.name for x in user.user_roles})
+            self.assertEqual(len(queries), 0)
+
+            util.invalidate_identities()
+            db_session.remove()
+            user = util.load_identity_by_username("admin")
+            self.assertIn("operator", {x.name for x in user.user_roles})
+            self.assertEqual(len(queries), 1)
+
+            self.assertIsNone(util.load_identity_by_username("notauser"))
+        finally:
+            event.remove(engine, "before_cursor_execute", on_execute)
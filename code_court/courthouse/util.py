@@ -1,13 +1,21 @@
+import copy
 import datetime
+import hashlib
+import hmac
+import pickle
+import time
 
 from functools import wraps
 
 import bcrypt
 
+from itsdangerous import BadSignature, URLSafeTimedSerializer
 from flask_login import current_user
 from flask_sqlalchemy import BaseQuery
+from sqlalchemy.orm import joinedload
 from flask import current_app, request, redirect
 
+import cache
 import model
 
 import json
@@ -17,6 +25,27 @@ from database import db_session
 
 RUN_CACHE_NAME = "runcache"
 SCORE_CACHE_NAME = "scorecache"
+CONF_CACHE_NAME = "confcache"
+CREDENTIAL_CACHE_NAME = "credcache"
+IDENTITY_CACHE_NAME = "identitycache"
+
+EXECUTOR_TIMEOUT_MINS = 3
+
+# how long a verified username and password is trusted without checking it
+# with bcrypt again
+CREDENTIAL_CACHE_TTL_SECONDS = 5 * 60
+EXECUTIONER_TOKEN_TTL_SECONDS = 15 * 60
+EXECUTIONER_TOKEN_SALT = "executioner-token"
+
+IDENTITY_CACHE_TTL_SECONDS = 30
+IDENTITY_CACHE_MAX_ITEMS = 5000
+
+# each process's (version, values) copy of the configuration table
+_configuration_snapshot = None
+
+# user id: (identity version, expiry time, detached user)
+_identity_cache = {}
+_identity_ids_by_username = {}
 
 
 class ModelMissingException(Exception):
@@ -57,6 +86,94 @@ def is_password_matching(plaintext_password, hashed_password):
     ) == hashed_password
 
 
+def verify_credentials(username, password):
+    """
+    Checks a username and password, remembering credentials that are correct
+    for CREDENTIAL_CACHE_TTL_SECONDS so they aren't checked with bcrypt on
+    every request. Credentials are cached by an HMAC of the username and
+    password keyed with the app's secret key, so the cache never holds the
+    password.
+
+    Params:
+        username (str): the user's username
+        password (str): the plaintext password
+
+    Returns:
+        bool: whether or not the credentials are correct
+    """
+    digest = hmac.new(
+        current_app.config["SECRET_KEY"].encode("UTF-8"),
+        "{}:{}".format(username, password).encode("UTF-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    if cache.get(CREDENTIAL_CACHE_NAME, digest) == username:
+        return True
+
+    user = model.User.query.filter_by(username=username).scalar()
+    if not user or not user.verify_password(password):
+        return False
+
+    cache.set(CREDENTIAL_CACHE_NAME, digest, username, CREDENTIAL_CACHE_TTL_SECONDS)
+    return True
+
+
+def create_executioner_token(username):
+    """
+    Creates a signed token that executioners send instead of their password
+
+    Params:
+        username (str): the executioner's username
+
+    Returns:
+        str: the token, which expires after EXECUTIONER_TOKEN_TTL_SECONDS
+    """
+    return _get_token_serializer().dumps(
+        {
+            "username": username,
+            "version": cache.get_version(CREDENTIAL_CACHE_NAME),
+        }
+    )
+
+
+def verify_executioner_token(token):
+    """
+    Checks an executioner's token. Tokens are revoked whenever users change,
+    as that changes the credential cache's version.
+
+    Params:
+        token (str): the token from create_executioner_token
+
+    Returns:
+        str: the token's username, or None if the token isn't valid
+    """
+    try:
+        claims = _get_token_serializer().loads(
+            token, max_age=EXECUTIONER_TOKEN_TTL_SECONDS
+        )
+    except BadSignature:
+        return None
+
+    version = cache.get_version(CREDENTIAL_CACHE_NAME)
+    if claims.get("version") != version:
+        return None
+
+    return claims.get("username")
+
+
+def invalidate_credentials():
+    """
+    Forgets every verified username and password and revokes every
+    executioner token, this must be called when users are edited or deleted
+    """
+    invalidate_cache(CREDENTIAL_CACHE_NAME)
+
+
+def _get_token_serializer():
+    return URLSafeTimedSerializer(
+        current_app.config["SECRET_KEY"], salt=EXECUTIONER_TOKEN_SALT
+    )
+
+
 def login_required(role="ANY"):
 
     def wrapper(fn):
@@ -66,8 +183,8 @@ def login_required(role="ANY"):
             if not current_user.is_authenticated:
                 return current_app.login_manager.unauthorized()
 
-            role_ids = [x.name for x in current_user.user_roles]
-            if (role not in role_ids) and (role != "ANY"):
+            # the user's roles are loaded with them from the identity cache
+            if role != "ANY" and role not in {x.name for x in current_user.user_roles}:
                 return current_app.login_manager.unauthorized()
 
             return fn(*args, **kwargs)
@@ -107,9 +224,138 @@ def set_configuration(key, val):
     config.val = str(val)
     db_session.commit()
 
+    invalidate_configuration()
+
 
 def get_configuration(key):
-    return model.Configuration.query.filter_by(key=key).scalar().convertedVal
+    return copy.deepcopy(get_configurations()[key])
+
+
+def get_configurations():
+    """
+    Gets every configuration value from this process's snapshot of the
+    configuration table. The snapshot is only reloaded when the configuration
+    version in the cache has changed, so reading it doesn't query the database.
+
+    Returns:
+        dict: the converted value of each configuration key, this is shared and
+            shouldn't be modified
+    """
+    global _configuration_snapshot
+
+    # the version is read before loading, so a change made while loading
+    # causes another reload
+    version = cache.get_version(CONF_CACHE_NAME)
+    snapshot = _configuration_snapshot
+    if snapshot is None or snapshot[0] != version:
+        values = {x.key: x.convertedVal for x in model.Configuration.query.all()}
+        snapshot = (version, values)
+        _configuration_snapshot = snapshot
+
+    return snapshot[1]
+
+
+def invalidate_configuration():
+    """
+    Bumps the configuration version, so every process reloads its snapshot,
+    and deletes the cached configuration responses
+    """
+    invalidate_cache(CONF_CACHE_NAME)
+
+
+def load_identity(user_id):
+    """
+    Loads the user making a JWT authenticated request, along with their roles
+    and contests. Users are kept in this process's identity cache for
+    IDENTITY_CACHE_TTL_SECONDS, or until the identity version in the cache
+    changes, so a hit doesn't query the database.
+
+    Params:
+        user_id (int): the user's id
+
+    Returns:
+        model.User: the user, in the request's session, or None if they don't
+            exist
+    """
+    user_id = i(user_id)
+
+    # the version is read before loading, so a change made while loading
+    # causes another load
+    version = cache.get_version(IDENTITY_CACHE_NAME)
+    user = _get_cached_identity(user_id, version)
+    if user is not None:
+        return user
+
+    return _load_identity(model.User.id == user_id, version)
+
+
+def load_identity_by_username(username):
+    """
+    Loads the user of an admin session from the identity cache, the same way
+    as load_identity
+
+    Params:
+        username (str): the user's username
+
+    Returns:
+        model.User: the user, in the request's session, or None if they don't
+            exist
+    """
+    version = cache.get_version(IDENTITY_CACHE_NAME)
+    user_id = _identity_ids_by_username.get(username)
+    if user_id is not None:
+        user = _get_cached_identity(user_id, version)
+        if user is not None and user.username == username:
+            return user
+
+    return _load_identity(model.User.username == username, version)
+
+
+def _get_cached_identity(user_id, version):
+    entry = _identity_cache.get(user_id)
+    if entry is None or entry[0] != version or entry[1] <= time.time():
+        return None
+
+    # the cached user is shared by every request, so it's copied into the
+    # session as it is rather than being reloaded or modified
+    return db_session.merge(entry[2], load=False)
+
+
+def _load_identity(criterion, version):
+    user = (
+        model.User.query.options(
+            joinedload(model.User.contests), joinedload(model.User.user_roles)
+        )
+        .filter(criterion)
+        .scalar()
+    )
+    if user is None:
+        return None
+
+    if len(_identity_cache) >= IDENTITY_CACHE_MAX_ITEMS:
+        _identity_cache.clear()
+        _identity_ids_by_username.clear()
+
+    # a pickled copy of the user is detached from the session, and keeps the
+    # roles and contests that were loaded with it
+    detached_user = pickle.loads(pickle.dumps(user))
+    _identity_cache[user.id] = (
+        version,
+        time.time() + IDENTITY_CACHE_TTL_SECONDS,
+        detached_user,
+    )
+    _identity_ids_by_username[user.username] = user.id
+
+    return user
+
+
+def invalidate_identities():
+    """
+    Bumps the identity version, so every process reloads the users in its
+    identity cache. This must be called after changing a user, or which users
+    are in a contest.
+    """
+    invalidate_cache(IDENTITY_CACHE_NAME)
 
 
 def ssl_required(fn):
@@ -140,23 +386,13 @@ def paginate(sa_query, page, per_page=20, error_out=True):
 
 
 def invalidate_cache_item(cache_name, key):
-    """Deletes a specific item in the specified cache"""
-    try:
-        import uwsgi
-
-        uwsgi.cache_del(str(key), cache_name)
-    except ImportError:
-        pass
+    """Marks a specific item in the specified cache as stale"""
+    cache.invalidate(cache_name, key)
 
 
 def invalidate_cache(cache_name):
     """Deletes everything in the specificed cache"""
-    try:
-        import uwsgi
-
-        uwsgi.cache_clear(cache_name)
-    except ImportError:
-        pass
+    cache.clear(cache_name)
 
 
 def str_to_dt(s):
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+Times the hot run queries against a large run table, before and after the run
+indexes migration is applied.
+
+The run table is seeded once with mostly judged runs, plus a small backlog of
+runs waiting for an executioner and a few being executed, which is what the
+table looks like late in a contest. Each query is then timed without the run
+indexes, the indexes are added by applying the migration, and each query is
+timed again.
+
+This uses its own sqlite database unless CODE_COURT_DB_URI is set.
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("CODE_COURT_DB_URI", "sqlite:////tmp/code_court_bench_indexes.db")
+
+from sqlalchemy import inspect
+
+import migrations
+import model
+import util
+from database import db_session, engine, init_db
+from migrations import m0002_run_indexes
+
+BENCH_CONTEST_NAME = "run_index_bench"
+BATCH_SIZE = 20000
+
+NUM_UNCLAIMED_RUNS = 200
+NUM_EXECUTING_RUNS = 20
+PRIORITY_RUN_RATIO = 0.05
+
+
+def setup_runs(num_users, num_problems, num_runs):
+    """Seeds the benchmark contest's runs, if they don't exist yet"""
+    contest = model.Contest.query.filter_by(name=BENCH_CONTEST_NAME).scalar()
+    if contest:
+        return contest
+
+    print(
+        "Creating a contest with {} users and {} problems".format(
+            num_users, num_problems
+        )
+    )
+    start_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=num_runs)
+    contest = model.Contest(
+        BENCH_CONTEST_NAME,
+        start_time,
+        start_time + datetime.timedelta(seconds=num_runs + 3600),
+        True,
+    )
+    io_problem_type = model.ProblemType("bench-input-output", "#!/bin/bash\n")
+    language = model.Language("bench-python", "python", True, "#!/bin/bash\n")
+
+    for i in range(num_problems):
+        slug = "bench{}".format(i)
+        problem = model.Problem(io_problem_type, slug, slug, "", "", "", "1", "1")
+        contest.problems.append(problem)
+
+    for i in range(num_users):
+        user = model.User("bench{}@example.com".format(i), "Bench {}".format(i), "pass")
+        contest.users.append(user)
+    db_session.add(contest)
+    db_session.add(language)
+    db_session.commit()
+
+    user_ids = [x.id for x in contest.users]
+    problem_ids = [x.id for x in contest.problems]
+    num_judged_runs = num_runs - NUM_UNCLAIMED_RUNS - NUM_EXECUTING_RUNS
+
+    print("Creating {} runs".format(num_runs))
+    rng = random.Random(0)
+    run_table = model.Run.__table__
+    for batch_start in range(0, num_runs, BATCH_SIZE):
+        rows = []
+        for i in range(batch_start, min(batch_start + BATCH_SIZE, num_runs)):
+            submit_time = start_time + datetime.timedelta(seconds=i)
+            is_judged = i < num_judged_runs
+            is_executing = num_judged_runs <= i < num_judged_runs + NUM_EXECUTING_RUNS
+            rows.append(
+                {
+                    "user_id": rng.choice(user_ids),
+                    "contest_id": contest.id,
+                    "language_id": language.id,
+                    "problem_id": rng.choice(problem_ids),
+                    "source_code": "print(1)",
+                    "submit_time": submit_time,
+                    "local_submit_time": submit_time,
+                    "started_execing_time": (
+                        submit_time if is_judged or is_executing else None
+                    ),
+                    "finished_execing_time": submit_time if is_judged else None,
+                    "run_input": "",
+                    "correct_output": "",
+                    "is_submission": rng.random() < 0.8,
+                    "is_passed": rng.random() < 0.3 if is_judged else None,
+                    "is_priority": rng.random() < PRIORITY_RUN_RATIO,
+                }
+            )
+        engine.execute(run_table.insert(), rows)
+        print("Created {} runs".format(batch_start + len(rows)))
+
+    return contest
+
+
+def get_queries(contest_id, user_id, problem_id):
+    """
+    Builds the hot run queries, as they're made by the courthouse
+
+    Returns:
+        list: (name, query) tuples
+    """
+    Run = model.Run
+    now = datetime.datetime.utcnow()
+    unclaimed_query = Run.query.filter(
+        Run.started_execing_time == None, Run.finished_execing_time == None
+    ).order_by(Run.submit_time.asc())
+
+    return [
+        (
+            "claim oldest writ",
+            unclaimed_query.with_entities(Run.id).limit(1),
+        ),
+        (
+            "claim oldest priority writ",
+            unclaimed_query.filter(Run.is_priority == True)
+            .with_entities(Run.id)
+            .limit(1),
+        ),
+        (
+            "overdue writs",
+            Run.query.filter(
+                Run.finished_execing_time == None,
+                Run.started_execing_time != None,
+                Run.started_execing_time
+                < now - datetime.timedelta(minutes=util.EXECUTOR_TIMEOUT_MINS),
+            ).with_entities(Run.id),
+        ),
+        (
+            "submission rate limit",
+            Run.query.filter_by(user_id=user_id)
+            .filter(Run.submit_time > now - datetime.timedelta(minutes=5))
+            .with_entities(Run.id),
+        ),
+        (
+            "defendant's runs",
+            Run.query.filter(Run.user_id == user_id, Run.contest_id == contest_id)
+            .order_by(Run.submit_time)
+            .with_entities(Run.id),
+        ),
+        (
+            "score aggregate",
+            Run.query.filter(
+                Run.contest_id == contest_id,
+                Run.user_id == user_id,
+                Run.problem_id == problem_id,
+                Run.is_submission == True,
+                Run.is_passed != None,
+                Run.finished_execing_time != None,
+            )
+            .order_by(Run.submit_time)
+            .with_entities(Run.submit_time, Run.is_passed),
+        ),
+        (
+            "scoreboard rebuild",
+            Run.query.filter(Run.is_submission == True, Run.contest_id == contest_id)
+            .with_entities(Run.contest_id, Run.user_id, Run.problem_id)
+            .distinct(),
+        ),
+    ]
+
+
+def time_queries(queries, repeat, explain):
+    """
+    Times each query
+
+    Returns:
+        dict: the median latency of each query in milliseconds, by name
+    """
+    engine.execute("ANALYZE")
+
+    latencies = {}
+    for name, query in queries:
+        if explain:
+            print_plan(name, query)
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query.all()
+            timings.append((time.perf_counter() - start) * 1000)
+            db_session.rollback()
+        latencies[name] = statistics.median(timings)
+
+    return latencies
+
+
+def print_plan(name, query):
+    """Prints a query's plan"""
+    explain = "EXPLAIN QUERY PLAN" if engine.dialect.name == "sqlite" else "EXPLAIN"
+    sql = str(query.statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    print("{}:".format(name))
+    for row in engine.execute("{} {}".format(explain, sql)):
+        print("    {}".format(row[-1]))
+
+
+def drop_run_indexes():
+    """Drops the run indexes and marks their migration as pending"""
+    existing = {x["name"] for x in inspect(engine).get_indexes("run")}
+    with engine.begin() as connection:
+        for index in m0002_run_indexes.indexes:
+            if index.name in existing:
+                index.drop(connection)
+        connection.execute(
+            migrations.schema_version.delete().where(
+                migrations.schema_version.c.version == m0002_run_indexes.VERSION
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--problems", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--explain", action="store_true", help="print each query's plan"
+    )
+    args = parser.parse_args()
+
+    init_db()
+    contest = setup_runs(args.users, args.problems, args.runs)
+    queries = get_queries(contest.id, contest.users[0].id, contest.problems[0].id)
+
+    drop_run_indexes()
+    print("Timing queries without the run indexes")
+    before = time_queries(queries, args.repeat, args.explain)
+
+    start = time.perf_counter()
+    migrations.upgrade(engine)
+    print("Migrated in {:.1f}s".format(time.perf_counter() - start))
+    print("Timing queries with the run indexes")
+    after = time_queries(queries, args.repeat, args.explain)
+
+    print()
+    print("{:<28} {:>12} {:>12} {:>9}".format("query", "before", "after", "speedup"))
+    for name, _ in queries:
+        print(
+            "{:<28} {:>10.2f}ms {:>10.2f}ms {:>8.1f}x".format(
+                name, before[name], after[name], before[name] / max(after[name], 1e-3)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
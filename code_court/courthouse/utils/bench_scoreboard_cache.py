@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Counts the database queries made by concurrent scoreboard readers right after
+the scoreboard is invalidated, with and without single-flight recomputes.
+
+Each round invalidates the cached scoreboard, as submitting a writ does, and
+then releases all of the reader threads at once. Without single-flight every
+reader that misses rebuilds the scoreboard. With it, one reader rebuilds it and
+the others serve the stale scoreboard.
+
+This uses its own sqlite database unless CODE_COURT_DB_URI is set.
+"""
+import argparse
+import datetime
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("CODE_COURT_DB_URI", "sqlite:////tmp/code_court_bench.db")
+
+from sqlalchemy import event
+
+import cache
+import model
+import scoreboard
+import util
+from database import db_session, engine
+from web import app
+
+BENCH_CONTEST_NAME = "scoreboard_cache_bench"
+
+
+class QueryCounter:
+    """Counts the queries sent to the database"""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self.on_execute)
+
+    def on_execute(self, *args):
+        with self.lock:
+            self.count += 1
+
+
+def setup_contest(num_users, num_problems, num_runs):
+    """Creates the benchmark contest, if it doesn't exist yet"""
+    contest = model.Contest.query.filter_by(name=BENCH_CONTEST_NAME).scalar()
+    if contest:
+        return contest
+
+    print("Creating a contest with {} users and {} problems".format(
+        num_users, num_problems))
+    start_time = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
+    contest = model.Contest(
+        BENCH_CONTEST_NAME, start_time, start_time + datetime.timedelta(hours=5), True
+    )
+    io_problem_type = model.ProblemType.query.filter_by(name="input-output").one()
+    defendant = model.UserRole.query.filter_by(name="defendant").one()
+    python = model.Language.query.filter_by(name="python").one()
+
+    for i in range(num_problems):
+        slug = "bench{}".format(i)
+        problem = model.Problem(
+            io_problem_type, slug, slug, "", "", "", "1", "1"
+        )
+        contest.problems.append(problem)
+
+    for i in range(num_users):
+        user = model.User(
+            "bench{}@example.com".format(i), "Bench {}".format(i), "pass",
+            user_roles=[defendant],
+        )
+        contest.users.append(user)
+    db_session.add(contest)
+    db_session.commit()
+
+    print("Creating {} runs".format(num_runs))
+    for i in range(num_runs):
+        run = model.Run(
+            contest.users[i % num_users],
+            contest,
+            python,
+            contest.problems[(i // num_users) % num_problems],
+            start_time + datetime.timedelta(seconds=i),
+            "print(1)",
+            "1",
+            "1",
+            True,
+        )
+        run.is_passed = i % 3 == 0
+        run.started_execing_time = run.submit_time
+        run.finished_execing_time = run.submit_time
+        db_session.add(run)
+    db_session.commit()
+
+    scoreboard.rebuild_scores(contest.id)
+    db_session.commit()
+    return contest
+
+
+def run_readers(contest_id, num_readers, num_rounds, counter):
+    """
+    Invalidates the scoreboard and reads it from every reader at once
+
+    Returns:
+        int: the number of queries made by the readers
+    """
+    url = "/api/scores/{}".format(contest_id)
+    app.test_client().get(url)  # warm the cache
+
+    barrier = threading.Barrier(num_readers + 1)
+
+    def read():
+        client = app.test_client()
+        for _ in range(num_rounds):
+            barrier.wait()
+            client.get(url)
+            barrier.wait()
+
+    threads = [threading.Thread(target=read) for _ in range(num_readers)]
+    for thread in threads:
+        thread.start()
+
+    counter.count = 0
+    for _ in range(num_rounds):
+        util.invalidate_cache_item(util.SCORE_CACHE_NAME, contest_id)
+        barrier.wait()  # release the readers
+        barrier.wait()  # wait for them to finish
+
+    for thread in threads:
+        thread.join()
+
+    return counter.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--problems", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        contest_id = setup_contest(args.users, args.problems, args.runs).id
+
+    counter = QueryCounter()
+    for single_flight in (False, True):
+        app.config["CACHE_SINGLE_FLIGHT"] = single_flight
+        cache.init_app(app)
+
+        num_queries = run_readers(contest_id, args.readers, args.rounds, counter)
+        print(
+            "single-flight {}: {} queries for {} readers over {} rounds "
+            "({:.1f} per invalidation)".format(
+                "on" if single_flight else "off",
+                num_queries,
+                args.readers,
+                args.rounds,
+                num_queries / args.rounds,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
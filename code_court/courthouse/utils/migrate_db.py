@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Brings an existing database up to the latest schema by applying its pending
+migrations, see migrations/__init__.py.
+
+It's safe to run this again once it's done, migrations that have been applied
+are recorded and skipped.
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import migrations
+from database import engine, init_db
+
+
+def _main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--list", action="store_true", help="list the pending migrations and exit"
+    )
+    args = parser.parse_args()
+
+    # creates the tables of a new database, existing ones are migrated
+    init_db()
+
+    if args.list:
+        for migration in migrations.get_pending_migrations(engine):
+            print("{}: {}".format(migration.VERSION, migrations.describe(migration)))
+        return
+
+    applied = migrations.upgrade(engine)
+    print("Done, applied {} migrations".format(len(applied)))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Moves the test data stored inline in each run into the test_data table,
+where it's stored once per distinct blob and referenced by hash.
+
+It's safe to run this while the courthouse is up, and to run it again if
+it's interrupted. Runs that haven't been migrated yet are still judged
+using their inline data.
+"""
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import migrations
+import model
+from database import db_session, engine, init_db
+
+BATCH_SIZE = 500
+
+
+def migrate_runs():
+    """Moves inline run input and output into test_data in batches"""
+    num_migrated = 0
+    while True:
+        runs = (
+            model.Run.query.filter(
+                (model.Run.run_input_hash == None)
+                | (model.Run.correct_output_hash == None)
+            )
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        if not runs:
+            break
+
+        for run in runs:
+            if run.run_input_hash is None:
+                run.run_input = run.inline_run_input
+            if run.correct_output_hash is None:
+                run.correct_output = run.inline_correct_output
+
+        db_session.commit()
+        num_migrated += len(runs)
+        print("Migrated {} runs".format(num_migrated))
+
+    return num_migrated
+
+
+def _main():
+    # the schema migrations add the test_data table and the run hash columns
+    init_db()
+    migrations.upgrade(engine)
+    num_migrated = migrate_runs()
+    print("Done, migrated {} runs".format(num_migrated))
+
+
+if __name__ == "__main__":
+    _main()
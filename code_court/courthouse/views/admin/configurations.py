@@ -85,6 +85,8 @@ def configurations_del(config_id):
     db_session.delete(config)
     db_session.commit()
 
+    util.invalidate_configuration()
+
     return redirect(url_for("configurations.configurations_view"))
 
 
@@ -124,6 +126,8 @@ def add_config():
 
     db_session.commit()
 
+    util.invalidate_configuration()
+
     return redirect(url_for("configurations.configurations_view"))
 
 
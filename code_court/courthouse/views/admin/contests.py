@@ -14,6 +14,7 @@ from flask import (
 )
 
 import model
+import scoreboard
 from database import db_session
 
 contests = Blueprint("contests", __name__, template_folder="templates/contests")
@@ -82,6 +83,7 @@ def contests_del(contest_id):
     try:
         db_session.delete(contest)
         db_session.commit()
+        util.invalidate_identities()
         flash("Deleted contest '{}'".format(contest.name), "warning")
     except IntegrityError:
         db_session.rollback()
@@ -94,6 +96,38 @@ def contests_del(contest_id):
     return redirect(url_for("contests.contests_view"))
 
 
+@contests.route("/unfreeze/<contest_id>/", methods=["GET"])
+@util.login_required("operator")
+def contests_unfreeze(contest_id):
+    """
+    Unfreezes a contest's scoreboard, revealing every verdict that was hidden
+    by the freeze
+
+    Params:
+        contest_id (int): the contest to unfreeze
+
+    Returns:
+        a redirect to the contest view page
+    """
+    contest = model.Contest.query.filter_by(id=util.i(contest_id)).scalar()
+    if contest is None:
+        error = "Failed to unfreeze contest '{}' as it doesn't exist.".format(
+            contest_id
+        )
+        current_app.logger.info(error)
+        flash(error, "danger")
+        return redirect(url_for("contests.contests_view"))
+
+    contest.is_unfrozen = True
+    db_session.commit()
+
+    util.invalidate_cache_item(util.SCORE_CACHE_NAME, contest.id)
+    util.invalidate_identities()
+
+    flash("Unfroze the scoreboard of contest '{}'".format(contest.name), "success")
+    return redirect(url_for("contests.contests_view"))
+
+
 def users_from_usernames(usernames, model):
     users = []
 
@@ -129,6 +163,8 @@ def add_contest():
     start_time = request.form.get("start_time")
     end_date = request.form.get("end_date")
     end_time = request.form.get("end_time")
+    freeze_date = request.form.get("freeze_date")
+    freeze_time = request.form.get("freeze_time")
     is_public = request.form.get("is_public")
     user_usernames = request.form.get("users")
     problem_slugs = request.form.get("problems")
@@ -149,6 +185,12 @@ def add_contest():
         flash(error, "danger")
         return redirect(url_for("contests.contests_view"))
 
+    # the freeze time is optional, contests without one are never frozen
+    if freeze_date and freeze_time:
+        freeze_dt = util.strs_to_dt(freeze_date, freeze_time)
+    else:
+        freeze_dt = None
+
     contest_id = util.i(request.form.get("contest_id"))
     if contest_id:  # edit
         contest = model.Contest.query.filter_by(id=int(contest_id)).one()
@@ -157,6 +199,11 @@ def add_contest():
 
         contest.start_time = util.strs_to_dt(start_date, start_time)
         contest.end_time = util.strs_to_dt(end_date, end_time)
+        if contest.freeze_time != freeze_dt:
+            # unfreezing revealed the scoreboard at the old freeze time, a new
+            # freeze time needs to be unfrozen again
+            contest.is_unfrozen = False
+        contest.freeze_time = freeze_dt
 
         contest.users = users_from_usernames(user_usernames.split(), model)
         contest.problems = problems_from_slugs(problem_slugs.split(), model)
@@ -172,16 +219,25 @@ def add_contest():
             is_public=is_public_bool,
             start_time=util.strs_to_dt(start_date, start_time),
             end_time=util.strs_to_dt(end_date, end_time),
+            freeze_time=freeze_dt,
             users=users_from_usernames(user_usernames.split(), model),
             problems=problems_from_slugs(problem_slugs.split(), model),
         )
         db_session.add(contest)
 
+    # penalties depend on the start time and the frozen scores on the
+    # freeze time, so the contest's scores are recomputed along with it
+    db_session.flush()
+    scoreboard.rebuild_scores(contest.id)
     db_session.commit()
 
     # If a problem is added to a contest, the cached runs will be
     # inaccurate. Clear the run cache to fix this.
     util.invalidate_cache(util.RUN_CACHE_NAME)
+    util.invalidate_cache_item(util.SCORE_CACHE_NAME, contest.id)
+
+    # users are cached with their contests
+    util.invalidate_identities()
 
     return redirect(url_for("contests.contests_view"))
 
@@ -108,6 +108,9 @@ def add_lang():
     syntax_mode = request.form.get("syntax_mode")
     is_enabled = request.form.get("is_enabled")
     run_script = request.form.get("run_script", "").replace("\r\n", "\n")
+    compile_script = (
+        request.form.get("compile_script", "").replace("\r\n", "\n").strip() or None
+    )
     default_template = request.form.get("default_template", "").replace("\r\n", "\n")
 
     if name is None:
@@ -139,6 +142,7 @@ def add_lang():
         lang.syntax_mode = syntax_mode
         lang.is_enabled = is_enabled_bool
         lang.run_script = run_script
+        lang.compile_script = compile_script
         lang.default_template = default_template
     else:  # add
         if is_dup_lang_name(name):
@@ -150,7 +154,12 @@ def add_lang():
             return redirect(url_for("languages.languages_view"))
 
         lang = model.Language(
-            name, syntax_mode, is_enabled_bool, run_script, default_template
+            name,
+            syntax_mode,
+            is_enabled_bool,
+            run_script,
+            default_template,
+            compile_script,
         )
         db_session.add(lang)
 
@@ -189,6 +198,7 @@ def display_lang_add_form(lang_id):
             syntax_mode=lang.syntax_mode,
             is_enabled=lang.is_enabled,
             run_script=lang.run_script,
+            compile_script=lang.compile_script,
             default_template=lang.default_template,
         )
 
@@ -65,10 +65,52 @@ def extract_problem_data(problem_zip_file):
         "sample_output": problem_zip_file.read("sample-output.txt").decode("utf-8"),
         "secret_input": problem_zip_file.read("secret-input.txt").decode("utf-8"),
         "secret_output": problem_zip_file.read("secret-output.txt").decode("utf-8"),
+        "test_cases": extract_test_cases(problem_zip_file),
     }
     return data
 
 
+def extract_test_cases(problem_zip_file):
+    """
+    Reads a problem zip's test cases, which are stored as tests/1.in and
+    tests/1.out, tests/2.in and tests/2.out, etc.
+
+    Params:
+        problem_zip_file (zipfile.ZipFile): the problem zip
+
+    Returns:
+        list: (input, output) pairs ordered by case number
+    """
+    case_numbers = []
+    for name in problem_zip_file.namelist():
+        case_match = re.match(r"tests/(\d+)\.in$", name)
+        if case_match:
+            case_numbers.append(int(case_match.group(1)))
+
+    test_cases = []
+    for case_number in sorted(case_numbers):
+        prefix = "tests/{}".format(case_number)
+        case_input = problem_zip_file.read(prefix + ".in").decode("utf-8")
+        case_output = problem_zip_file.read(prefix + ".out").decode("utf-8")
+        test_cases.append((case_input, case_output))
+
+    return test_cases
+
+
+def get_form_test_cases():
+    """
+    Gets the test cases from the problem add/edit form, skipping blank cases
+
+    Returns:
+        list: (input, output) pairs in the order they were entered
+    """
+    test_cases = zip(
+        request.form.getlist("test_case_input"),
+        request.form.getlist("test_case_output"),
+    )
+    return [(i, o) for i, o in test_cases if i.strip() or o.strip()]
+
+
 @problems.route("/batch_upload/", methods=["POST"])
 @util.login_required("operator")
 def problems_batch_upload():
@@ -111,6 +153,9 @@ def problems_batch_upload():
                 )
                 db_session.add(problem)
 
+            problem.set_test_cases(data["test_cases"])
+            problem.store_test_data()
+
         db_session.commit()
 
         return redirect(url_for("problems.problems_view"))
@@ -201,6 +246,7 @@ def add_problem():
     sample_output = request.form.get("sample_output")
     secret_input = request.form.get("secret_input")
     secret_output = request.form.get("secret_output")
+    test_cases = get_form_test_cases()
 
     if problem_type is None:
         error = "Failed to add problem due to undefined problem_type."
@@ -262,6 +308,9 @@ def add_problem():
         problem.is_enabled = is_enabled_bool
         db_session.add(problem)
 
+    problem.set_test_cases(test_cases)
+    problem.store_test_data()
+
     db_session.commit()
 
     # If a problem is updated, the cached runs will be
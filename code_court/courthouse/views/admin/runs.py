@@ -4,6 +4,8 @@ import util
 from flask import Blueprint, current_app, redirect, render_template, request, url_for
 
 import model
+import run_queue
+import scoreboard
 from database import db_session
 
 runs = Blueprint("runs", __name__, template_folder="templates/runs")
@@ -65,7 +67,23 @@ def runs_run(run_id):
     """
     run = model.Run.query.filter_by(id=run_id).scalar()
 
-    return render_template("runs/run.html", run=run)
+    # for runs with test cases, show the last case that was run, which is the
+    # one that failed if any did
+    run_input = run.run_input
+    expected_output = run.correct_output
+    if run.test_case_results and run.problem:
+        last_case_number = run.test_case_results[-1]["case_number"]
+        for test_case in run.problem.test_cases:
+            if test_case.case_number == last_case_number:
+                run_input = test_case.input
+                expected_output = test_case.output
+
+    return render_template(
+        "runs/run.html",
+        run=run,
+        run_input=run_input,
+        expected_output=expected_output,
+    )
 
 
 @runs.route("/<int:run_id>/priority", methods=["GET"])
@@ -85,11 +103,23 @@ def rejudge(run_id):
 
     run.started_execing_time = None
     run.finished_execing_time = None
+    run.delivery_count = 0
+    # leases from before the rejudge can't submit the run's old output
+    run.lease_count += 1
+    run.dead_letter_time = None
+    run.state = model.RunState.JUDGING
     run.run_output = None
+    run.test_case_data = None
     if run.is_submission:
         run.run_input = run.problem.secret_input
         run.correct_output = run.problem.secret_output
 
+    # the run's old verdict no longer counts until it's judged again
+    scoreboard.update_scores([scoreboard.get_score_key(run)])
     db_session.commit()
 
+    util.invalidate_cache_item(util.SCORE_CACHE_NAME, run.contest_id)
+    util.invalidate_cache_item(util.RUN_CACHE_NAME, run.user_id)
+    run_queue.enqueue(run)
+
     return redirect(url_for("runs.runs_run", run_id=run_id))
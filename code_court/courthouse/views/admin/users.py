@@ -130,6 +130,8 @@ def users_del(user_id):
     try:
         db_session.delete(user)
         db_session.commit()
+        util.invalidate_credentials()
+        util.invalidate_identities()
         flash("Deleted user '{}'".format(user.username), "warning")
     except IntegrityError:
         db_session.rollback()
@@ -195,6 +197,9 @@ def add_user():
 
     db_session.commit()
 
+    util.invalidate_credentials()
+    util.invalidate_identities()
+
     return redirect(url_for("users.users_view"))
 
 
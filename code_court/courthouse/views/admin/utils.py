@@ -1,12 +1,17 @@
 import util
 from flask import (
     Blueprint,
+    jsonify,
     render_template,
     request,
 )
 
+import os
 import random
+import cache
+import database
 import model
+import scoreboard
 from database import db_session
 
 utils = Blueprint("utils", __name__, template_folder="templates/utils")
@@ -30,8 +35,28 @@ def random_contestants():
 @util.login_required("operator")
 def invalidate_caches():
     """
-    Invalidates all uwsgi caches
+    Invalidates all caches
     """
-    util.invalidate_cache(util.RUN_CACHE_NAME)
-    util.invalidate_cache(util.SCORE_CACHE_NAME)
+    scoreboard.rebuild_scores()
+    db_session.commit()
+
+    # cleared after the rebuild, or scoreboards read while it ran would be
+    # cached with the old scores
+    cache.clear_all()
     return render_template("message.html", message="Invalidated cache")
+
+
+@utils.route("/metrics/", methods=["GET"])
+@util.login_required("operator")
+def metrics():
+    """
+    Gets the metrics of the process that serves the request, each uwsgi
+    worker has its own
+    """
+    return jsonify(
+        {
+            "pid": os.getpid(),
+            "db_pool": database.get_pool_metrics(),
+            "cache": cache.get_stats(),
+        }
+    )
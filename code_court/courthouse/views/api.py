@@ -2,21 +2,27 @@
 Contains api endpoints for the defendant frontend
 and external services
 """
+import collections
 import datetime
-import itertools
+import json
 import time
 import uuid
 
 import util
 
-from flask_httpauth import HTTPBasicAuth
+from sqlalchemy.orm import joinedload, undefer_group
+
+from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
 from flask_login import current_user
-from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity
+from flask_jwt_extended import (
+    jwt_required,
+    create_access_token,
+    get_current_user as get_jwt_user,
+    get_jwt_identity,
+)
 
 import six
 
-from sqlalchemy.orm import joinedload
-
 from flask import (
     abort,
     Blueprint,
@@ -28,68 +34,107 @@ from flask import (
 )
 
 from database import db_session
+import cache
 import model
+import run_queue
+import scoreboard
+import writ_notify
 
 api = Blueprint("api", __name__, template_folder="templates")
-executioner_auth = HTTPBasicAuth()
+
+# executioners can authenticate every request with their username and
+# password, or exchange them at /api/executioner-token for a token that's
+# checked without bcrypt
+executioner_basic_auth = HTTPBasicAuth()
+executioner_token_auth = HTTPTokenAuth(scheme="Bearer")
+executioner_auth = MultiAuth(executioner_basic_auth, executioner_token_auth)
+
+# executioners run a batch's writs one after another, so a batch is capped at
+# what can run within a single lease. Executioners send the time they allow
+# each writ, which defaults to the executor's default --writ-timeout.
+DEFAULT_WRIT_SECONDS = 60
+MAX_WRIT_WAIT_SECONDS = 30
+
+# cached scoreboards are rebuilt at least this often, and a stale scoreboard is
+# served while it's being rebuilt
+SCOREBOARD_SOFT_TTL_SECONDS = 60
 
 
 # api auth
-@executioner_auth.verify_password
+@executioner_basic_auth.verify_password
 def verify_password(username, password):
-    user = model.User.query.filter_by(username=username).scalar()
-    if not user or not user.verify_password(password):
-        return False
-    return True
+    return util.verify_credentials(username, password)
+
 
+@executioner_token_auth.verify_token
+def verify_token(token):
+    return util.verify_executioner_token(token) is not None
 
-@executioner_auth.error_handler
+
+@executioner_basic_auth.error_handler
+@executioner_token_auth.error_handler
 def unauthorized():
     return make_response(jsonify({"error": "Unauthorized access"}), 401)
 
 
+@api.route("/executioner-token", methods=["POST"])
+@executioner_basic_auth.login_required
+def get_executioner_token():
+    """endpoint for executioners to exchange their username and password for
+    a token, which they send as a bearer token until it expires"""
+    token = util.create_executioner_token(executioner_basic_auth.username())
+    return make_response(
+        jsonify({"token": token, "expires_in": util.EXECUTIONER_TOKEN_TTL_SECONDS}),
+        200,
+    )
+
+
 # api routes
 @api.route("/get-writ", methods=["GET"])
 @executioner_auth.login_required
 def get_writ():
-    """endpoint for executioners to get runs to execute"""
+    """endpoint for executioners to get runs to execute
 
-    # choose oldest priority run
-    chosen_run = (
-        model.Run.query.filter_by(
-            is_priority=True, started_execing_time=None, finished_execing_time=None
-        )
-        .order_by(model.Run.submit_time.asc())
-        .limit(1)
-        .first()
-    )
+    If the `wait` argument is given and no runs are queued, the request
+    blocks for up to that many seconds until a run is queued. If the
+    `languages` argument is given, only runs in those comma separated
+    languages are claimed.
+    """
 
-    # if no priority runs, choose oldest non-priority run
-    if chosen_run is None:
-        chosen_run = (
-            model.Run.query.filter_by(
-                started_execing_time=None, finished_execing_time=None
-            )
-            .order_by(model.Run.submit_time.asc())
-            .limit(1)
-            .first()
-        )
-    if chosen_run is None:
+    # claim the oldest priority run, or the oldest run if there are none
+    chosen_runs = _claim_runs_with_wait(1)
+    if not chosen_runs:
         return make_response(jsonify({"status": "unavailable"}), 200)
+    chosen_run = chosen_runs[0]
 
-    # TODO: use a better locking method to prevent dual execution
-    chosen_run.started_execing_time = datetime.datetime.utcnow()
-    db_session.commit()
+    resp = _get_writ_dict(chosen_run)
+    resp["status"] = "found"
 
-    resp = {
-        "status": "found",
-        "source_code": chosen_run.source_code,
-        "language": chosen_run.language.name,
-        "run_script": chosen_run.language.run_script,
-        "input": chosen_run.run_input,
-        "run_id": chosen_run.id,
-        "return_url": url_for("api.submit_writ", run_id=chosen_run.id, _external=True),
-    }
+    return make_response(jsonify(resp), 200)
+
+
+@api.route("/get-writs", methods=["GET"])
+@executioner_auth.login_required
+def get_writs():
+    """endpoint for executioners to claim up to `max` runs at once
+
+    Each writ is leased to the executor until its lease_expiration, after
+    which it will be handed out again if it hasn't been submitted. The batch
+    is capped at the number of writs that can run within a lease, given the
+    `writ_timeout` seconds the executor allows each writ. Supports the same
+    `wait` and `languages` arguments as get-writ.
+    """
+    writ_seconds = util.i(request.args.get("writ_timeout")) or DEFAULT_WRIT_SECONDS
+    max_writs_per_lease = util.EXECUTOR_TIMEOUT_MINS * 60 // max(writ_seconds, 1)
+
+    max_writs = util.i(request.args.get("max")) or 1
+    max_writs = max(min(max_writs, max_writs_per_lease), 1)
+
+    chosen_runs = _claim_runs_with_wait(max_writs)
+    if not chosen_runs:
+        return make_response(jsonify({"status": "unavailable", "writs": []}), 200)
+
+    resp = {"status": "found", "writs": [_get_writ_dict(x) for x in chosen_runs]}
 
     return make_response(jsonify(resp), 200)
 
@@ -101,8 +146,17 @@ def submit_writ(run_id):
 
     Looking for the format:
     {
-        "output": "..."
+        "lease_id": 1,
+        "output": "...",
+        "state": "...",
+        "is_output_matching": true,
+        "test_case_results": [...]
     }
+
+    When the executioner compares the output itself, it sends the verdict in
+    is_output_matching and only an excerpt of the output. test_case_results
+    is only sent for writs with test cases. lease_id is the writ's lease_id,
+    writs whose lease is no longer the run's current lease are rejected.
     """
     run = model.Run.query.get(util.i(run_id))
 
@@ -110,12 +164,6 @@ def submit_writ(run_id):
         current_app.logger.debug("Received writ without valid run, id: %s", run_id)
         abort(404)
 
-    if run.finished_execing_time:
-        current_app.logger.warning(
-            "Received writ submission for already submitted run, id: %s", run_id
-        )
-        abort(400)
-
     if not request.json:
         current_app.logger.debug("Received writ without json")
         abort(400)
@@ -126,13 +174,195 @@ def submit_writ(run_id):
         current_app.logger.debug("Received writ without the output field")
         abort(400)
 
-    run.run_output = request.json.get("output")
-    run.state = request.json.get("state") or run.state
-    run.finished_execing_time = datetime.datetime.utcnow()
+    if not _is_valid_writ_verdict(request.json):
+        current_app.logger.debug("Received writ with an invalid verdict")
+        abort(400)
+
+    if not run_queue.complete(run, util.i(request.json.get("lease_id"))):
+        current_app.logger.warning(
+            "Received writ submission for run without its current lease, id: %s",
+            run_id,
+        )
+        abort(400)
+
+    cache_keys = _get_writ_cache_keys([run])
+
+    _record_writ_output(run, request.json)
+    scoreboard.update_scores([scoreboard.get_score_key(run)])
+
+    db_session.commit()
+
+    _invalidate_writ_caches(cache_keys)
+
+    return "Good"
+
+
+@api.route("/submit-writs", methods=["POST"])
+@executioner_auth.login_required
+def submit_writs():
+    """endpoint for executioners to submit a batch of runs at once
+
+    Looking for the format:
+    {
+        "writs": [
+            {
+                "run_id": 1,
+                "lease_id": 1,
+                "output": "...",
+                "state": "...",
+                "is_output_matching": true,
+                "test_case_results": [...]
+            },
+            ...
+        ]
+    }
+
+    Responds with the status of each submitted writ, keyed by run id
+    """
+    if not request.json or not isinstance(request.json.get("writs"), list):
+        current_app.logger.debug("Received writs without json")
+        abort(400)
+
+    statuses = {}
+    submitted_runs = []
+    for writ in request.json["writs"]:
+        if not isinstance(writ, dict):
+            current_app.logger.debug("Received invalid writ in batch: %s", writ)
+            abort(400)
+
+        run_id = writ.get("run_id")
+        run = model.Run.query.get(util.i(run_id))
+
+        if not run:
+            current_app.logger.debug("Received writ without valid run, id: %s", run_id)
+            statuses[str(run_id)] = "NotFound"
+            continue
+
+        if not isinstance(writ.get("output"), six.string_types):
+            current_app.logger.debug("Received writ without the output field")
+            statuses[str(run_id)] = "Invalid"
+            continue
+
+        if not _is_valid_writ_verdict(writ):
+            current_app.logger.debug("Received writ with an invalid verdict")
+            statuses[str(run_id)] = "Invalid"
+            continue
+
+        if not run_queue.complete(run, util.i(writ.get("lease_id"))):
+            current_app.logger.warning(
+                "Received writ submission for run without its current lease, id: %s",
+                run_id,
+            )
+            statuses[str(run_id)] = "LeaseLost"
+            continue
+
+        submitted_runs.append(run)
+        _record_writ_output(run, writ)
+        statuses[str(run_id)] = "Good"
+
+    cache_keys = _get_writ_cache_keys(submitted_runs)
+    scoreboard.update_scores([scoreboard.get_score_key(x) for x in submitted_runs])
+
+    db_session.commit()
+
+    _invalidate_writ_caches(cache_keys)
+
+    return make_response(jsonify({"statuses": statuses}), 200)
+
+
+def _claim_runs_with_wait(max_runs):
+    """Claims up to max_runs runs in the request's `languages`, long-polling
+    for up to the number of seconds in the request's `wait` argument if none
+    are queued
+
+    Returns:
+        list: the claimed runs
+    """
+    wait_seconds = util.i(request.args.get("wait")) or 0
+    wait_seconds = min(max(wait_seconds, 0), MAX_WRIT_WAIT_SECONDS)
+    deadline = time.time() + wait_seconds
+
+    languages = None
+    if request.args.get("languages"):
+        languages = [x.strip() for x in request.args["languages"].split(",") if x]
+
+    while True:
+        queue_version = writ_notify.get_queue_version()
+        chosen_runs = run_queue.claim(max_runs, languages)
+
+        remaining_seconds = deadline - time.time()
+        if chosen_runs or remaining_seconds <= 0:
+            return chosen_runs
+
+        if not writ_notify.wait_for_run(queue_version, remaining_seconds):
+            return []
+
+
+def _get_writ_dict(run):
+    """Builds the writ handed to executioners for a claimed run"""
+    lease_expiration = run_queue.get_lease_expiration(run)
+
+    writ = {
+        "source_code": run.source_code,
+        "language": run.language.name,
+        "run_script": run.language.run_script,
+        "compile_script": run.language.compile_script,
+        "language_version": run.language.version,
+        "run_id": run.id,
+        "lease_id": run_queue.get_lease_id(run),
+        "return_url": url_for("api.submit_writ", run_id=run.id, _external=True),
+        "lease_expiration": util.dt_to_str(lease_expiration),
+    }
+
+    # test data is sent by hash, executioners fetch it from /api/test-data
+    # and cache it. Runs from before test data was stored by hash don't have one.
+    if run.run_input_hash:
+        writ["input_hash"] = run.run_input_hash
+    else:
+        writ["input"] = run.run_input
+
+    # submissions are compared by the executioner as the output streams in,
+    # test runs send back their whole output to show to the user
+    if run.is_submission and run.problem and run.problem.test_cases:
+        writ["test_cases"] = [
+            {
+                "case_number": x.case_number,
+                "input_hash": x.input_hash,
+                "output_hash": x.output_hash,
+            }
+            for x in run.problem.test_cases
+        ]
+    elif run.is_submission and run.correct_output_hash:
+        writ["expected_output_hash"] = run.correct_output_hash
+    elif run.is_submission:
+        writ["expected_output"] = run.correct_output
+
+    return writ
+
+
+def _record_writ_output(run, writ):
+    """Stores an executioner's output for a run and judges it
+
+    For writs with test cases, the output is from the last test case that
+    was run, which is the first failing case if any failed.
+
+    Params:
+        run (model.Run): the run the writ is for
+        writ (dict): the submitted writ, as described in submit_writ
+
+    Note:
+        the run's lease must have been completed, and the changes are not
+        committed
+    """
+    test_case_results = writ.get("test_case_results")
+
+    run.run_output = writ["output"]
+    run.state = writ.get("state") or run.state
+    run.test_case_data = json.dumps(test_case_results) if test_case_results else None
 
     if run.is_submission:
-        run.is_passed = clean_output_string(run.run_output) == clean_output_string(
-            run.correct_output
+        run.is_passed = _is_writ_output_passing(
+            run, writ.get("is_output_matching"), test_case_results
         )
 
         if run.state == model.RunState.EXECUTED:
@@ -148,20 +378,115 @@ def submit_writ(run_id):
                 else:
                     run.state = model.RunState.FAILED
 
-    if run.is_submission:
-        util.invalidate_cache_item(util.SCORE_CACHE_NAME, run.contest.id)
-
     if run.user.username == "exec":
         util.add_versions(run.run_output)
         db_session.delete(run)
         version_contest = model.Contest.query.filter_by(name="version_contest").first()
         db_session.delete(version_contest)
 
-    db_session.commit()
 
-    util.invalidate_cache_item(util.RUN_CACHE_NAME, run.user_id)
+def _is_writ_output_passing(run, is_output_matching, test_case_results):
+    """Judges a submission's output, using the executioner's verdict if it
+    compared the output itself
 
-    return "Good"
+    Returns:
+        bool: whether or not the run passed
+    """
+    test_cases = run.problem.test_cases if run.problem else []
+    if test_case_results and test_cases:
+        # the executioner stops at the first failing case, so every case
+        # must have been run and passed
+        ran_case_numbers = [x["case_number"] for x in test_case_results]
+        if ran_case_numbers != [x.case_number for x in test_cases]:
+            return False
+
+        return all(x["is_passed"] for x in test_case_results)
+
+    if is_output_matching is not None:
+        return is_output_matching
+
+    return clean_output_string(run.run_output) == clean_output_string(
+        run.correct_output
+    )
+
+
+def _is_valid_writ_verdict(writ):
+    """Checks the verdict fields sent with a writ, which may be missing"""
+    if not isinstance(writ.get("is_output_matching", False), bool):
+        return False
+
+    test_case_results = writ.get("test_case_results")
+    if test_case_results is None:
+        return True
+
+    if not isinstance(test_case_results, list):
+        return False
+
+    for result in test_case_results:
+        if not isinstance(result, dict):
+            return False
+        if not isinstance(result.get("case_number"), int):
+            return False
+        if not isinstance(result.get("is_passed"), bool):
+            return False
+        if not isinstance(result.get("state"), six.string_types):
+            return False
+        if not isinstance(result.get("time"), (int, float)):
+            return False
+
+    return True
+
+
+def _get_writ_cache_keys(runs):
+    """Gets the cache items affected by submitting runs
+
+    Note:
+        this must be called before committing, as the exec user's version
+        runs are deleted on submission
+
+    Returns:
+        tuple: the set of score cache keys and the set of run cache keys
+    """
+    score_keys = set()
+    for run in runs:
+        # a frozen scoreboard is served from the score cache until the contest
+        # is unfrozen, only submissions from before the freeze can change it
+        if run.is_submission and not _is_hidden_by_freeze(run):
+            score_keys.add(run.contest_id)
+
+    run_keys = {x.user_id for x in runs}
+    return score_keys, run_keys
+
+
+def _is_hidden_by_freeze(run):
+    """Checks whether a run was submitted after its contest's scoreboard froze"""
+    freeze_time = run.contest.get_scoreboard_freeze_time()
+    return freeze_time is not None and run.submit_time >= freeze_time
+
+
+def _invalidate_writ_caches(cache_keys):
+    """Invalidates the cached scores and runs affected by submitted runs"""
+    score_keys, run_keys = cache_keys
+
+    for contest_id in score_keys:
+        util.invalidate_cache_item(util.SCORE_CACHE_NAME, contest_id)
+
+    for user_id in run_keys:
+        util.invalidate_cache_item(util.RUN_CACHE_NAME, user_id)
+
+
+@api.route("/test-data/<data_hash>", methods=["GET"])
+@executioner_auth.login_required
+def get_test_data(data_hash):
+    """endpoint for executioners to fetch the test data referenced by writs
+
+    Test data never changes for a given hash, so executioners cache it
+    """
+    test_data = model.TestData.query.get(data_hash)
+    if not test_data:
+        abort(404)
+
+    return current_app.response_class(test_data.contents, mimetype="text/plain")
 
 
 @api.route("/return-without-run/<run_id>", methods=["POST"])
@@ -169,21 +494,25 @@ def submit_writ(run_id):
 def return_without_run(run_id):
     """Allows for executors to return a writ without running if they are
     experiencing errors or are shutting down
+
+    Looking for the format:
+    {
+        "lease_id": 1
+    }
     """
     run = model.Run.query.get(util.i(run_id))
     if not run:
         current_app.logger.debug("Received writ without valid run, id: %s", run_id)
         abort(404)
 
-    if run.finished_execing_time:
+    lease_id = util.i((request.get_json(silent=True) or {}).get("lease_id"))
+    if not run_queue.release(run, lease_id):
         current_app.logger.warning(
-            "Received return for already returned writ, id: %s", run_id
+            "Received return for writ without its run's current lease, id: %s",
+            run_id,
         )
         abort(400)
 
-    run.started_execing_time = None
-    db_session.commit()
-
     return "Good"
 
 
@@ -268,21 +597,42 @@ def get_problem(slug):
 @api.route("/problems/<user_id>")
 @api.route("/problems")
 @jwt_required
+@cache.cached_response(
+    util.RUN_CACHE_NAME, key=lambda user_id=None: get_jwt_identity()
+)
 def get_all_problems(user_id=None):
-    current_user_id = get_jwt_identity()
-    curr_user = model.User.query.get(util.i(current_user_id))
-
-    problems = model.Problem.query.filter_by(is_enabled=True).all()
-    runs = model.Run.query.filter_by(user=curr_user).all()
+    curr_user = get_jwt_user()
 
     if len(curr_user.contests) == 0:
         return make_response(jsonify({"error": "User has no contests"}), 400)
 
-    problems = (p for p in problems if curr_user.contests[0] in p.contests)
+    # this is polled by every defendant, so the number of queries mustn't grow
+    # with the number of problems or runs
+    problems = (
+        model.Problem.query.filter_by(is_enabled=True)
+        .filter(model.Problem.contests.any(id=curr_user.contests[0].id))
+        .options(
+            joinedload(model.Problem.problem_type), undefer_group("statement")
+        )
+        .all()
+    )
+    runs = (
+        model.Run.query.filter_by(user_id=curr_user.id)
+        .options(joinedload(model.Run.language))
+        .all()
+    )
+
+    runs_by_problem_id = collections.defaultdict(list)
+    for run in runs:
+        runs_by_problem_id[run.problem_id].append(run)
 
     resp = {}
     for problem in problems:
-        problem_run_dicts = [x.get_output_dict() for x in runs if x.problem == problem]
+        # runs are summarized as they're polled, the details of each run are
+        # fetched from /api/run/<run_id>
+        problem_run_dicts = [
+            x.get_summary_dict() for x in runs_by_problem_id[problem.id]
+        ]
 
         problem_dict = problem.get_output_dict()
         problem_dict["runs"] = problem_run_dicts
@@ -292,6 +642,21 @@ def get_all_problems(user_id=None):
     return make_response(jsonify(resp), 200)
 
 
+@api.route("/run/<run_id>", methods=["GET"])
+@jwt_required
+def get_run(run_id):
+    """Gets the details of one of the current user's runs"""
+    current_user_id = get_jwt_identity()
+    run = model.Run.query.get(util.i(run_id))
+
+    if not run or run.user_id != util.i(current_user_id):
+        return make_response(jsonify({"error": "Could not find run"}), 404)
+
+    resp = make_response(jsonify(run.get_output_dict()), 200)
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+
 @api.route("/submit_clarification", methods=["POST"])
 @jwt_required
 def submit_clarification():
@@ -337,8 +702,7 @@ def get_languages():
 @api.route("/current-user", methods=["GET"])
 @jwt_required
 def get_current_user():
-    current_user_id = get_jwt_identity()
-    curr_user = model.User.query.get(util.i(current_user_id))
+    curr_user = get_jwt_user()
 
     resp = None
     if curr_user:
@@ -349,21 +713,17 @@ def get_current_user():
 
 @api.route("/conf/<user_id>", methods=["GET"])
 @api.route("/conf", methods=["GET"])
+@cache.cached_response(
+    util.CONF_CACHE_NAME, key=lambda user_id=None: "all", serve_stale=True
+)
 def get_conf(user_id=None):
-    configurations = model.Configuration.query.all()
-
-    conf_dict = {}
-    for configuration in configurations:
-        conf_dict[configuration.key] = configuration.convertedVal
-
-    return make_response(jsonify(conf_dict), 200)
+    return make_response(jsonify(util.get_configurations()), 200)
 
 
 @api.route("/submit-run", methods=["POST"])
 @jwt_required
 def submit_run():
-    current_user_id = get_jwt_identity()
-    user = model.User.query.get(util.i(current_user_id))
+    user = get_jwt_user()
 
     MAX_RUNS = util.get_configuration("max_user_submissions")
     TIME_LIMIT = util.get_configuration("user_submission_time_limit")
@@ -437,18 +797,57 @@ def submit_run():
     db_session.add(run)
     db_session.commit()
 
+    if not run.finished_execing_time:
+        run_queue.enqueue(run)
+
     util.invalidate_cache_item(util.RUN_CACHE_NAME, run.user_id)
 
     return resp
 
 
 @api.route("/scores/<contest_id>", methods=["GET"])
+@cache.cached_response(
+    util.SCORE_CACHE_NAME,
+    key=lambda contest_id: contest_id,
+    soft_ttl=SCOREBOARD_SOFT_TTL_SECONDS,
+    serve_stale=True,
+)
 def get_scoreboard(contest_id):
+    """The public scoreboard, which stops counting submissions made after the
+    contest's freeze time until the contest is unfrozen"""
+    contest = model.Contest.query.get(contest_id)
+
+    if not contest:
+        return make_response(jsonify({"error": "Could not find contest"}), 404)
+
+    is_frozen = contest.get_scoreboard_freeze_time() is not None
+    return _get_scoreboard_response(contest, is_frozen)
+
+
+@api.route("/scores/<contest_id>/live", methods=["GET"])
+@util.login_required("operator")
+def get_live_scoreboard(contest_id):
+    """The judges' scoreboard, which counts every verdict even while the public
+    scoreboard is frozen"""
     contest = model.Contest.query.get(contest_id)
 
     if not contest:
         return make_response(jsonify({"error": "Could not find contest"}), 404)
 
+    return _get_scoreboard_response(contest, False)
+
+
+def _get_scoreboard_response(contest, is_frozen):
+    """
+    Builds a scoreboard response
+
+    Params:
+        contest (model.Contest): the contest
+        is_frozen (bool): whether to build the frozen scoreboard
+
+    Returns:
+        the scoreboard response
+    """
     defendants = (
         model.User.query.filter(model.User.user_roles.any(name="defendant"))
         .filter(model.User.contests.any(id=contest.id))
@@ -461,53 +860,9 @@ def get_scoreboard(contest_id):
         .all()
     )
 
-    runs = (
-        model.Run.query.filter_by(is_submission=True, contest=contest)
-        .options(joinedload(model.Run.user), joinedload(model.Run.problem))
-        .all()
+    user_points = scoreboard.get_user_points(
+        contest.id, defendants, problems, is_frozen
     )
-    key = lambda x: (x.user.id, x.problem.id, x.is_passed)
-
-    runs = {
-        k: list(v)
-        for k, v in itertools.groupby(
-            sorted(
-                filter(
-                    lambda x: x.user.id is not None
-                    and x.problem.id is not None
-                    and x.is_passed is not None,
-                    runs,
-                ),
-                key=key,
-            ),
-            key=key,
-        )
-    }
-
-    user_points = []
-    for user in defendants:
-        problem_states = {}
-        penalty = 0
-        for problem in problems:
-            problem_states[problem.slug] = (
-                len(runs.get((user.id, problem.id, True), [])) > 0
-            )
-            penalty += (
-                len(runs.get((user.id, problem.id, False), []))
-                if (user.id, problem.id, True) in runs
-                else 0
-            )
-
-        user_points.append(
-            {
-                "user": user.get_output_dict(),
-                "num_solved": len([x for x in problem_states.values() if x]),
-                "penalty": penalty,
-                "problem_states": problem_states,
-            }
-        )
-
-    user_points.sort(key=lambda x: (x["num_solved"], -x["penalty"]), reverse=True)
 
     return make_response(jsonify(user_points))
 
@@ -515,8 +870,7 @@ def get_scoreboard(contest_id):
 @api.route("/get-contest-info")
 @jwt_required
 def get_contest_info():
-    current_user_id = get_jwt_identity()
-    curr_user = model.User.query.get(util.i(current_user_id))
+    curr_user = get_jwt_user()
 
     if not curr_user:
         return make_response(jsonify({"error": "Not logged in"}), 400)
@@ -542,8 +896,7 @@ def make_user():
     - get auth token: curl -H "Content-Type: application/json" --data '{"username": "admin", "password": "pass"}' http://localhost:9191/api/login
     - make request: curl -H "Authorization: Bearer *token_goes_here*" -H "Content-Type: application/json" --data '{"name": "Ben", "username": "bdoan", "password": "pass"}' http://localhost:9191/api/make-defendant-user
     """
-    current_user_id = get_jwt_identity()
-    curr_user = model.User.query.get(util.i(current_user_id))
+    curr_user = get_jwt_user()
 
     if not curr_user:
         return make_response(jsonify({"error": "Not logged in"}), 400)
@@ -590,8 +943,7 @@ def make_user():
 @api.route("/update-user-metadata", methods=["POST"])
 @jwt_required
 def update_user_metadata():
-    current_user_id = get_jwt_identity()
-    curr_user = model.User.query.get(util.i(current_user_id))
+    curr_user = get_jwt_user()
 
     if not curr_user:
         return make_response(jsonify({"error": "Not logged in"}), 400)
@@ -620,6 +972,8 @@ def update_user_metadata():
     matching_user.merge_metadata(user_misc_metadata)
     db_session.commit()
 
+    util.invalidate_identities()
+
     return make_response(jsonify({"status": "Success"}), 200)
 
 
@@ -640,44 +994,7 @@ def load_test():
         .all()
     )
 
-    user_points = []
-    for user in defendants:
-        problem_states = {}
-        penalty = 0
-        for problem in problems:
-            is_passed = 0 < len(
-                model.Run.query.filter_by(
-                    is_submission=True,
-                    is_passed=True,
-                    user=user,
-                    contest=contest,
-                    problem=problem,
-                ).all()
-            )
-            problem_states[problem.slug] = is_passed
-
-            failed_subs = model.Run.query.filter_by(
-                is_submission=True,
-                is_passed=False,
-                user=user,
-                contest=contest,
-                problem=problem,
-            ).all()
-
-            for sub in failed_subs:
-                penalty += 1  # TODO we may want to use the time submitted instead of 1
-                #      to match ICPC scoring
-
-        user_points.append(
-            {
-                "user": user.get_output_dict(),
-                "num_solved": len([x for x in problem_states.values() if x]),
-                "penalty": penalty,
-                "problem_states": problem_states,
-            }
-        )
-
-    user_points.sort(key=lambda x: (x["num_solved"], -x["penalty"]), reverse=True)
+    user_points = scoreboard.get_user_points(contest.id, defendants, problems)
 
     user = model.User.query.filter_by(username="testuser1").scalar()
     if not user or not user.verify_password("test"):
@@ -759,6 +1076,8 @@ def signout_user(username):
     matching_user.merge_metadata({"signout": util.i(time.time())})
     db_session.commit()
 
+    util.invalidate_identities()
+
     return make_response(jsonify({"status": "Success"}), 200)
 
 
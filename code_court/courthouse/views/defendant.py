@@ -11,6 +11,7 @@ import model
 from database import db_session
 
 from flask_login import current_user
+from sqlalchemy.orm import undefer_group
 from flask import abort, Blueprint, current_app, render_template, request, Markup
 
 defendant = Blueprint("defendant", __name__, template_folder="templates")
@@ -59,6 +60,8 @@ def problem(problem_id):
 def submissions():
     submissions = model.Run.query.filter_by(
         user=current_user, is_submission=True
+    ).options(
+        undefer_group("run_data")
     ).order_by(
         model.Run.submit_time.desc()
     ).all()
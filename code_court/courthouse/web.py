@@ -24,7 +24,10 @@ from flask_sqlalchemy import get_debug_queries
 
 import werkzeug
 
+import cache
+import migrations
 import model
+import run_queue
 import util
 
 from database import db_session, init_db, engine
@@ -51,6 +54,8 @@ log_location = "logs/code_court.log"
 app = Flask(__name__)
 
 CODE_COURT_PRODUCTION_ENV_VAR = "CODE_COURT_PRODUCTION"
+CODE_COURT_CACHE_BACKEND_ENV_VAR = "CODE_COURT_CACHE_BACKEND"
+CODE_COURT_CACHE_REDIS_URL_ENV_VAR = "CODE_COURT_CACHE_REDIS_URL"
 
 
 def create_app():
@@ -80,6 +85,19 @@ def create_app():
         CODE_COURT_PRODUCTION_ENV_VAR
     ) else "DEVELOPMENT"
 
+    # defaults to a shared memory cache under uwsgi and an in-process one
+    # otherwise, see cache.py
+    app.config["CACHE_BACKEND"] = os.getenv(CODE_COURT_CACHE_BACKEND_ENV_VAR)
+    app.config["CACHE_REDIS_URL"] = os.getenv(
+        CODE_COURT_CACHE_REDIS_URL_ENV_VAR, "redis://localhost:6379/0"
+    )
+    app.config["CACHE_DEFAULT_TTL"] = 60 * 60
+    cache.init_app(app)
+
+    # runs are queued in the run table unless RUN_QUEUE_BACKEND is set, see
+    # run_queue.py
+    run_queue.init_app(app)
+
     # Add custom filters to Jinja2
     # http://flask.pocoo.org/docs/0.12/templating/
     app.jinja_env.filters["dt_to_str"] = util.dt_to_str
@@ -90,6 +108,11 @@ def create_app():
     app.logger.setLevel(logging.DEBUG)
 
     init_db()
+
+    # the code relies on the latest schema, so don't serve from a database
+    # that's missing some of it
+    migrations.check_schema(engine)
+
     if not app.config["TESTING"]:
         setup_database(app)
 
@@ -100,7 +123,7 @@ def create_app():
 
     CORS(app, supports_credentials=True)
 
-    JWTManager(app)
+    jwt = JWTManager(app)
 
     login_manager = LoginManager()
     login_manager.init_app(app)
@@ -113,7 +136,11 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(username):
-        return model.User.query.filter_by(username=username).scalar()
+        return util.load_identity_by_username(username)
+
+    @jwt.user_loader_callback_loader
+    def load_jwt_user(user_id):
+        return util.load_identity(user_id)
 
     app.register_blueprint(main, url_prefix="")
     app.register_blueprint(api, url_prefix="/api")
@@ -169,6 +196,10 @@ def create_app():
                 f.write("=========\n\n")
         return resp
 
+    # uwsgi forks its workers after the app is created, so the connections
+    # opened while creating it are closed instead of being shared with them
+    engine.dispose()
+
     return app
 
 
@@ -286,19 +317,17 @@ def populate_db():
                 textwrap.dedent(
                     """
                                 #!/bin/bash
-                                cp /share/program $scratch_dir/program.f
-
-                                cd $scratch_dir
-
-                                gfortran -o program $scratch_dir/program.f
-
-                                if [[ $? != 0 ]]; then
-                                  exit $?
-                                fi
+                                cat $input_file | $build_dir/program
+                                exit $?"""
+                ).strip(),
+                compile_script=textwrap.dedent(
+                    """
+                                #!/bin/bash
+                                cp $program_file $build_dir/program.f
 
-                                cat $input_file | ./program
+                                cd $build_dir
 
-                                exit $?"""
+                                gfortran -o program program.f"""
                 ).strip(),
             ),
             model.Language(
@@ -308,18 +337,7 @@ def populate_db():
                 textwrap.dedent(
                     """
                                 #!/bin/bash
-                                cp $program_file $scratch_dir/program.c
-
-                                cd $3
-
-                                gcc -o program $scratch_dir/program.c
-
-                                if [[ $? != 0 ]]; then
-                                  exit $?
-                                fi
-
-                                cat $input_file | ./program
-
+                                cat $input_file | $build_dir/program
                                 exit $?"""
                 ).strip(),
                 textwrap.dedent(
@@ -329,6 +347,15 @@ def populate_db():
                                 int main(int argc, const char* argv[]) {
                                 }"""
                 ),
+                textwrap.dedent(
+                    """
+                                #!/bin/bash
+                                cp $program_file $build_dir/program.c
+
+                                cd $build_dir
+
+                                gcc -o program program.c"""
+                ).strip(),
             ),
             model.Language(
                 "c++",
@@ -337,18 +364,7 @@ def populate_db():
                 textwrap.dedent(
                     """
                                 #!/bin/bash
-                                cp $program_file $scratch_dir/program.cpp
-
-                                cd $scratch_dir
-
-                                g++ -o program $scratch_dir/program.cpp
-
-                                if [[ $? != 0 ]]; then
-                                  exit $?
-                                fi
-
-                                cat $input_file | ./program
-
+                                cat $input_file | $build_dir/program
                                 exit $?"""
                 ).strip(),
                 textwrap.dedent(
@@ -359,6 +375,15 @@ def populate_db():
                                   std::cout << "Hello World!";
                                 }"""
                 ),
+                textwrap.dedent(
+                    """
+                                #!/bin/bash
+                                cp $program_file $build_dir/program.cpp
+
+                                cd $build_dir
+
+                                g++ -o program program.cpp"""
+                ).strip(),
             ),
             model.Language(
                 "java",
@@ -369,18 +394,7 @@ def populate_db():
                                 #!/bin/bash
                                 export PATH=$PATH:/usr/lib/jvm/java-1.8-openjdk/bin
 
-                                cp $program_file $scratch_dir/Main.java
-
-                                cd $scratch_dir
-
-                                javac Main.java
-
-                                if [[ $? != 0 ]]; then
-                                  exit $?
-                                fi
-
-                                cat $input_file | java Main
-
+                                cat $input_file | java -cp $build_dir Main
                                 exit $?"""
                 ).strip(),
                 textwrap.dedent(
@@ -391,6 +405,17 @@ def populate_db():
                                     }
                                 }"""
                 ),
+                textwrap.dedent(
+                    """
+                                #!/bin/bash
+                                export PATH=$PATH:/usr/lib/jvm/java-1.8-openjdk/bin
+
+                                cp $program_file $build_dir/Main.java
+
+                                cd $build_dir
+
+                                javac Main.java"""
+                ).strip(),
             ),
             model.Language(
                 "ruby",
@@ -410,17 +435,7 @@ def populate_db():
                 textwrap.dedent(
                     """
                                         #!/bin/bash
-                                        cp /share/program $scratch_dir/main.rs
-
-                                        cd $scratch_dir
-
-                                        rustc $scratch_dir/main.rs
-
-                                        if [[ $? != 0 ]]; then
-                                          exit $?
-                                        fi
-
-                                        cat $input_file | ./main
+                                        cat $input_file | $build_dir/main
                                         exit $?"""
                 ).strip(),
                 textwrap.dedent(
@@ -429,6 +444,15 @@ def populate_db():
                                         }
                         """
                 ).strip(),
+                textwrap.dedent(
+                    """
+                                        #!/bin/bash
+                                        cp $program_file $build_dir/main.rs
+
+                                        cd $build_dir
+
+                                        rustc main.rs"""
+                ).strip(),
             ),
         ]
     )
@@ -0,0 +1,88 @@
+"""
+Wakes up executioners that are long-polling for writs when runs are queued
+
+Waiters block on a condition variable in their process. Under uwsgi a queued
+run raises a uwsgi signal that's delivered to every worker, including from
+the spooler, and each worker's handler wakes up its own waiters.
+
+Long polls hold a request thread for as long as they wait, so each process
+only lets CODE_COURT_MAX_WRIT_WAITERS of them wait at once (2), leaving the
+rest of its threads to defendants. Under uwsgi the free threads are also the
+ones that handle the wakeup signal. Polls beyond the limit return straight
+away, as if they had timed out, and the executioner polls again after its
+usual wait.
+"""
+import os
+import threading
+
+try:
+    import uwsgi
+    import uwsgidecorators
+except ImportError:
+    uwsgi = None
+
+MAX_WAITERS = int(os.environ.get("CODE_COURT_MAX_WRIT_WAITERS", 2))
+
+_condition = threading.Condition()
+_queue_version = 0
+_waiter_slots = threading.BoundedSemaphore(MAX_WAITERS)
+
+
+def get_queue_version():
+    """
+    Gets an opaque token that changes every time a run is queued
+
+    Returns:
+        the current queue version
+    """
+    with _condition:
+        return _queue_version
+
+
+def notify_run_queued():
+    """Wakes up all executioners waiting for runs"""
+    if uwsgi:
+        uwsgi.signal(RUN_QUEUED_SIGNAL)
+        return
+
+    _wake_waiters()
+
+
+def wait_for_run(queue_version, timeout):
+    """
+    Blocks until a run has been queued since queue_version was read, or
+    until the timeout passes. Returns straight away if too many waiters are
+    already waiting in this process.
+
+    Params:
+        queue_version: a version previously returned by get_queue_version
+        timeout (float): the maximum number of seconds to wait
+
+    Returns:
+        bool: True if a run was queued, False if the wait timed out or there
+            were too many waiters
+    """
+    if not _waiter_slots.acquire(blocking=False):
+        return False
+
+    try:
+        with _condition:
+            return _condition.wait_for(lambda: _queue_version != queue_version, timeout)
+    finally:
+        _waiter_slots.release()
+
+
+def _wake_waiters(signum=None):
+    """Wakes up the waiters in this process"""
+    global _queue_version
+
+    with _condition:
+        _queue_version += 1
+        _condition.notify_all()
+
+
+if uwsgi:
+    # registered when the app is loaded in the master, so every worker and the
+    # spooler share the signal number
+    RUN_QUEUED_SIGNAL = uwsgidecorators.get_free_signal()
+    uwsgi.register_signal(RUN_QUEUED_SIGNAL, "workers", _wake_waiters)
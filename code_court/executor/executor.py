@@ -1,13 +1,20 @@
 #!/usr/bin/env python
 
 import argparse
+import codecs
+import contextlib
+import datetime
+import hashlib
+import json
 import logging
 import os
+import queue
 import shutil
 import signal
 import stat
 import subprocess
 import sys
+import threading
 import time
 import traceback
 import uuid
@@ -20,87 +27,355 @@ import requests
 from requests.auth import HTTPBasicAuth
 
 logging.basicConfig(level=logging.INFO,
-                    format="%(asctime)s %(levelname)s: %(message)s",
+                    format="%(asctime)s %(levelname)s [%(threadName)s]: %(message)s",
                     datefmt="%Y-%m-%d %H:%M:%S")
 
 SCRIPT_DIR = path.dirname(path.realpath(__file__))
 
 EXECUTOR_IMAGE_NAME = "code-court-executor"
 SHARED_DATA_DIR = path.join(SCRIPT_DIR, "share_data")
+BUILD_CACHE_DIR = path.join(SCRIPT_DIR, "build_cache")
+TEST_DATA_CACHE_DIR = path.join(SCRIPT_DIR, "test_data_cache")
 
 CPU_PERIOD = 500000
 MEM_LIMIT = "128m"
 PID_LIMIT = 50
 MEM_SWAPPINESS = 0
 CONTAINER_USER = "user"
+CONTAINER_UID = 1000
+# containers have a read only root filesystem, and these are the only places
+# programs can write to. Each is a tmpfs, so nothing written survives the
+# container, and pooled containers clear them between writs
+CONTAINER_TMPFS_DIRS = ["/scratch", "/tmp", "/var/tmp", "/home/" + CONTAINER_USER]
+CONTAINER_TMPFS_OPTIONS = "rw,exec,nosuid,size=64m,uid={},mode=1777".format(CONTAINER_UID)
 WAIT_SECONDS = 5
 
+# keeps pooled containers alive between writs
+POOL_KEEPALIVE_COMMAND = "tail -f /dev/null"
+# kills anything left running by the last writ and clears everything it could
+# have written, kill -1 never signals the container's init process or the
+# shell itself. /dev/shm is the one writable place docker mounts itself
+POOL_RESET_COMMAND = ["sh", "-c", "kill -9 -1; rm -rf {}; true".format(
+    " ".join("{0}/* {0}/.[!.]*".format(x) for x in CONTAINER_TMPFS_DIRS + ["/dev/shm"]))]
+POOL_ACQUIRE_TIMEOUT = 60
+POOL_METRICS_LOG_INTERVAL = 50
+
+# when output is compared as it streams in, only this much of it is sent back
+# to the courthouse
+OUTPUT_EXCERPT_CHARS = 2000
+MISMATCHED_LINE_CHARS = 200
+
+# tokens are renewed this long before they expire, and if the courthouse
+# doesn't issue tokens basic auth is used for this long before asking again
+TOKEN_RENEW_SECONDS = 60
+TOKEN_RETRY_SECONDS = 300
+
 
 class Executor:
-    def __init__(self, conf):
+    def __init__(self, conf, stop_event=None, pool=None, build_cache=None, test_data_cache=None, auth=None):
         self.writ = None
+        self.pending_writs = []
         self.conf = conf
         self.client = docker.from_env()
         self.container = None
+        self.pooled_container = None
+        self.pool = pool
+        self.build_cache = build_cache or BuildCache(BUILD_CACHE_DIR, conf['build_cache_size'])
+        self.test_data_cache = test_data_cache or TestDataCache(TEST_DATA_CACHE_DIR, conf['test_data_cache_size'])
+        self.auth = auth or CourthouseAuth(conf)
+        self.process = None
+        self.timer = None
+        self.writ_deadline = None
+        self.lease_deadline = None
+        self.test_case_results = None
+        self.is_output_matching = None
+        self.timed_out = False
+        self.lease_expired = False
+        self.program_lock = threading.Lock()
+        self.stop_event = stop_event or threading.Event()
 
     def start(self):
-        while True:
+        if self.conf['pool_size'] > 0 and not self.conf['insecure']:
+            self.pool = ContainerPool(self.client, self.conf['pool_size'], self.conf['recycle_after'])
+
+        if self.conf['concurrency'] > 1:
+            self.start_workers()
+        else:
+            while True:
+                self._run()
+
+    def start_workers(self):
+        # each worker has its own Executor, and so its own docker client and container
+        workers = []
+        for i in range(self.conf['concurrency']):
+            worker = threading.Thread(
+                target=Executor(self.conf, self.stop_event, self.pool, self.build_cache, self.test_data_cache,
+                                self.auth).work,
+                name="worker-{}".format(i),
+            )
+            worker.start()
+            workers.append(worker)
+
+        logging.info("Started %s workers", len(workers))
+        try:
+            while any(x.is_alive() for x in workers):
+                for worker in workers:
+                    worker.join(1)
+        except KeyboardInterrupt:
+            logging.info("Exiting, waiting for workers to finish their current writs")
+            self.stop_event.set()
+            for worker in workers:
+                worker.join()
+            if self.pool:
+                self.pool.close()
+            sys.exit(0)
+
+        logging.error("All workers have exited")
+        sys.exit(1)
+
+    def work(self):
+        while not self.stop_event.is_set():
             self._run()
+        self.return_pending_writs()
 
     def _run(self):
         try:
-            self.writ = self.get_writ()
-            if not self.writ:
-                time.sleep(WAIT_SECONDS)
+            if self.conf['batch_size'] > 1:
+                self.handle_writ_batch()
             else:
-                self.handle_writ()
+                poll_start = time.time()
+                self.writ = self.get_writ()
+                if not self.writ:
+                    self.wait_after_poll(poll_start)
+                else:
+                    self.handle_writ()
         except KeyboardInterrupt:
             logging.info("Exiting")
             if self.writ:
                 self.return_writ_without_output()
+            self.return_pending_writs()
+            if self.pool:
+                self.pool.close()
             sys.exit(0)
         except Exception:
-            logging.exception("Uncaught exception, exiting")
-            sys.exit(1)
+            # this runs in worker threads, where exiting would only stop the
+            # worker, so the writs are handed back and the worker keeps going
+            logging.exception("Uncaught exception, returning writs")
+            if self.writ:
+                self.return_writ_without_output()
+                self.writ = None
+            self.return_pending_writs()
+            time.sleep(WAIT_SECONDS)
+
+    def return_pending_writs(self):
+        while self.pending_writs:
+            self.writ = self.pending_writs.pop(0)
+            self.return_writ_without_output()
+        self.writ = None
+
+    def wait_after_poll(self, poll_start):
+        # long polls have already waited on the courthouse, so only sleep
+        # for whatever is left of WAIT_SECONDS, e.g. if the request failed
+        elapsed = time.time() - poll_start
+        time.sleep(max(WAIT_SECONDS - elapsed, 0))
+
+    def get_poll_params(self):
+        params = {}
+        if self.conf['long_poll'] > 0:
+            params['wait'] = self.conf['long_poll']
+        if self.conf.get('languages'):
+            params['languages'] = self.conf['languages']
+        return params
+
+    def handle_writ_batch(self):
+        poll_start = time.time()
+        self.pending_writs = self.get_writs()
+        if not self.pending_writs:
+            self.wait_after_poll(poll_start)
+            return
+
+        # each result is submitted as soon as it's ready, as the rest of the
+        # batch's leases keep running while the writs are executed in turn
+        while self.pending_writs and not self.stop_event.is_set():
+            self.writ = self.pending_writs.pop(0)
+            if self.writ.is_lease_expired():
+                # the courthouse may have handed the writ to another executor
+                logging.warn("Lease expired on writ %s before it was executed, returning it", self.writ.run_id)
+                self.return_writ_without_output()
+                self.writ = None
+                continue
+            self.handle_writ()
 
     def handle_writ(self):
         logging.info("Executing writ (id: %s, lang: %s)", self.writ.run_id, self.writ.language)
 
-        signal.signal(signal.SIGALRM, raise_timeout)
-        signal.alarm(self.conf['timeout'])
+        try:
+            self.load_test_data()
+        except TestDataUnavailableException as e:
+            logging.error("Failed to get test data for writ %s: %s", self.writ.run_id, e)
+            self.return_writ_without_output()
+            self.writ = None
+            return
+
+        self.timed_out = False
+        self.lease_expired = False
+        self.test_case_results = None
+        self.is_output_matching = None
+        self.writ_deadline = self.get_writ_deadline()
+        self.lease_deadline = self.get_lease_deadline()
+        self.start_timer()
 
         try:
             if self.conf['insecure']:
                 out = self.insecure_run_program()
+            elif self.pool:
+                out = self.docker_pooled_run_program()
             else:
                 out = self.docker_run_program()
-
-            signal.alarm(0)
         except TimedOutException:
-            logging.info("Timed out writ %s", self.writ.run_id)
-            self.submit_writ("Error: Timed out", RunState.TIMED_OUT)
+            if self.lease_expired:
+                # running out of lease isn't the program's fault, so the writ
+                # is handed back to be judged again instead of timing out
+                logging.warn("Lease expired on writ %s while it was executed, returning it", self.writ.run_id)
+                self.return_writ_without_output()
+            else:
+                logging.info("Timed out writ %s", self.writ.run_id)
+                self.submit_writ("Error: Timed out", RunState.TIMED_OUT)
         except OutputLimitExceeded:
             logging.info("Output limit exceeded on writ %s", self.writ.run_id)
             self.submit_writ("Error: Output limit exceeded", RunState.OUTPUT_LIMIT_EXCEEDED)
         except NoOutputException:
             logging.info("No output given from writ %s", self.writ.run_id)
             self.submit_writ("", RunState.NO_OUTPUT)
-        except docker.errors.APIError:
+        except (docker.errors.APIError, PoolExhaustedException, BuildDirResetException):
             self.return_writ_without_output()
             traceback.print_exc()
+        except Exception:
+            # the writ is cleared below, so it's returned before the exception
+            # reaches _run
+            self.return_writ_without_output()
+            raise
         else:
             self.submit_writ(self.clean_output(out), RunState.EXECUTED)
         finally:
-            signal.alarm(0)
-            if self.container:
-                self.container.remove(force=True)
+            self.timer.cancel()
+            with self.program_lock:
+                if self.pooled_container:
+                    # a timed out container has been killed, so can't be reused
+                    self.pool.release(self.pooled_container, is_reusable=not self.timed_out)
+                    self.pooled_container = None
+                elif self.container:
+                    self.container.remove(force=True)
                 self.container = None
+                self.process = None
+            for data_dir in (self.writ.shared_data_dir, self.writ.build_dir):
+                try:
+                    shutil.rmtree(data_dir)
+                except FileNotFoundError:
+                    pass
+
+            self.writ = None
+            self.writ_deadline = None
+            self.lease_deadline = None
+            self.test_case_results = None
+            self.is_output_matching = None
+
+    def load_test_data(self):
+        """Fills in the test data the writ references by hash, downloading any
+        that isn't in the test data cache"""
+        writ = self.writ
+        if writ.input_hash:
+            writ.input = self.test_data_cache.get(writ.input_hash, self.download_test_data)
+
+        if writ.expected_output_hash:
+            writ.expected_output = self.test_data_cache.get(writ.expected_output_hash, self.download_test_data)
+
+        for test_case in writ.test_cases or []:
+            if 'input_hash' in test_case:
+                test_case['input'] = self.test_data_cache.get(test_case['input_hash'], self.download_test_data)
+            if 'output_hash' in test_case:
+                test_case['output'] = self.test_data_cache.get(test_case['output_hash'], self.download_test_data)
+
+    def download_test_data(self, data_hash):
+        logging.info("Downloading test data %s", data_hash)
+        try:
+            r = requests.get(
+                self.conf['test_data_url'].format(data_hash),
+                auth=self.auth
+            )
+        except requests.exceptions.ConnectionError:
+            raise TestDataUnavailableException("couldn't connect to the courthouse")
+
+        if r.status_code != 200:
+            raise TestDataUnavailableException("got status code {}".format(r.status_code))
+
+        if hashlib.sha256(r.content).hexdigest() != data_hash:
+            raise TestDataUnavailableException("test data {} doesn't match its hash".format(data_hash))
+
+        return r.content
+
+    def get_writ_deadline(self):
+        """Gets the time by which all of the writ's test cases must have run"""
+        return time.time() + self.conf['writ_timeout']
+
+    def get_lease_deadline(self):
+        """Gets the time the writ's lease expires, or None if the courthouse
+        didn't send it"""
+        lease_seconds = self.writ.get_lease_seconds_left()
+        if lease_seconds is None:
+            return None
+        return time.time() + lease_seconds
+
+    def start_timer(self):
+        """Starts the program's time limit, restarting it if it was already running
+
+        Each run of the program gets the full timeout, unless less than that
+        is left before the writ's deadline, or before its lease expires.
+        """
+        if self.timer:
+            self.timer.cancel()
+
+        seconds = self.conf['timeout']
+        if self.writ_deadline is not None:
+            seconds = min(seconds, max(self.writ_deadline - time.time(), 0))
+
+        is_lease_expiring = False
+        if self.lease_deadline is not None and self.lease_deadline - time.time() < seconds:
+            seconds = max(self.lease_deadline - time.time(), 0)
+            is_lease_expiring = True
+
+        # signal.alarm only works on the main thread, so a timer kills the
+        # running program instead
+        self.timer = threading.Timer(seconds, self.on_timeout, args=(is_lease_expiring,))
+        self.timer.start()
+
+    def on_timeout(self, is_lease_expiring=False):
+        with self.program_lock:
+            self.timed_out = True
+            self.lease_expired = is_lease_expiring
+            self.kill_program()
+
+    def kill_program(self):
+        if self.container:
             try:
-                shutil.rmtree(self.writ.shared_data_dir)
-            except FileNotFoundError:
+                self.container.kill()
+            except docker.errors.APIError:
                 pass
 
-            self.writ = None
+        if self.process:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def set_program(self, container=None, process=None):
+        with self.program_lock:
+            self.container = container
+            self.process = process
+
+            # the timeout may have passed while the program was starting
+            if self.timed_out:
+                self.kill_program()
 
     def clean_output(self, s):
         # postgres can't store strings with null characters,
@@ -110,12 +385,14 @@ class Executor:
         s = s.replace("\0", "")
         return s
 
-    def create_share_files(self, share_folder, runner_str, input_str, program_str):
+    def create_share_files(self, share_folder, runner_str, input_str, program_str, compiler_str=None):
         files = {
             "runner": runner_str,
             "input": input_str,
             "program": program_str
         }
+        if compiler_str is not None:
+            files["compiler"] = compiler_str
 
         for fname, contents in files.items():
             loc = path.join(share_folder, fname)
@@ -129,7 +406,8 @@ class Executor:
         try:
             r = requests.get(
                 self.conf['writ_url'],
-                auth=HTTPBasicAuth(self.conf['username'], self.conf['password'])
+                params=self.get_poll_params(),
+                auth=self.auth
             )
         except Exception:
             logging.warn("Couldn't to courthouse at %s", self.conf['writ_url'])
@@ -147,13 +425,40 @@ class Executor:
 
         return Writ.from_dict(r.json())
 
+    def get_writs(self):
+        try:
+            r = requests.get(
+                self.conf['writs_url'],
+                # the courthouse only hands out as many writs as can run in a lease
+                params=dict(self.get_poll_params(), max=self.conf['batch_size'], writ_timeout=self.conf['writ_timeout']),
+                auth=self.auth
+            )
+        except Exception:
+            logging.warn("Couldn't to courthouse at %s", self.conf['writs_url'])
+            return []
+
+        if r.status_code != 200:
+            return []
+
+        try:
+            writ_dicts = r.json().get('writs', [])
+        except ValueError:
+            logging.warn("Received invalid json from while getting writs")
+            return []
+
+        writs = [Writ.from_dict(x) for x in writ_dicts]
+        return [x for x in writs if x is not None]
+
     def submit_writ(self, out, state):
         logging.info("Submitting writ %s, state: %s", self.writ.run_id, state)
+        submission = {"output": out, "state": state, "lease_id": self.writ.lease_id}
+        submission.update(self.get_verdict())
+
         try:
             r = requests.post(
                 self.conf['submit_url'].format(self.writ.run_id),
-                json={"output": out, "state": state},
-                auth=HTTPBasicAuth(self.conf['username'], self.conf['password'])
+                json=submission,
+                auth=self.auth
             )
 
             if r.status_code != 200:
@@ -164,6 +469,15 @@ class Executor:
 
         self.current_writ = None
 
+    def get_verdict(self):
+        """Gets the results of comparing the output in the executor, if it was"""
+        verdict = {}
+        if self.test_case_results is not None:
+            verdict["test_case_results"] = self.test_case_results
+        if self.is_output_matching is not None:
+            verdict["is_output_matching"] = self.is_output_matching
+        return verdict
+
     def return_writ_without_output(self):
         logging.info("Returning writ without output: %s", self.writ.run_id)
 
@@ -171,37 +485,119 @@ class Executor:
         try:
             requests.post(
                 url,
-                auth=HTTPBasicAuth(self.conf['username'], self.conf['password'])
+                json={"lease_id": self.writ.lease_id},
+                auth=self.auth
             )
         except requests.exceptions.ConnectionError:
             logging.warn("Failed to return writ: %s", self.writ.run_id)
 
-    def insecure_run_program(self):
-        container_shared_data_dir = self.writ.shared_data_dir
+    def substitute_script_vars(self, script, input_file, program_file, scratch_dir, build_dir):
+        script = script.replace("$input_file", input_file)
+        script = script.replace("$program_file", program_file)
+        script = script.replace("$scratch_dir", scratch_dir)
+        script = script.replace("$build_dir", build_dir)
+        return script
+
+    def compile_program(self, build_dir, run_compiler):
+        """Compiles the writ's program into build_dir, reusing a cached build of
+        identical source if there is one
+
+        Returns:
+            str: the compiler output if compiling failed, otherwise None
+        """
+        key = BuildCache.get_key(self.writ)
+        with self.build_cache.get_key_lock(key):
+            if self.build_cache.restore(key, build_dir):
+                logging.info("Using cached build for writ %s", self.writ.run_id)
+                return None
 
-        runner_str = self.writ.run_script
-        runner_str = runner_str.replace("$input_file", path.join(container_shared_data_dir, "input"))
-        runner_str = runner_str.replace("$program_file", path.join(container_shared_data_dir, "program"))
-        runner_str = runner_str.replace("$scratch_dir", container_shared_data_dir)
+            exit_code, out = run_compiler()
+            if exit_code != 0:
+                return out
 
-        os.makedirs(container_shared_data_dir)
-        self.create_share_files(
-            container_shared_data_dir,
-            runner_str,
-            self.writ.input,
-            self.writ.source_code,
-        )
+            self.build_cache.store(key, build_dir)
+            return None
 
-        runner_file = path.join(container_shared_data_dir, "runner")
-        try:
-            out = subprocess.check_output(
-                [runner_file],
-                shell=True,
-                stderr=subprocess.STDOUT
-            ).decode('utf-8')
-        except subprocess.CalledProcessError as e:
-            out = e.output.decode("utf-8")
+    def run_test_cases(self, run_once, reset=None):
+        """Runs the program against each of the writ's test cases in order,
+        stopping at the first case that fails
+
+        Writs without test cases are run once against their input. Output is
+        compared against the expected output as it streams in, and a program
+        is stopped as soon as its output doesn't match.
+
+        Params:
+            run_once (function): runs the program given its input and a
+                comparator, returning its output
+            reset (function): clears anything a case left behind before the
+                next case runs, if the cases share a container
+
+        Returns:
+            str: the output of the last case that was run, or an excerpt of
+                it if its output was compared
+        """
+        if not self.writ.test_cases:
+            if self.writ.expected_output is None:
+                return run_once(self.writ.input, None)
+
+            comparator = OutputComparator(self.writ.expected_output)
+            out = run_once(self.writ.input, comparator)
+            self.is_output_matching = comparator.is_matching
+            return comparator.get_excerpt(out)
+
+        self.test_case_results = []
+        out = ""
+        for case_num, test_case in enumerate(self.writ.test_cases):
+            if case_num > 0:
+                if reset:
+                    reset()
+                self.start_timer()
+
+            result = {
+                "case_number": test_case['case_number'],
+                "state": RunState.EXECUTED,
+                "is_passed": False,
+                "time": 0,
+            }
+            self.test_case_results.append(result)
+
+            comparator = OutputComparator(test_case['output'])
+            start = time.time()
+            try:
+                out = run_once(test_case['input'], comparator)
+            except TimedOutException:
+                result['state'] = RunState.TIMED_OUT
+                raise
+            except OutputLimitExceeded:
+                result['state'] = RunState.OUTPUT_LIMIT_EXCEEDED
+                raise
+            except NoOutputException:
+                result['state'] = RunState.NO_OUTPUT
+                raise
+            finally:
+                result['time'] = round(time.time() - start, 3)
+
+            result['is_passed'] = comparator.is_matching
+            out = comparator.get_excerpt(out)
+            if not result['is_passed']:
+                logging.info("Writ %s failed test case %s", self.writ.run_id, result['case_number'])
+                break
+
+        return out
+
+    def write_input(self, share_folder, input_str):
+        with open(path.join(share_folder, "input"), "w") as f:
+            f.write(input_str.replace("\r\n", "\n"))
 
+    def remove_container(self):
+        with self.program_lock:
+            container = self.container
+            self.container = None
+
+        if container:
+            container.remove(force=True)
+
+    def check_program_output(self, out):
         if len(out) > self.conf['char_output_limit']:
             raise OutputLimitExceeded()
 
@@ -210,68 +606,739 @@ class Executor:
 
         return out
 
-    def docker_run_program(self):
+    def insecure_run_program(self):
         container_shared_data_dir = self.writ.shared_data_dir
+        build_dir = path.join(container_shared_data_dir, "build")
+
+        def substitute(script):
+            return self.substitute_script_vars(
+                script,
+                input_file=path.join(container_shared_data_dir, "input"),
+                program_file=path.join(container_shared_data_dir, "program"),
+                scratch_dir=container_shared_data_dir,
+                build_dir=build_dir,
+            )
 
-        runner_str = self.writ.run_script
-        runner_str = runner_str.replace("$input_file", "/share/input")
-        runner_str = runner_str.replace("$program_file", "/share/program")
-        runner_str = runner_str.replace("$scratch_dir", "/scratch")
-
-        os.makedirs(container_shared_data_dir)
+        os.makedirs(build_dir)
         self.create_share_files(
             container_shared_data_dir,
-            runner_str,
+            substitute(self.writ.run_script),
             self.writ.input,
-            self.writ.source_code
+            self.writ.source_code,
+            substitute(self.writ.compile_script) if self.writ.compile_script else None,
         )
-        shared_volumes = {
-            container_shared_data_dir: {
-                "bind": "/share",
-                "mode": "ro"
-            }
-        }
-        self.container = self.client.containers.run(EXECUTOR_IMAGE_NAME,
-                                                    "/share/runner",
-                                                    detach=True,
-                                                    working_dir="/share",
-                                                    volumes=shared_volumes,
-                                                    user=CONTAINER_USER,
-                                                    network_disabled=True,
-                                                    read_only=False,
-                                                    mem_swappiness=MEM_SWAPPINESS,
-                                                    pids_limit=PID_LIMIT,
-                                                    cpu_period=CPU_PERIOD,
-                                                    mem_limit=MEM_LIMIT)
 
+        if self.writ.compile_script:
+            compiler_file = path.join(container_shared_data_dir, "compiler")
+            compile_out = self.compile_program(build_dir, lambda: self.insecure_exec(compiler_file, None))
+            if compile_out is not None:
+                return self.check_program_output(compile_out)
+
+        def run_once(input_str, comparator):
+            self.write_input(container_shared_data_dir, input_str)
+            _, out = self.insecure_exec(path.join(container_shared_data_dir, "runner"), comparator)
+            return self.check_program_output(out)
+
+        return self.run_test_cases(run_once)
+
+    def insecure_exec(self, script_file, comparator):
+        # run in a new session so a timeout can kill the script's children too
+        process = subprocess.Popen(
+            [script_file],
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        self.set_program(process=process)
+
+        try:
+            out = self.read_program_output(iter(lambda: process.stdout.read1(4096), b""), comparator)
+            # a program whose output didn't match is killed rather than waited for
+            if comparator is None or comparator.is_matching:
+                process.wait()
+        finally:
+            # the program may have been stopped early, or left children running
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
+            process.stdout.close()
+
+        self.set_program()
+        return process.returncode, out
+
+    def substitute_docker_script_vars(self, script):
+        return self.substitute_script_vars(
+            script,
+            input_file="/share/input",
+            program_file="/share/program",
+            scratch_dir="/scratch",
+            build_dir="/build",
+        )
+
+    def create_docker_share_files(self, share_dir):
+        compiler_str = None
+        if self.writ.compile_script:
+            compiler_str = self.substitute_docker_script_vars(self.writ.compile_script)
+
+        self.create_share_files(
+            share_dir,
+            self.substitute_docker_script_vars(self.writ.run_script),
+            self.writ.input,
+            self.writ.source_code,
+            compiler_str,
+        )
+
+    def docker_run_program(self):
+        container_shared_data_dir = self.writ.shared_data_dir
+        build_dir = self.writ.build_dir
+
+        os.makedirs(container_shared_data_dir)
+        os.makedirs(build_dir)
+        # the container user needs to be able to write builds out
+        os.chmod(build_dir, 0o777)
+        self.create_docker_share_files(container_shared_data_dir)
+
+        if self.writ.compile_script:
+            def run_compiler():
+                container = run_executor_container(
+                    self.client, container_shared_data_dir, "/share/compiler", build_dir, "rw")
+                self.set_program(container=container)
+                out = self.read_program_output(container.logs(stream=True))
+                exit_code = container.wait()
+                if isinstance(exit_code, dict):
+                    exit_code = exit_code.get('StatusCode')
+
+                self.remove_container()
+                return exit_code, out
+
+            compile_out = self.compile_program(build_dir, run_compiler)
+            if compile_out is not None:
+                return self.check_program_output(compile_out)
+
+        def run_once(input_str, comparator):
+            # each test case gets a fresh container
+            self.remove_container()
+            self.write_input(container_shared_data_dir, input_str)
+
+            container = run_executor_container(
+                self.client, container_shared_data_dir, "/share/runner", build_dir, "ro")
+            self.set_program(container=container)
+
+            out = self.read_program_output(container.logs(stream=True), comparator)
+            return self.check_program_output(out)
+
+        return self.run_test_cases(run_once)
+
+    def docker_pooled_run_program(self):
+        self.pooled_container = self.pool.acquire()
+        self.create_docker_share_files(self.pooled_container.share_dir)
+        self.set_program(container=self.pooled_container.container)
+
+        if self.writ.compile_script:
+            compile_out = self.compile_program(
+                self.pooled_container.build_dir,
+                lambda: self.docker_exec("/share/compiler", None),
+            )
+            if compile_out is not None:
+                return self.check_program_output(compile_out)
+
+        # /build stays writable for the compiler, so the build is kept aside
+        # and put back before each case
+        shutil.copytree(self.pooled_container.build_dir, self.writ.build_dir)
+
+        def run_once(input_str, comparator):
+            self.write_input(self.pooled_container.share_dir, input_str)
+            _, out = self.docker_exec("/share/runner", comparator)
+            return self.check_program_output(out)
+
+        def reset():
+            self.pool.reset(self.pooled_container)
+            self.pool.reset_build_dir(self.pooled_container, self.writ.build_dir)
+
+        # the cases share the container, so one case can't leave files or
+        # processes behind for the next, or change the program
+        return self.run_test_cases(run_once, reset)
+
+    def docker_exec(self, command, comparator):
+        api = self.client.api
+        exec_id = api.exec_create(self.container.id, command, user=CONTAINER_USER)['Id']
+        out = self.read_program_output(api.exec_start(exec_id, stream=True), comparator)
+        exit_code = api.exec_inspect(exec_id).get('ExitCode')
+        return exit_code, out
+
+    def read_program_output(self, output_stream, comparator=None):
+        """Reads a program's output as it streams in
+
+        If a comparator is given, the output is compared as it arrives and
+        reading stops at the first mismatch. Only the start of the output is
+        kept, as the whole output isn't sent back to the courthouse.
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
         out = []
         rolling_size = 0
-        for line in self.container.logs(stream=True):
-            chunk = line.decode("utf-8")
+        kept_size = 0
+        for line in output_stream:
+            chunk = decoder.decode(line)
             rolling_size += len(chunk)
 
             if rolling_size > self.conf['char_output_limit']:
                 raise OutputLimitExceeded()
 
+            if comparator is None:
+                out.append(chunk)
+                continue
+
+            if kept_size < OUTPUT_EXCERPT_CHARS:
+                out.append(chunk[:OUTPUT_EXCERPT_CHARS - kept_size])
+                kept_size += len(out[-1])
+
+            if not comparator.feed(chunk):
+                logging.info("Output of writ %s doesn't match, stopping early", self.writ.run_id)
+                break
+        else:
+            chunk = decoder.decode(b"", final=True)
             out.append(chunk)
+            if comparator is not None:
+                comparator.feed(chunk)
+                comparator.finish()
 
-        if rolling_size == 0:
-            raise NoOutputException()
+        if self.timed_out:
+            raise TimedOutException()
 
         return "".join(out)
 
 
+class OutputComparator:
+    """Compares a program's output to the expected output as it streams in
+
+    Output is compared the same way the courthouse compares it, ignoring
+    leading and trailing whitespace and treating \\r\\n as \\n, without
+    holding the whole output in memory.
+    """
+    def __init__(self, expected_output):
+        self.expected = expected_output.replace("\r\n", "\n").strip()
+        self.pos = 0
+        self.pending_space = ""
+        self.has_started = False
+        self.has_carriage_return = False
+        self.mismatch_pos = None
+        self.mismatch_text = ""
+
+    @property
+    def is_matching(self):
+        return self.mismatch_pos is None
+
+    def feed(self, chunk):
+        """Compares the next chunk of output
+
+        Returns:
+            bool: False once the output no longer matches
+        """
+        if self.mismatch_pos is not None:
+            return False
+
+        # a \r at the end of a chunk may be the start of a \r\n
+        if self.has_carriage_return:
+            chunk = "\r" + chunk
+        self.has_carriage_return = chunk.endswith("\r")
+        if self.has_carriage_return:
+            chunk = chunk[:-1]
+        chunk = chunk.replace("\r\n", "\n")
+
+        if not self.has_started:
+            chunk = chunk.lstrip()
+            self.has_started = bool(chunk)
+
+        # trailing whitespace is only compared once more output follows it
+        body = chunk.rstrip()
+        if not body:
+            self.pending_space += chunk
+            return True
+
+        segment = self.pending_space + body
+        self.pending_space = chunk[len(body):]
+
+        expected_segment = self.expected[self.pos:self.pos + len(segment)]
+        if segment != expected_segment:
+            mismatch = min(len(segment), len(expected_segment))
+            for i, (actual_char, expected_char) in enumerate(zip(segment, expected_segment)):
+                if actual_char != expected_char:
+                    mismatch = i
+                    break
+
+            self.mismatch_pos = self.pos + mismatch
+            self.mismatch_text = segment[mismatch:]
+            return False
+
+        self.pos += len(segment)
+        return True
+
+    def finish(self):
+        """Marks the end of the output, which fails if output is missing"""
+        if self.mismatch_pos is None and self.pos != len(self.expected):
+            self.mismatch_pos = self.pos
+
+    def get_excerpt(self, kept_output):
+        """Gets the output to send back to the courthouse
+
+        For matching output this is the start of the output, otherwise it's the
+        output up to and including the first mismatched line.
+        """
+        if self.is_matching:
+            if len(kept_output) >= OUTPUT_EXCERPT_CHARS:
+                kept_output += "\n...[truncated]..."
+            return kept_output
+
+        mismatched_line = self.mismatch_text.split("\n", 1)[0][:MISMATCHED_LINE_CHARS]
+        excerpt = self.expected[:self.mismatch_pos] + mismatched_line
+        if len(excerpt) > OUTPUT_EXCERPT_CHARS:
+            excerpt = "...[truncated]...\n" + excerpt[-OUTPUT_EXCERPT_CHARS:]
+        return excerpt
+
+
+def run_executor_container(client, shared_data_dir, command, build_dir=None, build_dir_mode="ro"):
+    shared_volumes = {
+        shared_data_dir: {
+            "bind": "/share",
+            "mode": "ro"
+        }
+    }
+    if build_dir:
+        shared_volumes[build_dir] = {
+            "bind": "/build",
+            "mode": build_dir_mode
+        }
+
+    return client.containers.run(EXECUTOR_IMAGE_NAME,
+                                 command,
+                                 detach=True,
+                                 working_dir="/share",
+                                 volumes=shared_volumes,
+                                 user=CONTAINER_USER,
+                                 network_disabled=True,
+                                 read_only=True,
+                                 tmpfs={x: CONTAINER_TMPFS_OPTIONS for x in CONTAINER_TMPFS_DIRS},
+                                 mem_swappiness=MEM_SWAPPINESS,
+                                 pids_limit=PID_LIMIT,
+                                 cpu_period=CPU_PERIOD,
+                                 mem_limit=MEM_LIMIT)
+
+
+class DiskCache:
+    """A content addressed cache of files on disk, with least recently used
+    entries removed once there are more than max_entries"""
+    def __init__(self, cache_dir, max_entries):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        # key: the number of workers reading the entry, which evict leaves
+        self.num_readers = {}
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get_key_lock(self, key):
+        """Gets a lock that stops concurrent workers filling the same entry twice"""
+        with self.lock:
+            if key not in self.key_locks:
+                if len(self.key_locks) > self.max_entries:
+                    self.key_locks = {k: v for k, v in self.key_locks.items() if v.locked()}
+                self.key_locks[key] = threading.Lock()
+            return self.key_locks[key]
+
+    @contextlib.contextmanager
+    def read_entry(self, key):
+        """Stops evict removing an entry while it's being read
+
+        Yields:
+            str: the entry's path, which may not exist
+        """
+        with self.lock:
+            self.num_readers[key] = self.num_readers.get(key, 0) + 1
+        try:
+            yield path.join(self.cache_dir, key)
+        finally:
+            with self.lock:
+                self.num_readers[key] -= 1
+                if not self.num_readers[key]:
+                    del self.num_readers[key]
+
+    def evict(self):
+        """Removes the least recently used entries once the cache is over its size,
+        apart from entries that are being read"""
+        with self.lock:
+            keys = [x for x in os.listdir(self.cache_dir) if ".tmp-" not in x]
+            num_over = len(keys) - self.max_entries
+            if num_over <= 0:
+                return
+
+            entries = [path.join(self.cache_dir, x) for x in keys if x not in self.num_readers]
+            entries.sort(key=path.getmtime)
+            for entry in entries[:num_over]:
+                if path.isdir(entry):
+                    shutil.rmtree(entry, ignore_errors=True)
+                else:
+                    os.remove(entry)
+
+
+class BuildCache(DiskCache):
+    """A content addressed cache of compiled programs
+
+    Builds are keyed by the language, its version, the compile script and
+    the source code, so identical source is only compiled once per node.
+    """
+    @staticmethod
+    def get_key(writ):
+        key_data = json.dumps([writ.language, writ.language_version, writ.compile_script, writ.source_code])
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def restore(self, key, build_dir):
+        """Copies a cached build into build_dir
+
+        Returns:
+            bool: whether or not there was a cached build
+        """
+        with self.read_entry(key) as entry_dir:
+            if self.max_entries <= 0 or not path.isdir(entry_dir):
+                with self.lock:
+                    self.num_misses += 1
+                return False
+
+            shutil.copytree(entry_dir, build_dir, dirs_exist_ok=True)
+            os.utime(entry_dir)
+
+        with self.lock:
+            self.num_hits += 1
+        return True
+
+    def store(self, key, build_dir):
+        if self.max_entries <= 0:
+            return
+
+        entry_dir = path.join(self.cache_dir, key)
+        tmp_dir = "{}.tmp-{}".format(entry_dir, uuid.uuid4())
+        shutil.copytree(build_dir, tmp_dir)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict()
+
+
+class TestDataCache(DiskCache):
+    """A cache of the test data that writs reference by the sha256 hash of its
+    contents, so unchanged test data is only downloaded once per node"""
+    def get(self, data_hash, download):
+        """Gets test data, downloading it if it isn't cached
+
+        Params:
+            data_hash (str): the hex sha256 hash of the test data
+            download (function): downloads the test data given its hash
+
+        Returns:
+            str: the test data
+        """
+        with self.get_key_lock(data_hash), self.read_entry(data_hash) as entry_file:
+            if self.max_entries > 0 and path.isfile(entry_file):
+                os.utime(entry_file)
+                with self.lock:
+                    self.num_hits += 1
+                with open(entry_file, "rb") as f:
+                    return f.read().decode("utf-8")
+
+            with self.lock:
+                self.num_misses += 1
+
+            contents = download(data_hash)
+            if self.max_entries > 0:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_file = "{}.tmp-{}".format(entry_file, uuid.uuid4())
+                with open(tmp_file, "wb") as f:
+                    f.write(contents)
+                os.rename(tmp_file, entry_file)
+                self.evict()
+
+            return contents.decode("utf-8")
+
+
+class PooledContainer:
+    def __init__(self, container, share_dir, build_dir):
+        self.container = container
+        self.share_dir = share_dir
+        self.build_dir = build_dir
+        self.uses = 0
+
+
+class ContainerPool:
+    """A pool of pre-created, resource limited executor containers
+
+    Containers are reset and reused between writs, and replaced with a
+    fresh container after recycle_after uses or if they can't be reused.
+    """
+    def __init__(self, client, size, recycle_after):
+        self.client = client
+        self.size = size
+        self.recycle_after = recycle_after
+        self.idle = queue.Queue()
+        self.metrics = StartupMetrics()
+        self.is_closed = False
+
+        logging.info("Starting %s pooled containers", size)
+        for _ in range(size):
+            self.idle.put(self.create())
+
+    def create(self):
+        share_dir = path.join(SHARED_DATA_DIR, "pool-{}".format(uuid.uuid4()))
+        build_dir = share_dir + "-build"
+        os.makedirs(share_dir)
+        os.makedirs(build_dir)
+        os.chmod(build_dir, 0o777)
+
+        start = time.time()
+        container = run_executor_container(self.client, share_dir, POOL_KEEPALIVE_COMMAND, build_dir, "rw")
+        self.metrics.record_cold_start(time.time() - start)
+
+        return PooledContainer(container, share_dir, build_dir)
+
+    def acquire(self):
+        start = time.time()
+        try:
+            pooled = self.idle.get(timeout=POOL_ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            raise PoolExhaustedException()
+        self.metrics.record_warm_start(time.time() - start)
+
+        return pooled
+
+    def release(self, pooled, is_reusable):
+        pooled.uses += 1
+        self.clear_dir(pooled.share_dir)
+        self.clear_dir(pooled.build_dir)
+        # files the writ made that can't be removed would end up in the
+        # next writ's build
+        is_reusable = is_reusable and not os.listdir(pooled.build_dir)
+
+        if is_reusable and pooled.uses < self.recycle_after and not self.is_closed:
+            try:
+                self.reset(pooled)
+                self.idle.put(pooled)
+                return
+            except docker.errors.APIError:
+                logging.exception("Failed to reset pooled container, replacing it")
+
+        self.discard(pooled)
+        if not self.is_closed:
+            threading.Thread(target=self.replenish, name="pool-replenish").start()
+
+    def reset(self, pooled):
+        """Kills anything left running in the container and clears the
+        places it can write to, the share and build dirs are left alone"""
+        pooled.container.exec_run(POOL_RESET_COMMAND, user=CONTAINER_USER)
+
+    def reset_build_dir(self, pooled, build_snapshot_dir):
+        """Replaces the container's build dir with a copy of the writ's build,
+        undoing anything the last case changed there"""
+        self.clear_dir(pooled.build_dir)
+        if os.listdir(pooled.build_dir):
+            raise BuildDirResetException()
+        shutil.copytree(build_snapshot_dir, pooled.build_dir, dirs_exist_ok=True)
+
+    def replenish(self):
+        try:
+            self.idle.put(self.create())
+        except (docker.errors.APIError, OSError):
+            logging.exception("Failed to create pooled container")
+
+    def discard(self, pooled):
+        try:
+            pooled.container.remove(force=True)
+        except docker.errors.APIError:
+            logging.exception("Failed to remove pooled container")
+        shutil.rmtree(pooled.share_dir, ignore_errors=True)
+        shutil.rmtree(pooled.build_dir, ignore_errors=True)
+
+    def clear_dir(self, dir_path):
+        for fname in os.listdir(dir_path):
+            file_path = path.join(dir_path, fname)
+            if path.isdir(file_path) and not path.islink(file_path):
+                shutil.rmtree(file_path, ignore_errors=True)
+            else:
+                os.remove(file_path)
+
+    def close(self):
+        self.is_closed = True
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        self.metrics.log_summary()
+
+
+class StartupMetrics:
+    """Tracks how long it takes to get a container ready for a writ"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.num_cold_starts = 0
+        self.cold_start_seconds = 0.0
+        self.num_warm_starts = 0
+        self.warm_start_seconds = 0.0
+
+    def record_cold_start(self, seconds):
+        with self.lock:
+            self.num_cold_starts += 1
+            self.cold_start_seconds += seconds
+
+    def record_warm_start(self, seconds):
+        with self.lock:
+            self.num_warm_starts += 1
+            self.warm_start_seconds += seconds
+            should_log = self.num_warm_starts % POOL_METRICS_LOG_INTERVAL == 0
+
+        if should_log:
+            self.log_summary()
+
+    def get_saved_seconds(self):
+        """Estimates the startup time saved compared to creating a container per writ"""
+        with self.lock:
+            if self.num_cold_starts == 0:
+                return 0.0
+            avg_cold_start = self.cold_start_seconds / self.num_cold_starts
+            return avg_cold_start * self.num_warm_starts - self.warm_start_seconds
+
+    def log_summary(self):
+        with self.lock:
+            avg_cold_start = self.cold_start_seconds / max(self.num_cold_starts, 1)
+            avg_warm_start = self.warm_start_seconds / max(self.num_warm_starts, 1)
+            num_cold_starts = self.num_cold_starts
+            num_warm_starts = self.num_warm_starts
+
+        logging.info(
+            "Container startup: %s pooled writs (avg wait %.3fs), %s containers created (avg %.3fs), ~%.1fs saved",
+            num_warm_starts, avg_warm_start, num_cold_starts, avg_cold_start, self.get_saved_seconds())
+
+
+class CourthouseAuth(requests.auth.AuthBase):
+    """Authenticates requests to the courthouse with a short-lived token
+
+    The username and password are exchanged for a token, so the courthouse
+    only checks the password once per token instead of on every request. The
+    token is renewed before it expires, or when the courthouse rejects it.
+    If the courthouse doesn't issue tokens, basic auth is used instead.
+    """
+    def __init__(self, conf):
+        self.conf = conf
+        self.basic_auth = HTTPBasicAuth(conf['username'], conf['password'])
+        self.token = None
+        self.renew_time = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, r):
+        token = self.get_token() if self.conf.get('token_url') else None
+        if token is None:
+            return self.basic_auth(r)
+
+        r.headers['Authorization'] = "Bearer {}".format(token)
+        r.register_hook('response', self.handle_401)
+        return r
+
+    def get_token(self, rejected_token=None):
+        """Gets the current token, requesting a new one if it's due for renewal
+        or if it's the token the courthouse rejected
+
+        Returns:
+            str: the token, or None if basic auth should be used
+        """
+        with self.lock:
+            if time.time() >= self.renew_time or (rejected_token and rejected_token == self.token):
+                self.token, self.renew_time = self.request_token()
+            return self.token
+
+    def request_token(self):
+        """Exchanges the username and password for a token
+
+        Returns:
+            tuple: the token, or None if one couldn't be issued, and the time to
+                renew it at
+        """
+        try:
+            r = requests.post(self.conf.get('token_url'), auth=self.basic_auth)
+        except requests.exceptions.RequestException:
+            return None, time.time() + TOKEN_RETRY_SECONDS
+
+        if r.status_code != 200:
+            logging.warn("Couldn't get an auth token, using basic auth, code: %s", r.status_code)
+            return None, time.time() + TOKEN_RETRY_SECONDS
+
+        try:
+            token_data = r.json()
+            return token_data['token'], time.time() + token_data['expires_in'] - TOKEN_RENEW_SECONDS
+        except (ValueError, KeyError):
+            logging.warn("Received an invalid auth token, using basic auth")
+            return None, time.time() + TOKEN_RETRY_SECONDS
+
+    def handle_401(self, r, **kwargs):
+        """Retries a request that was rejected with a renewed token"""
+        if r.status_code != 401:
+            return r
+
+        rejected_token = r.request.headers['Authorization'].split(None, 1)[-1]
+        token = self.get_token(rejected_token)
+        if token is None:
+            return r
+
+        # the response has to be read before its connection can be reused
+        r.content
+        r.close()
+
+        prep = r.request.copy()
+        prep.headers['Authorization'] = "Bearer {}".format(token)
+        retried = r.connection.send(prep, **kwargs)
+        retried.history.append(r)
+        retried.request = prep
+        return retried
+
+
 class Writ:
-    def __init__(self, source_code, run_script, input, run_id, return_url, language):
+    def __init__(self, source_code, run_script, input, run_id, return_url, language, lease_id=None, lease_expiration=None,
+                 compile_script=None, language_version=None, test_cases=None, expected_output=None,
+                 input_hash=None, expected_output_hash=None):
         self.source_code = source_code
         self.run_script = run_script
+        self.compile_script = compile_script
+        self.language_version = language_version
+        self.test_cases = test_cases
+        self.expected_output = expected_output
+        self.expected_output_hash = expected_output_hash
         self.input = input
+        self.input_hash = input_hash
         self.run_id = run_id
         self.return_url = return_url
         self.language = language
+        # sent back with the writ's output, the courthouse only accepts it from
+        # the holder of the run's current lease
+        self.lease_id = lease_id
+        self.lease_expiration = lease_expiration
 
         self.container_ident = "{}-{}-{}".format(self.run_id, self.language, str(uuid.uuid4()))
         self.shared_data_dir = path.join(SHARED_DATA_DIR, self.container_ident)
+        self.build_dir = self.shared_data_dir + "-build"
+
+    def get_lease_seconds_left(self):
+        """Gets the number of seconds until the lease expires, or None if the
+        courthouse didn't send the lease's expiration"""
+        if self.lease_expiration is None:
+            return None
+        return max((self.lease_expiration - datetime.datetime.utcnow()).total_seconds(), 0)
+
+    def is_lease_expired(self):
+        if self.lease_expiration is None:
+            return False
+        return datetime.datetime.utcnow() > self.lease_expiration
 
     @staticmethod
     def from_dict(writ_json):
@@ -281,14 +1348,19 @@ class Writ:
         source_code = writ_json.get('source_code')
         run_script = writ_json.get('run_script')
         input = writ_json.get('input')
+        input_hash = writ_json.get('input_hash')
         run_id = writ_json.get('run_id')
         return_url = writ_json.get('return_url')
         language = writ_json.get('language')
 
+        lease_expiration = None
+        if writ_json.get('lease_expiration'):
+            lease_expiration = datetime.datetime.strptime(writ_json['lease_expiration'], "%Y-%m-%dT%H:%M:%SZ")
+
         if (
                 source_code is None or
                 run_script is None or
-                input is None or
+                (input is None and input_hash is None) or
                 run_id is None or
                 return_url is None or
                 language is None):
@@ -302,6 +1374,14 @@ class Writ:
             run_id=run_id,
             return_url=return_url,
             language=language,
+            lease_id=writ_json.get('lease_id'),
+            lease_expiration=lease_expiration,
+            compile_script=writ_json.get('compile_script'),
+            language_version=writ_json.get('language_version'),
+            test_cases=writ_json.get('test_cases'),
+            expected_output=writ_json.get('expected_output'),
+            input_hash=input_hash,
+            expected_output_hash=writ_json.get('expected_output_hash'),
         )
 
 
@@ -335,7 +1415,13 @@ def get_conf():
         '--timeout',
         default=5,
         type=int,
-        help='the maximum time a writ can run',
+        help='the maximum time each run of a program can take',
+    )
+    parser.add_argument(
+        '--writ-timeout',
+        default=60,
+        type=int,
+        help='the maximum total time of all the runs of a program, batches of writs only have as many writs as can be given this long within a lease',
     )
     parser.add_argument(
         '-c',
@@ -344,16 +1430,81 @@ def get_conf():
         type=int,
         help='the maximum number of chars a run can output',
     )
+    parser.add_argument(
+        '-b',
+        '--batch-size',
+        default=1,
+        type=int,
+        help='the number of writs to claim per request, each is submitted once it has run',
+    )
+    parser.add_argument(
+        '-l',
+        '--long-poll',
+        default=0,
+        type=int,
+        help='the number of seconds the courthouse may hold a request open while waiting for writs',
+    )
+    parser.add_argument(
+        '--languages',
+        default=None,
+        help='a comma separated list of the languages to claim writs for, by default writs in any language are claimed',
+    )
+    parser.add_argument(
+        '-n',
+        '--concurrency',
+        default=1,
+        type=int,
+        help='the number of writs to execute in parallel, each in its own container',
+    )
+    parser.add_argument(
+        '--build-cache-size',
+        default=500,
+        type=int,
+        help='the number of compiled programs to cache, 0 disables the build cache',
+    )
+    parser.add_argument(
+        '--test-data-cache-size',
+        default=1000,
+        type=int,
+        help='the number of test data files to cache, 0 disables the test data cache',
+    )
+    parser.add_argument(
+        '--pool-size',
+        default=0,
+        type=int,
+        help='the number of warm containers to keep ready for writs, 0 creates a container per writ',
+    )
+    parser.add_argument(
+        '--recycle-after',
+        default=20,
+        type=int,
+        help='the number of writs a pooled container runs before it is replaced',
+    )
 
     args = parser.parse_args()
 
     conf = vars(args)  # turn args into dict
     conf['writ_url'] = "{}/api/get-writ".format(conf['url'])
+    conf['writs_url'] = "{}/api/get-writs".format(conf['url'])
     conf['submit_url'] = "{}/api/submit-writ/{{}}".format(conf['url'])
     conf['return_url'] = "{}/api/return-without-run".format(conf['url'])
+    conf['test_data_url'] = "{}/api/test-data/{{}}".format(conf['url'])
+    conf['token_url'] = "{}/api/executioner-token".format(conf['url'])
     return conf
 
 
+class PoolExhaustedException(Exception):
+    pass
+
+
+class BuildDirResetException(Exception):
+    pass
+
+
+class TestDataUnavailableException(Exception):
+    pass
+
+
 class OutputLimitExceeded(Exception):
     pass
 
@@ -366,10 +1517,6 @@ class TimedOutException(Exception):
     pass
 
 
-def raise_timeout(signum, frame):
-    raise TimedOutException()
-
-
 class RunState:
     CONTEST_HAS_NOT_BEGUN = "ContestHasNotBegun"
     CONTEST_ENDED = "ContestEnded"
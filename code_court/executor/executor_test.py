@@ -1,10 +1,19 @@
+import datetime
+import hashlib
 import json
+import os
 import re
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
 
+import docker
 import responses
 
-from executor import Executor, get_conf
+from executor import (CONTAINER_TMPFS_DIRS, EXECUTOR_IMAGE_NAME, BuildCache, ContainerPool, Executor,
+                      OutputComparator, TestDataCache, get_conf)
 
 
 def get_test_conf():
@@ -12,6 +21,7 @@ def get_test_conf():
     conf['insecure'] = True
     conf['timeout'] = 1
     conf['char_output_limit'] = 1000
+    conf['token_url'] = None
     return conf
 
 
@@ -23,15 +33,21 @@ def get_test_writ():
         "run_script": "cat $input_file | python3 $program_file",
         "input": "",
         "run_id": 1,
+        "lease_id": 1,
         "return_url": "http://localhost:9191/api/submit-writ"
     }
 
 
 def setup_get_writ_resp(writ):
-    responses.add(responses.GET, re.compile(r"http://.*?/api/get-writ"),
+    responses.add(responses.GET, re.compile(r"http://.*?/api/get-writ(\?.*)?$"),
                   json=writ, status=200)
 
 
+def setup_get_writs_resp(writs):
+    responses.add(responses.GET, re.compile(r"http://.*?/api/get-writs.*?"),
+                  json={"status": "found", "writs": writs}, status=200)
+
+
 def setup_submit_writ_resp(callback):
     responses.add_callback(
         responses.POST,
@@ -40,36 +56,290 @@ def setup_submit_writ_resp(callback):
     )
 
 
+def setup_test_data_resp(contents):
+    data_hash = hashlib.sha256(contents.encode("utf-8")).hexdigest()
+    responses.add(responses.GET, re.compile(r"http://.*?/api/test-data/{}$".format(data_hash)),
+                  body=contents, status=200)
+    return data_hash
+
+
 def setup_return_writ_resp():
     responses.add(responses.POST, re.compile(r"http://.*?/api/return-without-run/.*?"),
                   json="Good", status=200)
 
 
+class FakeContainer:
+    def __init__(self):
+        self.commands = []
+        self.is_removed = False
+
+    def exec_run(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        return b""
+
+    def kill(self):
+        pass
+
+    def remove(self, force=False):
+        self.is_removed = True
+
+
+class FakeContainers:
+    def __init__(self):
+        self.created = []
+
+    def run(self, image, command, **kwargs):
+        container = FakeContainer()
+        container.run_kwargs = kwargs
+        self.created.append(container)
+        return container
+
+
+class FakeDockerClient:
+    def __init__(self):
+        self.containers = FakeContainers()
+
+
+def is_docker_available():
+    try:
+        docker.from_env().images.get(EXECUTOR_IMAGE_NAME)
+        return True
+    except Exception:
+        return False
+
+
+class ContainerPoolTest(unittest.TestCase):
+    def test_reuse_and_recycle(self):
+        client = FakeDockerClient()
+        pool = ContainerPool(client, size=1, recycle_after=2)
+        self.assertEqual(len(client.containers.created), 1)
+
+        # the container is reset and reused
+        first = pool.acquire()
+        pool.release(first, is_reusable=True)
+        self.assertEqual(len(first.container.commands), 1)
+        self.assertIs(pool.acquire(), first)
+
+        # after recycle_after uses, it is replaced
+        pool.release(first, is_reusable=True)
+        second = pool.acquire()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.container.is_removed)
+
+        # containers that can't be reused are replaced straight away
+        pool.release(second, is_reusable=False)
+        third = pool.acquire()
+        self.assertIsNot(third, second)
+        self.assertTrue(second.container.is_removed)
+
+        self.assertEqual(pool.metrics.num_warm_starts, 4)
+        self.assertEqual(pool.metrics.num_cold_starts, 3)
+
+        pool.release(third, is_reusable=True)
+        pool.close()
+        self.assertTrue(third.container.is_removed)
+
+    def test_containers_only_write_to_cleared_dirs(self):
+        client = FakeDockerClient()
+        pool = ContainerPool(client, size=1, recycle_after=2)
+
+        pooled = pool.acquire()
+        run_kwargs = pooled.container.run_kwargs
+        self.assertTrue(run_kwargs['read_only'])
+        self.assertEqual(sorted(run_kwargs['tmpfs']), sorted(CONTAINER_TMPFS_DIRS))
+
+        pool.release(pooled, is_reusable=True)
+        reset_command = pooled.container.commands[0][-1]
+        for dir_path in CONTAINER_TMPFS_DIRS:
+            self.assertIn(dir_path + "/*", reset_command)
+        pool.close()
+
+    def test_reset_build_dir(self):
+        client = FakeDockerClient()
+        pool = ContainerPool(client, size=1, recycle_after=2)
+        pooled = pool.acquire()
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            with open(os.path.join(snapshot_dir, "program"), "w") as f:
+                f.write("compiled")
+
+            # a case replaces the program and leaves a file behind
+            with open(os.path.join(pooled.build_dir, "program"), "w") as f:
+                f.write("changed")
+            os.makedirs(os.path.join(pooled.build_dir, "stash"))
+
+            pool.reset_build_dir(pooled, snapshot_dir)
+
+        self.assertEqual(os.listdir(pooled.build_dir), ["program"])
+        with open(os.path.join(pooled.build_dir, "program")) as f:
+            self.assertEqual(f.read(), "compiled")
+        pool.release(pooled, is_reusable=True)
+        pool.close()
+
+    @unittest.skipUnless(is_docker_available(), "needs docker and the executor image")
+    def test_pooled_writes_dont_leak(self):
+        pool = ContainerPool(docker.from_env(), size=1, recycle_after=10)
+        try:
+            first = pool.acquire()
+            first.container.exec_run(
+                ["sh", "-c", "for d in / /share /scratch /tmp /var/tmp ~; do echo leaked > $d/leak; done"],
+                user="user")
+            pool.release(first, is_reusable=True)
+
+            second = pool.acquire()
+            self.assertIs(second, first)
+            _, out = second.container.exec_run(
+                ["sh", "-c", "cat /leak /share/leak /scratch/leak /tmp/leak /var/tmp/leak ~/leak"],
+                user="user")
+            self.assertNotIn(b"leaked", out)
+            pool.release(second, is_reusable=True)
+        finally:
+            pool.close()
+
+
+class BuildCacheTest(unittest.TestCase):
+    def test_evict_leaves_entries_being_read(self):
+        with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as build_dir:
+            build_cache = BuildCache(cache_dir, 1)
+            with open(os.path.join(build_dir, "program"), "w") as f:
+                f.write("built")
+
+            build_cache.store("old", build_dir)
+            with build_cache.read_entry("old"):
+                # the least recently used entry is being restored, so the
+                # newer one is evicted instead
+                build_cache.store("new", build_dir)
+                self.assertEqual(os.listdir(cache_dir), ["old"])
+
+            build_cache.store("newest", build_dir)
+            self.assertEqual(os.listdir(cache_dir), ["newest"])
+
+
+def is_chunked_output_matching(chunks, expected_output):
+    comparator = OutputComparator(expected_output)
+    for chunk in chunks:
+        if not comparator.feed(chunk):
+            return False
+    comparator.finish()
+    return comparator.is_matching
+
+
+class OutputComparatorTest(unittest.TestCase):
+    def test_matches_like_courthouse(self):
+        def clean(s):
+            return s.replace("\r\n", "\n").strip()
+
+        outputs = [
+            "1\n2\nFizz\n",
+            "\n  1\r\n2\r\nFizz\r\n\r\n",
+            "1\n2\nFizz",
+            "1\n2 \nFizz",
+            "1\n2\nFizz\nBuzz",
+            "1\n2\nFiz",
+            "1\n2\rFizz",
+            "",
+        ]
+        for output in outputs:
+            for expected in ("1\n2\nFizz\n", "1\r\n2\r\nFizz"):
+                is_matching = clean(output) == clean(expected)
+                # try every way of splitting the output into two chunks
+                for i in range(len(output) + 1):
+                    chunks = [output[:i], output[i:]]
+                    self.assertEqual(is_chunked_output_matching(chunks, expected), is_matching, chunks)
+
+                self.assertEqual(is_chunked_output_matching(list(output), expected), is_matching)
+
+    def test_excerpt(self):
+        comparator = OutputComparator("1\n2\nFizz\n4\nBuzz\n")
+        self.assertTrue(comparator.feed("1\n2\n"))
+        self.assertFalse(comparator.feed("3\n4\nBuzz\n"))
+        self.assertFalse(comparator.feed("more output"))
+        self.assertEqual(comparator.get_excerpt("1\n2\n3\n4\nBuzz\n"), "1\n2\n3")
+
+        comparator = OutputComparator("1\n2\nFizz")
+        comparator.feed("1\n2\n")
+        comparator.finish()
+        self.assertFalse(comparator.is_matching)
+        self.assertEqual(comparator.get_excerpt("1\n2\n"), "1\n2")
+
+
 class ExecutorTest(unittest.TestCase):
     @responses.activate
     def test_normal_run(self):
+        submitted = []
+
         def submit_callback(request):
-            resp = json.loads(request.body.decode("utf-8"))
-            self.assertEqual(resp['output'], "hello\n")
-            self.assertEqual(resp['state'], "Executed")
+            submitted.append(json.loads(request.body.decode("utf-8")))
             return (200, {}, "Good")
 
         setup_get_writ_resp(get_test_writ())
         setup_submit_writ_resp(submit_callback)
         Executor(get_test_conf())._run()
 
+        self.assertEqual(len(submitted), 1)
+        self.assertEqual(submitted[0]['output'], "hello\n")
+        self.assertEqual(submitted[0]['state'], "Executed")
+
+    @responses.activate
+    def test_compare_output_while_streaming(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        test_writ['expected_output'] = "1\n2\n3\n"
+        # the program would run into the time limit if it wasn't stopped at
+        # the first wrong line
+        test_writ['source_code'] = 'import time\nprint(1)\nprint(5, flush=True)\ntime.sleep(1000)'
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+
+        start = time.time()
+        Executor(get_test_conf())._run()
+        self.assertLess(time.time() - start, 1)
+
+        responses.reset()
+        test_writ['source_code'] = 'print("1\\n2\\n3")'
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+        Executor(get_test_conf())._run()
+
+        self.assertEqual(submitted[0]['output'], "1\n5")
+        self.assertEqual(submitted[0]['state'], "Executed")
+        self.assertFalse(submitted[0]['is_output_matching'])
+        self.assertEqual(submitted[1]['output'], "1\n2\n3\n")
+        self.assertTrue(submitted[1]['is_output_matching'])
+
     @responses.activate
     def test_return_writ(self):
         setup_get_writ_resp(get_test_writ())
         setup_return_writ_resp()
         Executor(get_test_conf())._run()
 
+    @responses.activate
+    def test_uncaught_exception_returns_writ(self):
+        class BrokenExecutor(Executor):
+            def insecure_run_program(self):
+                raise RuntimeError("broken")
+
+        setup_get_writ_resp(get_test_writ())
+        setup_return_writ_resp()
+
+        with unittest.mock.patch("executor.WAIT_SECONDS", 0):
+            # the worker keeps going rather than exiting
+            BrokenExecutor(get_test_conf())._run()
+
+        returns = [x for x in responses.calls if "/api/return-without-run/" in x.request.url]
+        self.assertEqual(len(returns), 1)
+
     @responses.activate
     def test_run_timelimit(self):
+        submitted = []
+
         def submit_callback(request):
-            resp = json.loads(request.body.decode("utf-8"))
-            self.assertEqual(resp['output'], "Error: Timed out")
-            self.assertEqual(resp['state'], "TimedOut")
+            submitted.append(json.loads(request.body.decode("utf-8")))
             return (200, {}, "Good")
 
         test_writ = get_test_writ()
@@ -78,12 +348,40 @@ class ExecutorTest(unittest.TestCase):
         setup_submit_writ_resp(submit_callback)
         Executor(get_test_conf())._run()
 
+        self.assertEqual(len(submitted), 1)
+        self.assertEqual(submitted[0]['output'], "Error: Timed out")
+        self.assertEqual(submitted[0]['state'], "TimedOut")
+
+    @responses.activate
+    def test_run_timelimit_off_main_thread(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        test_writ['source_code'] = 'import time\ntime.sleep(1000)'
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+
+        workers = [threading.Thread(target=Executor(get_test_conf())._run) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(10)
+
+        self.assertEqual(len(submitted), 2)
+        for resp in submitted:
+            self.assertEqual(resp['output'], "Error: Timed out")
+            self.assertEqual(resp['state'], "TimedOut")
+
     @responses.activate
     def test_run_outputlimit(self):
+        submitted = []
+
         def submit_callback(request):
-            resp = json.loads(request.body.decode("utf-8"))
-            self.assertEqual(resp['output'], "Error: Output limit exceeded")
-            self.assertEqual(resp['state'], "OutputLimitExceeded")
+            submitted.append(json.loads(request.body.decode("utf-8")))
             return (200, {}, "Good")
 
         test_writ = get_test_writ()
@@ -92,12 +390,16 @@ class ExecutorTest(unittest.TestCase):
         setup_submit_writ_resp(submit_callback)
         Executor(get_test_conf())._run()
 
+        self.assertEqual(len(submitted), 1)
+        self.assertEqual(submitted[0]['output'], "Error: Output limit exceeded")
+        self.assertEqual(submitted[0]['state'], "OutputLimitExceeded")
+
     @responses.activate
     def test_run_with_compile_error(self):
+        submitted = []
+
         def submit_callback(request):
-            resp = json.loads(request.body.decode("utf-8"))
-            self.assertIn("SyntaxError: unexpected EOF while parsing", resp['output'])
-            self.assertEqual(resp['state'], "Executed")
+            submitted.append(json.loads(request.body.decode("utf-8")))
             return (200, {}, "Good")
 
         test_writ = get_test_writ()
@@ -106,6 +408,371 @@ class ExecutorTest(unittest.TestCase):
         setup_submit_writ_resp(submit_callback)
         Executor(get_test_conf())._run()
 
+        self.assertEqual(len(submitted), 1)
+        self.assertIn("SyntaxError: unexpected EOF while parsing", submitted[0]['output'])
+        self.assertEqual(submitted[0]['state'], "Executed")
+
+    @responses.activate
+    def test_compiled_run_uses_build_cache(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        test_writ['compile_script'] = 'cp $program_file $build_dir/program.py && echo compiled'
+        test_writ['run_script'] = 'cat $input_file | python3 $build_dir/program.py'
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            build_cache = BuildCache(cache_dir, 10)
+            for _ in range(2):
+                Executor(get_test_conf(), build_cache=build_cache)._run()
+
+            self.assertEqual(build_cache.num_misses, 1)
+            self.assertEqual(build_cache.num_hits, 1)
+
+        self.assertEqual(len(submitted), 2)
+        for resp in submitted:
+            self.assertEqual(resp['output'], "hello\n")
+            self.assertEqual(resp['state'], "Executed")
+
+    @responses.activate
+    def test_test_cases_stop_at_first_failure(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        test_writ['source_code'] = 'n = int(input())\nprint(n * 2 if n < 3 else n)'
+        test_writ['test_cases'] = [
+            {"case_number": 1, "input": "1", "output": "2"},
+            {"case_number": 2, "input": "2", "output": "4"},
+            {"case_number": 3, "input": "3", "output": "6"},
+            {"case_number": 4, "input": "4", "output": "8"},
+        ]
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+        Executor(get_test_conf())._run()
+
+        self.assertEqual(len(submitted), 1)
+        resp = submitted[0]
+        self.assertEqual(resp['output'], "3")
+        self.assertEqual(resp['state'], "Executed")
+
+        results = resp['test_case_results']
+        self.assertEqual([x['case_number'] for x in results], [1, 2, 3])
+        self.assertEqual([x['is_passed'] for x in results], [True, True, False])
+        for result in results:
+            self.assertEqual(result['state'], "Executed")
+            self.assertGreaterEqual(result['time'], 0)
+
+    @responses.activate
+    def test_test_case_timelimit(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        test_writ['source_code'] = 'import time\nn = int(input())\ntime.sleep(n)\nprint(n)'
+        test_writ['test_cases'] = [
+            {"case_number": 1, "input": "0", "output": "0"},
+            {"case_number": 2, "input": "1000", "output": "1000"},
+        ]
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+        Executor(get_test_conf())._run()
+
+        resp = submitted[0]
+        self.assertEqual(resp['state'], "TimedOut")
+        self.assertEqual([x['state'] for x in resp['test_case_results']], ["Executed", "TimedOut"])
+
+    @unittest.skipUnless(is_docker_available(), "needs docker and the executor image")
+    @responses.activate
+    def test_pooled_test_cases_are_isolated(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        test_writ['run_script'] = 'cat $input_file | python3 $program_file'
+        test_writ['source_code'] = ('import os\nprint(os.path.exists("/scratch/seen"))\n'
+                                    'open("/scratch/seen", "w").close()')
+        test_writ['test_cases'] = [
+            {"case_number": x, "input": "", "output": "False"} for x in range(1, 3)
+        ]
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+
+        conf = get_test_conf()
+        conf['insecure'] = False
+        pool = ContainerPool(docker.from_env(), size=1, recycle_after=10)
+        try:
+            Executor(conf, pool=pool)._run()
+        finally:
+            pool.close()
+
+        self.assertEqual([x['is_passed'] for x in submitted[0]['test_case_results']], [True, True])
+
+    @unittest.skipUnless(is_docker_available(), "needs docker and the executor image")
+    @responses.activate
+    def test_pooled_test_cases_share_clean_build(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        test_writ['run_script'] = 'cat $input_file | python3 $program_file'
+        test_writ['source_code'] = ('import os\nprint(os.path.exists("/build/seen"))\n'
+                                    'open("/build/seen", "w").close()')
+        test_writ['test_cases'] = [
+            {"case_number": x, "input": "", "output": "False"} for x in range(1, 3)
+        ]
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+
+        conf = get_test_conf()
+        conf['insecure'] = False
+        pool = ContainerPool(docker.from_env(), size=1, recycle_after=10)
+        try:
+            Executor(conf, pool=pool)._run()
+        finally:
+            pool.close()
+
+        self.assertEqual([x['is_passed'] for x in submitted[0]['test_case_results']], [True, True])
+
+    @responses.activate
+    def test_writ_timelimit(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        test_writ['source_code'] = 'import time\nn = input()\ntime.sleep(float(n))\nprint(n)'
+        # each case is within the time limit, but together they aren't
+        test_writ['test_cases'] = [
+            {"case_number": x, "input": "0.6", "output": "0.6"} for x in range(1, 4)
+        ]
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+
+        conf = get_test_conf()
+        conf['writ_timeout'] = 1
+        start = time.time()
+        Executor(conf)._run()
+        self.assertLess(time.time() - start, 1.5)
+
+        resp = submitted[0]
+        self.assertEqual(resp['state'], "TimedOut")
+        self.assertEqual([x['state'] for x in resp['test_case_results']], ["Executed", "TimedOut"])
+
+    @responses.activate
+    def test_lease_timelimit(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        test_writ['source_code'] = 'import time\ntime.sleep(10)'
+        lease_expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=2)
+        test_writ['lease_expiration'] = lease_expiration.strftime("%Y-%m-%dT%H:%M:%SZ")
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+        setup_return_writ_resp()
+
+        conf = get_test_conf()
+        conf['timeout'] = 5
+        start = time.time()
+        Executor(conf)._run()
+        self.assertLess(time.time() - start, 3)
+
+        # the lease running out isn't a verdict on the program
+        self.assertEqual(submitted, [])
+        returns = [x for x in responses.calls if "/api/return-without-run/" in x.request.url]
+        self.assertEqual(len(returns), 1)
+
+    @responses.activate
+    def test_test_data_cache(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append(json.loads(request.body.decode("utf-8")))
+            return (200, {}, "Good")
+
+        test_writ = get_test_writ()
+        del test_writ['input']
+        test_writ['source_code'] = 'print(input())'
+        test_writ['input_hash'] = setup_test_data_resp("cached input\r\n")
+        test_writ['expected_output_hash'] = setup_test_data_resp("cached input\n")
+        setup_get_writ_resp(test_writ)
+        setup_submit_writ_resp(submit_callback)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            test_data_cache = TestDataCache(cache_dir, 10)
+            for _ in range(2):
+                Executor(get_test_conf(), test_data_cache=test_data_cache)._run()
+
+            self.assertEqual(test_data_cache.num_misses, 2)
+            self.assertEqual(test_data_cache.num_hits, 2)
+
+        downloads = [x for x in responses.calls if "/api/test-data/" in x.request.url]
+        self.assertEqual(len(downloads), 2)
+
+        for resp in submitted:
+            self.assertEqual(resp['output'], "cached input\n")
+            self.assertTrue(resp['is_output_matching'])
+
+    @responses.activate
+    def test_test_data_hash_mismatch(self):
+        test_writ = get_test_writ()
+        test_writ['input_hash'] = hashlib.sha256(b"other input").hexdigest()
+        responses.add(responses.GET, re.compile(r"http://.*?/api/test-data/.*"),
+                      body="tampered input", status=200)
+        setup_get_writ_resp(test_writ)
+        setup_return_writ_resp()
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            Executor(get_test_conf(), test_data_cache=TestDataCache(cache_dir, 10))._run()
+
+        returns = [x for x in responses.calls if "/api/return-without-run/" in x.request.url]
+        self.assertEqual(len(returns), 1)
+
+    @responses.activate
+    def test_batch_run(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append((request.url, json.loads(request.body.decode("utf-8"))))
+            return (200, {}, "Good")
+
+        writs = []
+        for run_id in range(1, 4):
+            test_writ = get_test_writ()
+            test_writ['run_id'] = run_id
+            test_writ['source_code'] = 'print({})'.format(run_id)
+            writs.append(test_writ)
+
+        conf = get_test_conf()
+        conf['batch_size'] = 3
+        setup_get_writs_resp(writs)
+        setup_submit_writ_resp(submit_callback)
+        Executor(conf)._run()
+
+        # each writ is submitted as soon as it has run
+        self.assertEqual(len(submitted), 3)
+        for run_id, (url, writ) in enumerate(submitted, 1):
+            self.assertTrue(url.endswith("/api/submit-writ/{}".format(run_id)))
+            self.assertEqual(writ['output'], "{}\n".format(run_id))
+            self.assertEqual(writ['state'], "Executed")
+
+    @responses.activate
+    def test_batch_run_returns_expired_writs(self):
+        submitted = []
+
+        def submit_callback(request):
+            submitted.append((request.url, json.loads(request.body.decode("utf-8"))))
+            return (200, {}, "Good")
+
+        expired_writ = get_test_writ()
+        expired_writ['lease_expiration'] = "2017-01-01T00:00:00Z"
+        expired_writ['lease_id'] = 3
+        writ = get_test_writ()
+        writ['run_id'] = 2
+        writ['lease_id'] = 2
+
+        conf = get_test_conf()
+        conf['batch_size'] = 2
+        setup_get_writs_resp([expired_writ, writ])
+        setup_submit_writ_resp(submit_callback)
+        setup_return_writ_resp()
+        Executor(conf)._run()
+
+        # the courthouse sizes the batch by the time allowed each writ
+        self.assertIn("writ_timeout={}".format(conf['writ_timeout']), responses.calls[0].request.url)
+
+        returns = [x.request for x in responses.calls if "/api/return-without-run/" in x.request.url]
+        self.assertEqual(len(returns), 1)
+        self.assertTrue(returns[0].url.endswith("/1"))
+        self.assertEqual(json.loads(returns[0].body.decode("utf-8"))['lease_id'], 3)
+        self.assertEqual(len(submitted), 1)
+        self.assertTrue(submitted[0][0].endswith("/2"))
+        self.assertEqual(submitted[0][1]['lease_id'], 2)
+
+    @responses.activate
+    def test_long_poll(self):
+        setup_get_writ_resp({"status": "unavailable"})
+
+        conf = get_test_conf()
+        conf['long_poll'] = 20
+        writ = Executor(conf).get_writ()
+
+        self.assertIsNone(writ)
+        self.assertIn("wait=20", responses.calls[0].request.url)
+
+    @responses.activate
+    def test_language_lanes(self):
+        setup_get_writ_resp({"status": "unavailable"})
+
+        conf = get_test_conf()
+        conf['languages'] = "python,c"
+        Executor(conf).get_writ()
+
+        self.assertIn("languages=python%2Cc", responses.calls[0].request.url)
+
+    @responses.activate
+    def test_token_auth(self):
+        conf = get_conf()
+        tokens = iter(["first", "second"])
+        responses.add_callback(
+            responses.POST, conf['token_url'],
+            callback=lambda request: (200, {}, json.dumps({"token": next(tokens), "expires_in": 900})),
+        )
+        auth_headers = []
+
+        def get_writ_callback(request):
+            auth_headers.append(request.headers['Authorization'])
+            if request.headers['Authorization'] == "Bearer first" and len(auth_headers) > 1:
+                return (401, {}, "")
+            return (200, {}, json.dumps({"status": "unavailable"}))
+        responses.add_callback(responses.GET, conf['writ_url'], callback=get_writ_callback)
+
+        executor = Executor(conf)
+        executor.get_writ()
+        self.assertEqual(auth_headers, ["Bearer first"])
+
+        # a rejected token is renewed and the request is sent again
+        executor.get_writ()
+        self.assertEqual(auth_headers, ["Bearer first", "Bearer first", "Bearer second"])
+
+    @responses.activate
+    def test_token_auth_unavailable(self):
+        conf = get_conf()
+        responses.add(responses.POST, conf['token_url'], status=404)
+        setup_get_writ_resp({"status": "unavailable"})
+
+        executor = Executor(conf)
+        executor.get_writ()
+        executor.get_writ()
+
+        # basic auth is used, without asking for a token again
+        token_calls = [x for x in responses.calls if x.request.url == conf['token_url']]
+        self.assertEqual(len(token_calls), 1)
+        self.assertTrue(responses.calls[-1].request.headers['Authorization'].startswith("Basic "))
+
 
 if __name__ == '__main__':
     unittest.main()